@@ -1,4 +1,5 @@
 import asyncio
+from contextvars import ContextVar
 from datetime import datetime
 import logging
 import shutil
@@ -29,6 +30,7 @@ if TYPE_CHECKING:
     from agentia.knowledge_base import KnowledgeBase
 
 from .message import *
+from .blobs import BlobStore
 from .history import History
 
 from typing import TYPE_CHECKING
@@ -36,12 +38,24 @@ from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from .tools import ToolInfo, ToolRegistry, Tools
     from .plugins import Plugin
-    from .llm import ModelOptions
+    from .llm import LLMBackend, ModelOptions
+    from .llm.routing import RoutingOptions
+    from .offload import OffloadStore
+    from .llm.cache import CompletionCache
+    from .llm.compaction import CompactionOptions
+    from .offload import ToolResultAging
+    from .session_store import SessionStore
+    from .utils.deadline import Deadline
+    from .utils.render import TerminalRenderer
+    from .llm.usage import Usage, UsageTracker
 
 M = TypeVar("M", AssistantMessage, MessageStream)
 
 _global_cache_dir = None
 
+# The leaders of the communications the current task runs in, from the root down
+_LEADERS: ContextVar[tuple["Agent", ...]] = ContextVar("agentia_leaders", default=())
+
 
 def _get_global_cache_dir() -> Path:
     global _global_cache_dir
@@ -64,6 +78,26 @@ class CommunicationEvent:
     child: "Agent"
     message: str
     response: str | None = None
+    error: str | None = None
+    """Set if the colleague failed to respond, e.g. timed out"""
+    delta: str | None = None
+    """An incremental part of the response, while the colleague is still replying"""
+
+
+@dataclass
+class ColleagueSessions:
+    """How a leader keeps its conversations with colleagues"""
+
+    scope: Literal["leader", "job", "shared"] = "leader"
+    """
+    * `leader`: Each colleague has one isolated session per leader session, reused across jobs.
+    * `job`: Each job starts a new, empty session.
+    * `shared`: All jobs, from all leaders, run in the colleague's own history.
+    """
+    max_turns: int = 8
+    """Number of recent turns (jobs) kept in a reused session"""
+    token_limit: int | None = 32000
+    """Maximum number of tokens sent for inference in a session. Defaults to the colleague's limit if None."""
 
 
 ToolCallEventListener = Callable[[ToolCallEvent], Any]
@@ -91,52 +125,56 @@ class ChatCompletion(Generic[M]):
     def __aiter__(self):
         return self
 
+    async def aclose(self):
+        """
+        Stop the completion early, e.g. when the user presses stop or the client disconnects.
+        The message stream being generated is aborted, and its request is cancelled.
+        """
+        await self.__agen.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc: Any):
+        await self.aclose()
+
     async def messages(self) -> AsyncGenerator[M, None]:
         await self.__agent.init()
-        async for event in self:
-            if isinstance(event, Message) or isinstance(event, MessageStream):
-                yield event
+        try:
+            async for event in self:
+                if isinstance(event, Message) or isinstance(event, MessageStream):
+                    yield event
+        finally:
+            await self.aclose()
 
     async def __await_impl(self) -> str:
         await self.__agent.init()
         last_message = ""
-        async for msg in self.__agen:
-            if isinstance(msg, Message):
-                assert isinstance(msg.content, str)
-                last_message = msg.content
-            if isinstance(msg, MessageStream):
-                last_message = ""
-                async for delta in msg:
-                    last_message += delta
+        try:
+            async for msg in self.__agen:
+                if isinstance(msg, Message):
+                    assert isinstance(msg.content, str)
+                    last_message = msg.content
+                if isinstance(msg, MessageStream):
+                    last_message = (await msg.wait_for_completion()).content or ""
+        finally:
+            await self.aclose()
         return last_message
 
     def __await__(self):
         return self.__await_impl().__await__()
 
-    async def dump(self):
-        await self.__agent.init()
+    async def dump(self, renderer: Optional["TerminalRenderer"] = None):
+        """
+        Print the response to the terminal.
 
-        def print_name_and_icon(name: str, icon: str | None):
-            name_and_icon = f"[{icon} {name}]" if icon else f"[{name}]"
-            rich.print(f"[bold blue]{name_and_icon}[/bold blue]")
-
-        async for msg in self.__agen:
-            if isinstance(msg, Message):
-                print_name_and_icon(self.__agent.name, self.__agent.icon)
-                print(msg.content)
-            if isinstance(msg, MessageStream):
-                name_printed = False
-                outputed = False
-                async for delta in msg:
-                    if delta == "":
-                        continue
-                    if not name_printed:
-                        print_name_and_icon(self.__agent.name, self.__agent.icon)
-                        name_printed = True
-                    outputed = True
-                    print(delta, end="", flush=True)
-                if outputed:
-                    print()
+        :param renderer: Default to a shared plain text renderer.
+        """
+        from agentia.utils.render import TerminalRenderer
+
+        await self.__agent.init()
+        renderer = renderer or TerminalRenderer.default()
+        await renderer.render(self, self.__agent)
 
 
 UserConsentHandler = Callable[[str], bool | Coroutine[Any, Any, bool]]
@@ -149,7 +187,10 @@ class Agent:
         id: str | None = None,
         icon: str | None = None,
         description: str | None = None,
-        model: Annotated[str | None, f"Default to {DEFAULT_MODEL}"] = None,
+        model: Annotated[
+            str | list[str] | None,
+            f"Default to {DEFAULT_MODEL}. A list of models to hedge requests and fail over between them.",
+        ] = None,
         tools: Optional["Tools"] = None,
         options: Optional["ModelOptions"] = None,
         api_key: str | None = None,
@@ -157,8 +198,17 @@ class Agent:
         debug: bool = False,
         colleagues: list["Agent"] | None = None,
         knowledge_base: Union["KnowledgeBase", bool, Path, None] = None,
+        cache: Union["CompletionCache", bool, None] = None,
+        compaction: Union["CompactionOptions", bool, None] = None,
+        tool_result_aging: Union["ToolResultAging", bool, None] = None,
+        colleague_sessions: ColleagueSessions | None = None,
+        max_tool_iterations: int | None = None,
+        routing: Optional["RoutingOptions"] = None,
     ):
-        from .llm import LLMBackend, ModelOptions
+        from .llm import ModelOptions
+        from .llm.cache import CompletionCache
+        from .llm.compaction import CompactionOptions
+        from .offload import ToolResultAging
         from .tools import ToolRegistry
 
         # Init simple fields
@@ -175,21 +225,15 @@ class Agent:
         self.log = MSG_LOGGER.getChild(self.id)
         if debug:
             self.log.setLevel(logging.DEBUG)
-        model = model or DEFAULT_MODEL
-        if ":" in model:
-            provider = model.split(":")[0]
-            model = model.split(":")[1]
-        elif "OPENAI_BASE_URL" in os.environ:
-            provider = "openai"
-        else:
-            provider = "openrouter"
-        assert provider in [
-            "openai",
-            "openrouter",
-            "deepseek",
-        ], f"Unknown provider: {provider}"
+        models = [
+            Agent.__parse_model(m)
+            for m in (model if isinstance(model, list) else [model or DEFAULT_MODEL])
+        ]
+        provider, model = models[0]
         self.description = description
         self.colleagues: dict[str, "Agent"] = {}
+        self.colleague_sessions = colleague_sessions or ColleagueSessions()
+        self.__sessions: dict[str, tuple[History, asyncio.Lock]] = {}
         self.context: Any = None
         self.original_config: Any = None
         self.agent_data_folder = _get_global_cache_dir() / "agents" / f"{self.id}"
@@ -204,7 +248,15 @@ class Agent:
         self.__on_tool_end: Callable[[ToolCallEvent], Any] | None = None
         self.__on_communication_start: Callable[[CommunicationEvent], Any] | None = None
         self.__on_communication_end: Callable[[CommunicationEvent], Any] | None = None
+        self.__on_communication_delta: Callable[[CommunicationEvent], Any] | None = None
         self.__on_client_tool_call: Callable[[str, Any], Any] | None = None
+        # Init history. Instructions are kept stable for prompt caching, and
+        # volatile information is added to the history context instead.
+        self.__history = History(instructions=self.__instructions)
+        # Only keep references to inline images in the history
+        self.__history.enable_blob_store(BlobStore(self.agent_data_folder / "blobs"))
+        self.__uploaded_files: list[str] = []
+        self.__offload_store: Optional["OffloadStore"] = None
         # Init colleagues
         if colleagues is not None and len(colleagues) > 0:
             self.__init_cooperation(colleagues)
@@ -216,40 +268,205 @@ class Agent:
             )
         # Init memory
         self.__init_memory()
-        # Init history and backend
-        self.__history = History(instructions=self.__instructions)
-        if provider == "openai":
-            from .llm.openai import OpenAIBackend
-
-            self.__backend: LLMBackend = OpenAIBackend(
+        # Init backend
+        if len(models) > 1:
+            self.__backend = self.__create_hedged_backend(
+                models, options or ModelOptions(), api_key
+            )
+        else:
+            self.__backend = self.__create_backend(
+                provider=provider,
                 model=model,
                 tools=self.__tools,
                 options=options or ModelOptions(),
                 history=self.__history,
                 api_key=api_key,
             )
-        elif provider == "deepseek":
-            from .llm.deepseek import DeepSeekBackend
+        self.__backend.max_tool_iterations = max_tool_iterations
+        # Init model routing
+        if routing is not None:
+            self.__init_routing(provider, routing, options or ModelOptions(), api_key)
+        # Init completion cache
+        if cache is True:
+            cache = CompletionCache.shared(_get_global_cache_dir() / "completions.db")
+        if isinstance(cache, CompletionCache):
+            self.__backend.cache = cache
+        # Init history compaction
+        if compaction is not None and compaction is not False:
+            self.__init_compaction(
+                provider,
+                compaction if compaction is not True else CompactionOptions(),
+                api_key,
+            )
+        # Init tool result aging
+        if tool_result_aging is not None and tool_result_aging is not False:
+            self.__init_tool_result_aging(
+                tool_result_aging
+                if tool_result_aging is not True
+                else ToolResultAging()
+            )
 
-            self.__backend: LLMBackend = DeepSeekBackend(
+        weakref.finalize(self, Agent.__sweeper, self.session_id)
+
+    @staticmethod
+    def __parse_model(model: str) -> tuple[str, str]:
+        """Split a model name into the provider and the model"""
+        if ":" in model:
+            provider = model.split(":")[0]
+            model = model.split(":")[1]
+        elif "OPENAI_BASE_URL" in os.environ:
+            provider = "openai"
+        else:
+            provider = "openrouter"
+        assert provider in [
+            "openai",
+            "openrouter",
+            "deepseek",
+        ], f"Unknown provider: {provider}"
+        return provider, model
+
+    def __create_hedged_backend(
+        self,
+        models: list[tuple[str, str]],
+        options: "ModelOptions",
+        api_key: str | None,
+    ) -> "LLMBackend":
+        from .llm.hedged import HedgedBackend
+        from .llm.openai import OpenAIBackend
+
+        backends: list[OpenAIBackend] = []
+        for provider, model in models:
+            # Only reuse the api key for the provider of the first model
+            backend = self.__create_backend(
+                provider=provider,
                 model=model,
                 tools=self.__tools,
-                options=options or ModelOptions(),
+                options=options,
                 history=self.__history,
+                api_key=api_key if provider == models[0][0] else None,
+            )
+            assert isinstance(backend, OpenAIBackend)
+            backends.append(backend)
+        return HedgedBackend(backends, self.__tools, options, self.__history)
+
+    def __create_backend(
+        self,
+        provider: str,
+        model: str,
+        tools: "ToolRegistry",
+        options: "ModelOptions",
+        history: History,
+        api_key: str | None,
+    ) -> "LLMBackend":
+        if provider == "openai":
+            from .llm.openai import OpenAIBackend
+
+            return OpenAIBackend(
+                model=model,
+                tools=tools,
+                options=options,
+                history=history,
+                api_key=api_key,
+            )
+        elif provider == "deepseek":
+            from .llm.deepseek import DeepSeekBackend
+
+            return DeepSeekBackend(
+                model=model,
+                tools=tools,
+                options=options,
+                history=history,
                 api_key=api_key,
             )
         else:
             from .llm.openrouter import OpenRouterBackend
 
-            self.__backend: LLMBackend = OpenRouterBackend(
+            return OpenRouterBackend(
                 model=model,
-                tools=self.__tools,
-                options=options or ModelOptions(),
-                history=self.__history,
+                tools=tools,
+                options=options,
+                history=history,
                 api_key=api_key,
             )
 
-        weakref.finalize(self, Agent.__sweeper, self.session_id)
+    def __init_routing(
+        self,
+        provider: str,
+        routing: "RoutingOptions",
+        options: "ModelOptions",
+        api_key: str | None,
+    ):
+        from .llm.routing import ModelRouter
+
+        fast_provider, fast_model = Agent.__parse_model(routing.fast)
+        # Only reuse the api key if the fast model uses the same provider
+        fast = self.__create_backend(
+            provider=fast_provider,
+            model=fast_model,
+            tools=self.__tools,
+            options=options,
+            history=self.__history,
+            api_key=api_key if fast_provider == provider else None,
+        )
+        # Account all requests to this agent
+        fast.usage = self.__backend.usage
+        self.__backend.router = ModelRouter(routing, fast)
+
+    def __init_compaction(
+        self, provider: str, options: "CompactionOptions", api_key: str | None
+    ):
+        from .llm import ModelOptions
+        from .llm.compaction import DEFAULT_SUMMARY_MODELS, Summarizer
+        from .tools import ToolRegistry
+
+        model = options.model or DEFAULT_SUMMARY_MODELS[provider]
+        if ":" in model:
+            summary_provider, model = model.split(":", 1)
+        else:
+            summary_provider = provider
+        # Only reuse the api key if the summarizer uses the same provider
+        backend = self.__create_backend(
+            provider=summary_provider,
+            model=model,
+            tools=ToolRegistry(self),
+            options=ModelOptions(),
+            history=History(instructions=None),
+            api_key=api_key if summary_provider == provider else None,
+        )
+        summarizer = Summarizer(
+            backend, cache_path=self.agent_data_folder / "summaries.db"
+        )
+        self.__history.enable_compaction(
+            summarizer.summarize,
+            threshold=options.threshold,
+            keep_ratio=options.keep_ratio,
+        )
+
+    def __init_tool_result_aging(self, options: "ToolResultAging"):
+        from .decorators import tool
+        from .offload import OffloadStore
+
+        # Moved next to the persisted history by `attach_session_store`
+        store = OffloadStore(self.session_data_folder / "tool-results")
+        self.__offload_store = store
+        self.__history.enable_tool_result_aging(store, options)
+
+        @tool(name="_get_tool_result")
+        def get_tool_result(
+            ref: Annotated[str, "The reference of the offloaded tool result"],
+            offset: Annotated[int, "The character offset to start reading from"] = 0,
+            length: Annotated[int, "The maximum number of characters to read"] = 8000,
+        ):
+            """Read the full content of an earlier tool result that has been offloaded from the conversation"""
+            content = store.get(ref)
+            if content is None:
+                return {"error": f"Tool result not found: {ref}"}
+            end = offset + length
+            if end >= len(content):
+                return content[offset:]
+            return f"{content[offset:end]}\n... ({len(content) - end} more chars, continue from offset={end})"
+
+        self.__tools._add_dispatch_tool(get_tool_result)
 
     @staticmethod
     def __sweeper(session_id: str):
@@ -331,6 +548,14 @@ class Agent:
         self.__on_communication_end = listener
         return listener
 
+    def on_commuication_delta(self, listener: Callable[[CommunicationEvent], Any]):
+        """
+        Fire when a colleague, or a colleague of a colleague, streams a part of its response.
+        Only fired on the agent at the root of the conversation, i.e. the one that was not called by another agent.
+        """
+        self.__on_communication_delta = listener
+        return listener
+
     def on_client_tool_call(self, listener: Callable[[str, Any], Any]):
         """Fire when a client tool call is required"""
         self.__on_client_tool_call = listener
@@ -361,21 +586,133 @@ class Agent:
             if asyncio.iscoroutine(result):
                 await result
 
-        if event.response is None and self.__on_communication_start is not None:
+        if event.delta is not None:
+            # Deltas bubble up to the root, however deep the colleague is
+            leaders = _LEADERS.get()
+            root = leaders[0] if len(leaders) > 0 else self
+            if root.__on_communication_delta is not None:
+                await call_listener(root.__on_communication_delta)
+            return
+        ended = event.response is not None or event.error is not None
+        if not ended and self.__on_communication_start is not None:
             await call_listener(self.__on_communication_start)
-        if event.response is not None and self.__on_communication_end is not None:
+        if ended and self.__on_communication_end is not None:
             await call_listener(self.__on_communication_end)
 
+    async def __communicate(
+        self, target: "Agent", message: str, timeout: float | None = None
+    ) -> str:
+        """Send a message to a colleague and wait for the reply, reporting the progress via `CommunicationEvent`s"""
+        from .utils.tracing import start_span
+
+        leader = self
+        self.log.info(f"COMMUNICATE {leader.name} -> {target.name}: {repr(message)}")
+        options = self.colleague_sessions
+        history, lock = self.__colleague_session(target)
+        cid = uuid.uuid4().hex
+        await self._emit_communication_event(
+            CommunicationEvent(id=cid, parent=leader, child=target, message=message)
+        )
+        last_message = ""
+
+        intro = f"{leader.name} is directly talking to you right now. ({leader.name}: {leader.description})"
+        messages: list[Message] = [UserMessage(message)]
+        if history is None:
+            messages.insert(0, SystemMessage(intro))
+        else:
+            # Sessions only ever talk to this leader
+            history.set_context("leader", intro)
+
+        async def converse():
+            async with lock:
+                await converse_locked()
+                if history is not None and options.scope == "leader":
+                    history.keep_last_turns(options.max_turns)
+
+        async def converse_locked():
+            nonlocal last_message
+            # The reply is aborted if the job is cancelled, e.g. timed out
+            async with target.chat_completion(
+                messages, stream=True, history=history
+            ) as response:
+                async for m in response:
+                    if not isinstance(m, MessageStream):
+                        continue
+                    # Relay the reply as it is generated
+                    async for delta in m.coalesce():
+                        await self._emit_communication_event(
+                            CommunicationEvent(
+                                id=cid,
+                                parent=leader,
+                                child=target,
+                                message=message,
+                                delta=delta,
+                            )
+                        )
+                    content = (await m.wait_for_completion()).content
+                    if content:
+                        self.log.info(
+                            f"RESPONSE {leader.name} <- {target.name}: {repr(content)}"
+                        )
+                        last_message = content
+                        await self._emit_communication_event(
+                            CommunicationEvent(
+                                id=cid,
+                                parent=leader,
+                                child=target,
+                                message=message,
+                                response=content,
+                            )
+                        )
+
+        # Inherited by the colleague's turn, and the communications it starts
+        token = _LEADERS.set(_LEADERS.get() + (leader,))
+        with start_span("agent.communicate", leader=leader.name, colleague=target.name):
+            try:
+                await asyncio.wait_for(converse(), timeout)
+            except asyncio.TimeoutError:
+                self.log.warning(
+                    f"COMMUNICATE {leader.name} -> {target.name}: timed out after {timeout}s"
+                )
+                await self._emit_communication_event(
+                    CommunicationEvent(
+                        id=cid,
+                        parent=leader,
+                        child=target,
+                        message=message,
+                        error=f"Timed out after {timeout} seconds",
+                    )
+                )
+                raise
+            finally:
+                _LEADERS.reset(token)
+        return last_message
+
+    def __colleague_session(
+        self, colleague: "Agent"
+    ) -> tuple[History | None, asyncio.Lock]:
+        """Get the history to talk to a colleague in (None for its own history), and a lock to run one job at a time in it"""
+        options = self.colleague_sessions
+        if options.scope == "job":
+            return colleague.history.new_session(options.token_limit), asyncio.Lock()
+        if options.scope == "shared":
+            return None, asyncio.Lock()
+        if colleague.name not in self.__sessions:
+            history = colleague.history.new_session(options.token_limit)
+            self.__sessions[colleague.name] = (history, asyncio.Lock())
+        return self.__sessions[colleague.name]
+
     def __add_colleague(self, colleague: "Agent"):
         if colleague.name in self.colleagues:
             return
         self.colleagues[colleague.name] = colleague
         # Add a tool to dispatch a job to one colleague
         agent_names = [agent.name for agent in self.colleagues.values()]
-        leader = self
-        description = "Send a message or dispatch a job to a agent, and get the response from them. Note that the agent does not have any context expect what you explicitly told them, so give them the details as precise and as much as possible. Agents cannot contact each other, please coordinate the jobs and information between them properly by yourself when necessary. Here are a list of agents with their description:\n"
+        agent_list = ""
         for agent in self.colleagues.values():
-            description += f" * {agent.name}: {agent.description}\n"
+            agent_list += f" * {agent.name}: {agent.description}\n"
+        description = "Send a message or dispatch a job to a agent, and get the response from them. Note that the agent does not have any context expect what you explicitly told them, so give them the details as precise and as much as possible. Agents cannot contact each other, please coordinate the jobs and information between them properly by yourself when necessary. Here are a list of agents with their description:\n"
+        description += agent_list
 
         from .decorators import tool
 
@@ -389,41 +726,42 @@ class Agent:
                 str, "The message to send to the agent, or the job details."
             ],
         ):
-            self.log.info(f"COMMUNICATE {leader.name} -> {agent}: {repr(message)}")
+            return await self.__communicate(self.colleagues[agent], message)
 
-            target = self.colleagues[agent]
-            cid = uuid.uuid4().hex
-            await self._emit_communication_event(
-                CommunicationEvent(id=cid, parent=leader, child=target, message=message)
-            )
-            response = target.chat_completion(
-                [
-                    SystemMessage(
-                        f"{leader.name} is directly talking to you right now. ({leader.name}: {leader.description})",
-                    ),
-                    UserMessage(message),
-                ]
-            )
-            last_message = ""
-            async for m in response:
-                if isinstance(m, Message):
-                    self.log.info(
-                        f"RESPONSE {leader.name} <- {agent}: {repr(m.content)}"
-                    )
-                    # results.append(m.to_json())
-                    last_message = m.content
-                    await self._emit_communication_event(
-                        CommunicationEvent(
-                            id=cid,
-                            parent=leader,
-                            child=target,
-                            message=message,
-                            response=m.content,
-                        )
+        self.__tools._add_dispatch_tool(communiate)
+
+        # Add a tool to dispatch distinct jobs to several colleagues at once
+        description = "Dispatch jobs to multiple agents at the same time, and get all their responses. The agents work on their jobs concurrently, so prefer this over sending the jobs one by one when the jobs are independent of each other. Each agent does not have any context expect what you explicitly told them, so give them the details as precise and as much as possible. Here are a list of agents with their description:\n"
+        description += agent_list
+
+        @tool(name="_communiate_all", description=description)
+        async def communiate_all(
+            jobs: Annotated[
+                dict[str, str],
+                f"A mapping from agent names to the messages or job details to send to them. Agent names must be among: {', '.join(agent_names)}.",
+            ],
+            timeout: Annotated[
+                int | None,
+                "The maximum number of seconds to wait for each agent. Agents that do not respond in time are reported as timed out. Defaults to 600.",
+            ] = None,
+        ):
+            seconds = timeout or 600
+
+            async def dispatch(name: str, message: str) -> Any:
+                if name not in self.colleagues:
+                    return {"error": f"Unknown agent: {name}"}
+                try:
+                    return await self.__communicate(
+                        self.colleagues[name], message, timeout=seconds
                     )
-            return last_message
+                except asyncio.TimeoutError:
+                    return {"error": f"No response within {seconds} seconds"}
 
-        self.__tools._add_dispatch_tool(communiate)
+            names = list(jobs.keys())
+            results = await asyncio.gather(*(dispatch(n, jobs[n]) for n in names))
+            return dict(zip(names, results))
+
+        self.__tools._add_dispatch_tool(communiate_all)
 
     def __init_cooperation(self, colleagues: list["Agent"]):
         # Leader can dispatch jobs to colleagues
@@ -457,14 +795,11 @@ class Agent:
                 global_store=self.agent_data_folder / "knowledge-base",
                 session_store=session_store,
             )
-        # Update instructions
+        # Update context
         global_vector_store = knowledge_base.vector_stores["global"]
         if len(global_vector_store.initial_files or []) > 0:
             files = global_vector_store.initial_files or []
-            if self.__instructions is not None:
-                self.__instructions += f"\n\nFILES: {', '.join(files)}"
-            else:
-                self.__instructions = f"FILES: {', '.join(files)}"
+            self.__history.set_context("files", f"FILES: {', '.join(files)}")
 
         # File search tool
 
@@ -472,7 +807,7 @@ class Agent:
 
         from .decorators import tool
 
-        @tool(name="_file_search")
+        @tool(name="_file_search", pure=True)
         async def file_search(
             query: Annotated[str, "The query to search for files"],
             filename: Annotated[
@@ -505,45 +840,85 @@ class Agent:
         if len(content) == 0:
             return
 
-        if self.__instructions is None:
-            self.__instructions = f"YOUR PREVIOUS MEMORY: \n{content}"
-        else:
-            self.__instructions += f"\n\nYOUR PREVIOUS MEMORY: \n{content}"
+        self.__history.set_context("memory", f"YOUR PREVIOUS MEMORY: \n{content}")
 
     def reset(self):
         self.history.reset()
 
+    def attach_session_store(
+        self, store: "SessionStore", session: str | None = None, resume: bool = True
+    ):
+        """
+        Persist the conversation to `store` as messages are added.
+        If the session already exists in the store, it is resumed.
+
+        :param session: The session ID. Default to the ID of the current session.
+        """
+        session = session or self.session_id
+        if self.__offload_store is not None:
+            # Offloaded tool results live as long as the session, not the process
+            self.__offload_store.move(
+                self.agent_data_folder / "tool-results" / slugify(session)
+            )
+        self.__history.attach_store(store, session, resume=resume)
+
+    def delete_session(self):
+        """Delete the persisted session (see `attach_session_store`), with its offloaded tool results, and start a new conversation"""
+        self.__history.delete_stored_session()
+
     def get_plugin(self, name: str) -> Optional["Plugin"]:
         return self.__tools.get_plugin(name)
 
     @overload
     def chat_completion(
-        self, messages: Sequence[Message] | str, stream: Literal[False] = False
+        self,
+        messages: Sequence[Message] | str,
+        stream: Literal[False] = False,
+        history: History | None = None,
+        deadline: Union["Deadline", float, None] = None,
     ) -> ChatCompletion[AssistantMessage]: ...
 
     @overload
     def chat_completion(
-        self, messages: Sequence[Message] | str, stream: Literal[True]
+        self,
+        messages: Sequence[Message] | str,
+        stream: Literal[True],
+        history: History | None = None,
+        deadline: Union["Deadline", float, None] = None,
     ) -> ChatCompletion[MessageStream]: ...
 
     def chat_completion(
         self,
         messages: Sequence[Message] | str,
         stream: bool = False,
+        history: History | None = None,
+        deadline: Union["Deadline", float, None] = None,
     ) -> ChatCompletion[MessageStream] | ChatCompletion[AssistantMessage]:
+        """
+        :param history: Run the turn in this history instead of the agent's own history. See `History.new_session`.
+        :param deadline: A `Deadline`, or a timeout in seconds. Once it expires, provider requests, tools and colleagues are cancelled,
+            and the turn ends with the partial result. Call `Deadline.cancel()` to stop the turn early.
+        """
+        from .utils.deadline import Deadline
+
         if isinstance(messages, str):
             messages = [UserMessage(messages)]
+        if isinstance(deadline, (int, float)):
+            deadline = Deadline(deadline)
         self.__load_files(messages)
         if stream:
-            return self.__backend.chat_completion(messages, stream=True)
+            return self.__backend.chat_completion(
+                messages, stream=True, history=history, deadline=deadline
+            )
         else:
-            return self.__backend.chat_completion(messages, stream=False)
+            return self.__backend.chat_completion(
+                messages, stream=False, history=history, deadline=deadline
+            )
 
     def __load_files(self, messages: Sequence[Message]):
-        old_messages = [m for m in messages]
-        messages = []
         files: list[BytesIO] = []
-        for m in old_messages:
+        all_filenames: list[str] = []
+        for m in messages:
             if isinstance(m, UserMessage) and m.files:
                 filenames = []
                 for file in m.files:
@@ -569,15 +944,18 @@ class Agent:
                         f = BytesIO(file.getvalue().encode())
                         f.name = f.name
                         files.append(f)
-                messages.append(
-                    SystemMessage(f"UPLOADED-FILES: {', '.join(filenames)}")
-                )
-            messages.append(m)
+                all_filenames.extend(filenames)
         if len(files) == 0:
             return
         if self.knowledge_base is None:
             raise ValueError("Knowledge base is disabled.")
         self.knowledge_base.add_temporary_documents(files)
+        # List uploaded files in the context, rather than inserting system messages
+        # in the middle of the history
+        self.__uploaded_files.extend(all_filenames)
+        self.__history.set_context(
+            "uploaded-files", f"UPLOADED-FILES: {', '.join(self.__uploaded_files)}"
+        )
 
     @property
     def history(self) -> History:
@@ -591,6 +969,20 @@ class Agent:
     def tools(self) -> "ToolRegistry":
         return self.__backend.tools
 
+    @property
+    def usage(self) -> "UsageTracker":
+        """Token usage of this agent in the current session"""
+        return self.__backend.usage
+
+    def total_usage(self) -> "Usage":
+        """Token usage of this agent and all its colleagues, recursively"""
+        from .llm.usage import Usage
+
+        total = Usage()
+        for agent in self.all_agents():
+            total = total + agent.usage.totals
+        return total
+
     def all_agents(self) -> set["Agent"]:
         agents = set()
         agents.add(self)
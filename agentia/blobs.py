@@ -0,0 +1,173 @@
+import base64
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+from pathlib import Path
+import threading
+
+LOGGER = logging.getLogger("agentia.blobs")
+
+BLOB_URL_PREFIX = "blob:"
+
+MISSING_BLOB_PLACEHOLDER = "[image no longer available]"
+
+
+def is_blob_url(url: str) -> bool:
+    return url.startswith(BLOB_URL_PREFIX)
+
+
+def parse_data_url(url: str) -> tuple[str, bytes] | None:
+    """Parse a base64 `data:` URL into its MIME type and content"""
+    if not url.startswith("data:") or "," not in url:
+        return None
+    header, data = url[5:].split(",", 1)
+    if not header.endswith(";base64"):
+        return None
+    mime = header.removesuffix(";base64") or "application/octet-stream"
+    return mime, base64.b64decode(data)
+
+
+class BlobStore:
+    def __init__(self, path: Path | None = None, max_bytes: int = 1 << 30):
+        """
+        Content-addressed store of binary content parts (e.g. images), so that the history only keeps short `blob:` URLs.
+
+        :param path: Directory to keep the blobs in. Blobs are kept in memory if not provided.
+        :param max_bytes: Maximum total size of the blobs on disk. The least recently used blobs are removed first,
+            but blobs pinned by a history (see `pin`) are never removed.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.__memory: dict[str, bytes] = {}
+        self.__lock = threading.Lock()
+        # Total size of the blobs on disk. Scanned on the first write.
+        self.__size: int | None = None
+        # Blobs referenced by each live history
+        self.__pins: dict[str, set[str]] = {}
+        # Recently materialized data URLs, as the same images are sent with every request of a turn
+        self.__data_urls: OrderedDict[str, str] = OrderedDict()
+
+    def put(self, data: bytes, mime: str) -> str:
+        """Store the content and return its `blob:` URL"""
+        digest = hashlib.sha256(data).hexdigest()
+        with self.__lock:
+            if self.path is None:
+                self.__memory[digest] = data
+            else:
+                file = self.path / digest
+                if not file.exists():
+                    self.path.mkdir(parents=True, exist_ok=True)
+                    size = self.__disk_size()
+                    tmp = file.with_suffix(".tmp")
+                    tmp.write_bytes(data)
+                    os.replace(tmp, file)
+                    self.__size = size + len(data)
+                    if self.__size > self.max_bytes:
+                        self.__evict(keep=digest)
+        return f"{BLOB_URL_PREFIX}{mime}:{digest}"
+
+    def pin(self, owner: str, url: str, durable: bool = False):
+        """
+        Keep a blob as long as `owner` (e.g. a history) references it.
+
+        :param durable: Also keep the pin on disk, e.g. for persisted sessions that can be resumed by another process.
+        """
+        digest = _digest(url)
+        with self.__lock:
+            pins = self.__pins.setdefault(owner, set())
+            if digest in pins:
+                return
+            pins.add(digest)
+            if durable and self.path is not None:
+                file = self.__pin_file(owner)
+                file.parent.mkdir(parents=True, exist_ok=True)
+                with open(file, "a") as f:
+                    f.write(digest + "\n")
+
+    def unpin_all(self, owner: str):
+        """Release all blobs pinned by `owner`"""
+        with self.__lock:
+            self.__pins.pop(owner, None)
+            if self.path is not None:
+                self.__pin_file(owner).unlink(missing_ok=True)
+
+    def __pin_file(self, owner: str) -> Path:
+        assert self.path is not None
+        return self.path / "pins" / hashlib.sha256(owner.encode()).hexdigest()
+
+    def put_data_url(self, url: str) -> str:
+        """Move the content of a base64 `data:` URL to the store. Other URLs are returned as-is."""
+        parsed = parse_data_url(url)
+        if parsed is None:
+            return url
+        mime, data = parsed
+        return self.put(data, mime)
+
+    def get(self, url: str) -> tuple[str, bytes] | None:
+        """Get the MIME type and content of a `blob:` URL"""
+        mime, digest = url.removeprefix(BLOB_URL_PREFIX).rsplit(":", 1)
+        with self.__lock:
+            if self.path is None:
+                data = self.__memory.get(digest)
+                return (mime, data) if data is not None else None
+            file = self.path / digest
+            if not digest.isalnum() or not file.exists():
+                return None
+            file.touch()
+            return mime, file.read_bytes()
+
+    def materialize(self, url: str) -> str | None:
+        """Convert a `blob:` URL back to a `data:` URL, for sending to the provider. Returns None if the blob is gone."""
+        if not is_blob_url(url):
+            return url
+        if (data_url := self.__data_urls.get(url)) is not None:
+            self.__data_urls.move_to_end(url)
+            return data_url
+        blob = self.get(url)
+        if blob is None:
+            LOGGER.warning(f"Blob not found: {url}")
+            return None
+        mime, data = blob
+        data_url = f"data:{mime};base64,{base64.b64encode(data).decode()}"
+        self.__data_urls[url] = data_url
+        if len(self.__data_urls) > 8:
+            self.__data_urls.popitem(last=False)
+        return data_url
+
+    def __disk_size(self) -> int:
+        assert self.path is not None
+        if self.__size is None:
+            self.__size = sum(
+                f.stat().st_size for f in self.path.iterdir() if f.is_file()
+            )
+        return self.__size
+
+    def __pinned(self) -> set[str]:
+        assert self.path is not None
+        pinned = set().union(*self.__pins.values())
+        pins_dir = self.path / "pins"
+        if pins_dir.exists():
+            for file in pins_dir.iterdir():
+                pinned.update(file.read_text().split())
+        return pinned
+
+    def __evict(self, keep: str):
+        assert self.path is not None and self.__size is not None
+        pinned = self.__pinned() | {keep}
+        files = [
+            (f, f.stat())
+            for f in self.path.iterdir()
+            if f.is_file() and f.name not in pinned
+        ]
+        for f, s in sorted(files, key=lambda x: x[1].st_mtime):
+            f.unlink(missing_ok=True)
+            self.__size -= s.st_size
+            for url in [u for u in self.__data_urls if _digest(u) == f.name]:
+                del self.__data_urls[url]
+            if self.__size <= self.max_bytes:
+                break
+
+
+def _digest(url: str) -> str:
+    return url.removeprefix(BLOB_URL_PREFIX).rsplit(":", 1)[1]
@@ -9,7 +9,6 @@ from typing import (
 
 from agentia.message import JSON
 
-
 R = TypeVar("R", Coroutine[Any, Any, Optional[JSON | str]], Optional[JSON | str])
 
 
@@ -22,6 +21,11 @@ def tool(
     name: str | None = None,
     display_name: str | None = None,
     description: str | None = None,
+    pure: bool = False,
+    cache: bool = False,
+    cache_ttl: float | None = None,
+    cache_max_size: int = 1024,
+    cache_on_disk: bool = False,
 ) -> Callable[..., Callable[..., R]]: ...
 
 
@@ -29,7 +33,25 @@ def tool(
     name: str | Callable[..., R] | None = None,
     display_name: str | None = None,
     description: str | None = None,
+    pure: bool = False,
+    cache: bool = False,
+    cache_ttl: float | None = None,
+    cache_max_size: int = 1024,
+    cache_on_disk: bool = False,
 ) -> Callable[..., R] | Callable[[Callable[..., R]], Callable[..., R]]:
+    """
+    Mark a function as a tool.
+
+    :param name: Optional tool name. Default to the function name.
+    :param display_name: Optional human readable name of the tool.
+    :param description: Optional tool description. Default to the function docstring.
+    :param pure: Whether the tool always returns the same result for the same arguments.
+        Concurrent calls to a pure tool with identical arguments share a single invocation.
+    :param cache: Whether to memoize the results of the tool. Implies `pure`.
+    :param cache_ttl: Optional time-to-live of the memoized results, in seconds.
+    :param cache_max_size: Maximum number of results kept in memory.
+    :param cache_on_disk: Whether to also persist the results under the agent data folder, to share them across sessions.
+    """
 
     def __tool_impl(callable: Callable[..., R]) -> Callable[..., R]:
         # store gpt function metadata to the callable object
@@ -38,6 +60,9 @@ def tool(
             NAME_TAG,
             DISPLAY_NAME_TAG,
             DESCRIPTION_TAG,
+            PURE_TAG,
+            CACHE_TAG,
+            ToolCacheOptions,
         )
 
         if isinstance(name, str):
@@ -49,6 +74,15 @@ def tool(
         if isinstance(description, str):
             setattr(callable, DESCRIPTION_TAG, description)
 
+        if pure or cache:
+            setattr(callable, PURE_TAG, True)
+
+        if cache:
+            options = ToolCacheOptions(
+                ttl=cache_ttl, max_size=cache_max_size, on_disk=cache_on_disk
+            )
+            setattr(callable, CACHE_TAG, options)
+
         setattr(callable, IS_TOOL_TAG, True)
 
         return callable
@@ -58,6 +92,8 @@ def tool(
         and (not isinstance(name, str))
         and display_name is None
         and description is None
+        and not pure
+        and not cache
     ):
         return __tool_impl(name)
 
@@ -1,93 +1,551 @@
-from typing import Any
+import asyncio
+import dataclasses
+import weakref
+from typing import TYPE_CHECKING, Any, Awaitable, Callable
 
 import tiktoken
-from .message import BaseMessage, Message, SystemMessage
+from .blobs import BlobStore, is_blob_url
+from .message import (
+    BaseMessage,
+    ContentPartImage,
+    ContentPartText,
+    Message,
+    SystemMessage,
+    ToolMessage,
+    UserMessage,
+)
+from .offload import (
+    OFFLOADED_PREFIX,
+    OffloadStore,
+    ToolResultAging,
+    offloaded_content,
+)
+
+if TYPE_CHECKING:
+    from .session_store import SessionStore
 
 ENCODING = tiktoken.encoding_for_model("gpt-4o-mini")
 
+DEFAULT_TOKEN_LIMIT = 120000
+
 
 class History:
-    def __init__(self, instructions: str | None) -> None:
+    def __init__(
+        self,
+        instructions: str | None,
+        token_limit: int = DEFAULT_TOKEN_LIMIT,
+        trim_ratio: float = 0.75,
+    ) -> None:
+        """
+        The conversation history of an agent.
+
+        Requests are laid out to maximize provider-side prefix caching:
+        the instructions and the conversation form a stable prefix, and volatile context
+        (see `set_context`) is sent as a system message at the end of each request.
+
+        :param instructions: The system instructions, sent as the first message.
+        :param token_limit: Maximum number of tokens sent for inference.
+        :param trim_ratio: When the limit is exceeded, the oldest turns are dropped until the history fits in `token_limit * trim_ratio` tokens.
+            The remaining history then stays stable until the limit is exceeded again.
+        """
         self._instructions = instructions
+        self.token_limit = token_limit
+        self.trim_ratio = trim_ratio
         self.__messages: list[Message] = []
+        self.__context: dict[str, str] = {}
+        self.__context_message: SystemMessage | None = None
+        self.__token_counts: dict[int, tuple[Message, int]] = {}
+        self.__trim_start = 0
+        self.__last_request: list[Message] = []
+        self.prefix_stability: float | None = None
+        """Fraction of the tokens of the last request that are a prefix of the previous request"""
+        self.__summarize: Summarize | None = None
+        self.__compaction_threshold = 0
+        self.__compaction_keep = 0
+        self.__compaction_task: asyncio.Task[None] | None = None
+        self.__offload_store: OffloadStore | None = None
+        self.__aging = ToolResultAging()
+        self.__blobs: BlobStore | None = None
+        self.__drop_images_after: int | None = None
+        self.__store: "SessionStore | None" = None
+        self.__session = ""
+        # When a session is resumed, only the leading system messages (instructions and summaries)
+        # and the recent messages are loaded. `__hidden` messages after the first `__pinned` ones are not loaded yet.
+        self.__pinned = 0
+        self.__hidden = 0
+        self.reset()
+
+    def attach_store(self, store: "SessionStore", session: str, resume: bool = True):
+        """
+        Persist the history to `store`: each message is written as it is added.
+
+        :param session: The session ID.
+        :param resume: If the session already exists in the store, replace the current history with it.
+            Only the recent messages needed for inference are loaded. Older messages are loaded on demand.
+        """
+        if self.__blobs is not None:
+            self.__blobs.unpin_all(self.__blob_owner())
+        self.__store = store
+        self.__session = session
+        if resume and store.length(session) > 0:
+            self.__resume()
+            # Blobs of older messages are still pinned by the previous process
+            if self.__blobs is not None:
+                self.__pin_blobs(self.__messages)
+        else:
+            self.__persist_from(0)
+            self.__repin_blobs()
+
+    def delete_stored_session(self):
+        """Delete the persisted session together with its offloaded tool results and blob pins, and start over"""
+        if self.__store is None:
+            return
+        self.__store.delete(self.__session)
+        if self.__blobs is not None:
+            self.__blobs.unpin_all(self.__blob_owner())
+        if self.__offload_store is not None:
+            self.__offload_store.clear()
+        self.__store = None
+        self.__session = ""
         self.reset()
 
+    def enable_tool_result_aging(self, store: OffloadStore, options: ToolResultAging):
+        """
+        Replace old tool results with a short head and a reference, once they are older than
+        `options.max_age` turns, or once all tool results exceed `options.max_tokens`.
+        The full results are kept in `store`.
+
+        Tool results are only aged when a new turn starts, so the prompt prefix changes at most once per turn.
+        """
+        self.__offload_store = store
+        self.__aging = options
+
+    def enable_blob_store(self, store: BlobStore, drop_images_after: int | None = None):
+        """
+        Move inline (`data:` URL) images of user messages to `store`, and only keep their `blob:` URLs in the history.
+        Images are materialized again when the provider request is built (see `materialize_url`).
+        Files attached to user messages are not kept in the history either, as they are loaded to the knowledge base.
+
+        :param drop_images_after: Replace images older than this number of turns with a short placeholder.
+        """
+        self.__blobs = store
+        self.__drop_images_after = drop_images_after
+        # Blobs of persisted sessions stay pinned until the session is reset
+        weakref.finalize(self, store.unpin_all, f"history:{id(self)}")
+
+    def materialize_url(self, url: str) -> str | None:
+        """Convert a `blob:` URL in the history back to a `data:` URL. Returns None if the blob is no longer available."""
+        if not is_blob_url(url):
+            return url
+        if self.__blobs is None:
+            raise ValueError(f"No blob store to materialize {url}")
+        return self.__blobs.materialize(url)
+
+    def __blob_owner(self) -> str:
+        if self.__store is not None:
+            return f"session:{self.__session}"
+        return f"history:{id(self)}"
+
+    def __pin_blobs(self, messages: list[Message]):
+        assert self.__blobs is not None
+        for m in messages:
+            if isinstance(m, UserMessage) and not isinstance(m.content, str):
+                for p in m.content:
+                    if isinstance(p, ContentPartImage) and is_blob_url(p.url):
+                        self.__blobs.pin(
+                            self.__blob_owner(), p.url, durable=self.__store is not None
+                        )
+
+    def __repin_blobs(self):
+        """Only keep the blobs that are still referenced by the history"""
+        if self.__blobs is None:
+            return
+        self.__blobs.unpin_all(self.__blob_owner())
+        self.__pin_blobs(self.__messages)
+
+    def enable_compaction(
+        self, summarize: "Summarize", threshold: int, keep_ratio: float = 0.5
+    ):
+        """
+        Compact the history in the background once it grows beyond `threshold` tokens:
+        the oldest turns are replaced by a summary message, and only the most recent turns
+        (up to `threshold * keep_ratio` tokens) are kept verbatim.
+
+        :param summarize: Summarize a span of whole turns into a message. May return None on failure.
+        """
+        self.__summarize = summarize
+        self.__compaction_threshold = threshold
+        self.__compaction_keep = int(threshold * keep_ratio)
+
+    async def wait_for_compaction(self):
+        """Wait for the running background compaction, if any"""
+        if self.__compaction_task is not None:
+            await asyncio.shield(self.__compaction_task)
+
+    def new_session(self, token_limit: int | None = None) -> "History":
+        """
+        Create an empty history with the same instructions, context and storage options,
+        e.g. for an isolated conversation with the same agent. The new history is not persisted.
+        """
+        h = History(
+            self._instructions,
+            token_limit=token_limit or self.token_limit,
+            trim_ratio=self.trim_ratio,
+        )
+        h.__context = dict(self.__context)
+        h.__offload_store = self.__offload_store
+        h.__aging = self.__aging
+        if self.__blobs is not None:
+            # Also releases the pins of the new history once it is dropped
+            h.enable_blob_store(self.__blobs, self.__drop_images_after)
+        h.__summarize = self.__summarize
+        h.__compaction_threshold = self.__compaction_threshold
+        h.__compaction_keep = self.__compaction_keep
+        return h
+
+    def keep_last_turns(self, turns: int):
+        """Drop all but the leading system message and the last `turns` turns"""
+        self.__load_hidden()
+        head = self.__head()
+        blocks = self.__blocks(self.__messages[len(head) :])
+        if len(blocks) <= turns:
+            return
+        kept = [m for block in blocks[len(blocks) - turns :] for m in block]
+        self.set_messages(head + kept)
+
     def get_for_inference(self, keep_last=0) -> list[Message]:
         """
         Get the recent messages for inference
         """
-        messages = History.__trim(self.__messages, keep_last=keep_last)
+        messages = self.__trim(keep_last=keep_last)
+        if context := self.__get_context_message():
+            messages.append(context)
+        self.__update_prefix_stability(messages)
         return messages
 
     def reset(self):
         self.__messages = []
+        self.__token_counts = {}
+        self.__trim_start = 0
+        self.__pinned = self.__hidden = 0
+        if self.__store is not None:
+            self.__store.truncate(self.__session, 0)
+        self.__repin_blobs()
         if self._instructions is not None:
             self.add(SystemMessage(self._instructions))
 
     def add(self, message: Message):
-        # TODO: auto trim history
+        if isinstance(message, UserMessage):
+            # A new turn starts
+            if self.__offload_store is not None:
+                self.__age_tool_results()
+            if self.__drop_images_after is not None:
+                self.__drop_images()
+            if self.__blobs is not None:
+                message = self.__offload_content_parts(message)
         self.__messages.append(message)
+        if self.__store is not None:
+            index = self.__global_index(len(self.__messages) - 1)
+            self.__store.write(self.__session, index, message.to_json())
+        if self.__summarize is not None:
+            self.__maybe_compact()
 
     def set_messages(self, messages: list[Message]):
         self.__messages = messages
+        self.__token_counts = {}
+        self.__trim_start = 0
+        self.__pinned = self.__hidden = 0
+        self.__persist_from(0)
+        self.__repin_blobs()
 
     def get_messages(self) -> list[Message]:
+        self.__load_hidden()
         return self.__messages
 
     def get_raw_messages(self) -> Any:
-        return [m.to_json() for m in self.__messages]
+        return [m.to_json() for m in self.get_messages()]
 
     def set_raw_messages(self, data: Any):
-        self.__messages = [BaseMessage.from_json(m) for m in data]
+        self.set_messages([BaseMessage.from_json(m) for m in data])
+
+    def set_context(self, key: str, content: str | None):
+        """
+        Set (or remove, if `content` is None) a block of volatile context, e.g. file lists or memories.
+        Context is sent at the end of each request instead of in the instructions, so that changes do not invalidate the cached prompt prefix.
+        """
+        if content is None:
+            self.__context.pop(key, None)
+        else:
+            self.__context[key] = content
+        self.__context_message = None
+
+    def get_context(self, key: str) -> str | None:
+        return self.__context.get(key)
 
-    @staticmethod
-    def __trim(
-        msgs: list[Message], token_limit: int = 120000, keep_first=0, keep_last=0
-    ) -> list[Message]:
-        from .message import ContentPartText
+    def __get_context_message(self) -> SystemMessage | None:
+        if len(self.__context) == 0:
+            return None
+        if self.__context_message is None:
+            self.__context_message = SystemMessage("\n\n".join(self.__context.values()))
+        return self.__context_message
 
-        first_system_message = None
+    def count_tokens(self, m: Message) -> int:
+        entry = self.__token_counts.get(id(m))
+        if entry is not None and entry[0] is m:
+            return entry[1]
+        tokens = _count_tokens(m)
+        self.__token_counts[id(m)] = (m, tokens)
+        return tokens
+
+    def __blocks(self, msgs: list[Message]) -> list[list[Message]]:
+        """Split messages into turns. Each turn starts with a user message, so tool calls and results are never separated."""
+        blocks: list[list[Message]] = []
+        for m in msgs:
+            if len(blocks) == 0 or isinstance(m, UserMessage):
+                blocks.append([])
+            blocks[-1].append(m)
+        return blocks
+
+    def __trim(self, keep_last=0) -> list[Message]:
+        msgs = self.__messages
+        head = self.__head()
+        body_start = len(head)
+        tail_start = max(len(msgs) - keep_last, body_start)
+        # Only drop whole turns from the front, and only when the limit is exceeded
+        start = max(self.__trim_start, body_start)
+        if start > tail_start:
+            start = tail_start
+        tokens = sum(self.count_tokens(m) for m in head)
+        tokens += sum(self.count_tokens(m) for m in msgs[start:])
+        if tokens > self.token_limit:
+            target = int(self.token_limit * self.trim_ratio)
+            for block in self.__blocks(msgs[start:tail_start]):
+                if tokens <= target:
+                    break
+                tokens -= sum(self.count_tokens(m) for m in block)
+                start += len(block)
+            self.__trim_start = start
+        return head + msgs[start:]
+
+    def __head(self) -> list[Message]:
+        msgs = self.__messages
         if len(msgs) > 0 and isinstance(msgs[0], SystemMessage):
-            first_system_message = msgs[0]
-            other_messages = msgs[1:]
-            if keep_first > 0:
-                keep_first -= 1
-        else:
-            other_messages = msgs
-        head_msgs = []
-        if keep_first > 0:
-            head_msgs = other_messages[:keep_first]
-            other_messages = other_messages[keep_first:]
-        tail_msgs = []
-        if keep_last > 0:
-            tail_msgs = other_messages[-keep_last:]
-            other_messages = other_messages[:-keep_last]
-
-        def count_tokens(m: Message) -> int:
-            if isinstance(m.content, str):
-                return len(ENCODING.encode(m.content))
-            elif isinstance(m.content, list):
-                tokens = 0
-                for part in m.content:
-                    if isinstance(part, ContentPartText):
-                        tokens += len(ENCODING.encode(part.content))
-                return tokens
-            return 0
-
-        msgs2 = []
+            return [msgs[0]]
+        return []
+
+    def __global_index(self, i: int) -> int:
+        return i if i < self.__pinned else i + self.__hidden
+
+    def __persist_from(self, start: int):
+        """Rewrite the stored messages from the local index `start` onwards"""
+        if self.__store is None:
+            return
+        self.__store.truncate(self.__session, self.__global_index(start))
+        for i in range(start, len(self.__messages)):
+            m = self.__messages[i]
+            self.__store.write(self.__session, self.__global_index(i), m.to_json())
+
+    def __resume(self):
+        assert self.__store is not None
+        store, session = self.__store, self.__session
+        length = store.length(session)
+        pinned: list[Message] = []
+        while len(pinned) < length:
+            m = BaseMessage.from_json(
+                store.read(session, len(pinned), len(pinned) + 1)[0]
+            )
+            if not isinstance(m, SystemMessage):
+                break
+            pinned.append(m)
+        # Load whole turns from the end, until the token limit is reached
+        tail: list[Message] = []
         tokens = 0
-        if first_system_message is not None:
-            msgs2.append(first_system_message)
-            tokens += count_tokens(first_system_message)
-        for m in head_msgs:
-            msgs2.append(m)
-            tokens += count_tokens(m)
-        for m in tail_msgs:
-            tokens += count_tokens(m)
-        for m in other_messages:
-            tokens += count_tokens(m)
-            if tokens > token_limit:
+        for i, data in store.read_reversed(session):
+            if i < len(pinned):
                 break
-            msgs2.append(m)
-        msgs2.extend(tail_msgs)
-        return msgs2
+            m = BaseMessage.from_json(data)
+            tail.append(m)
+            tokens += self.count_tokens(m)
+            if isinstance(m, UserMessage) and tokens >= self.token_limit:
+                break
+        tail.reverse()
+        self.__messages = pinned + tail
+        self.__token_counts = {}
+        self.__trim_start = 0
+        self.__pinned = len(pinned)
+        self.__hidden = length - len(pinned) - len(tail)
+
+    def __load_hidden(self):
+        if self.__hidden == 0:
+            return
+        assert self.__store is not None
+        start = self.__pinned
+        data = self.__store.read(self.__session, start, start + self.__hidden)
+        self.__messages[start:start] = [BaseMessage.from_json(m) for m in data]
+        if self.__trim_start >= start:
+            self.__trim_start += len(data)
+        self.__pinned = self.__hidden = 0
+
+    def __offload_content_parts(self, m: UserMessage) -> UserMessage:
+        assert self.__blobs is not None
+        if isinstance(m.content, str) and len(m.files) == 0:
+            return m
+        content = m.content
+        if not isinstance(content, str):
+            content = [
+                (
+                    ContentPartImage(self.__blobs.put_data_url(p.url))
+                    if isinstance(p, ContentPartImage)
+                    else p
+                )
+                for p in content
+            ]
+        m = dataclasses.replace(m, content=content, files=[])
+        self.__pin_blobs([m])
+        return m
+
+    def __drop_images(self):
+        assert self.__drop_images_after is not None
+        msgs = self.__messages
+        age = 0
+        for i in range(len(msgs) - 1, len(self.__head()) - 1, -1):
+            m = msgs[i]
+            if not isinstance(m, UserMessage):
+                continue
+            age += 1
+            if age <= self.__drop_images_after or isinstance(m.content, str):
+                continue
+            if not any(isinstance(p, ContentPartImage) for p in m.content):
+                continue
+            content = [
+                (
+                    ContentPartText(
+                        "[image omitted]"
+                        if p.url.startswith("data:")
+                        else f"[image omitted: {p.url}]"
+                    )
+                    if isinstance(p, ContentPartImage)
+                    else p
+                )
+                for p in m.content
+            ]
+            msgs[i] = dataclasses.replace(m, content=content)
+            if self.__store is not None:
+                self.__store.write(
+                    self.__session, self.__global_index(i), msgs[i].to_json()
+                )
+
+    def __age_tool_results(self):
+        assert self.__offload_store is not None
+        options = self.__aging
+        msgs = self.__messages
+        age = 0
+        tool_tokens = 0
+        # Walk from the newest turn to the oldest
+        for i in range(len(msgs) - 1, len(self.__head()) - 1, -1):
+            m = msgs[i]
+            if isinstance(m, UserMessage):
+                age += 1
+            if not isinstance(m, ToolMessage):
+                continue
+            if m.content.startswith(OFFLOADED_PREFIX):
+                continue
+            tool_tokens += self.count_tokens(m)
+            if len(m.content) < options.min_chars:
+                continue
+            over_budget = (
+                options.max_tokens is not None and tool_tokens > options.max_tokens
+            )
+            if age < options.max_age and not over_budget:
+                continue
+            ref = self.__offload_store.put(m.content)
+            self.__token_counts.pop(id(m), None)
+            msgs[i] = ToolMessage(
+                offloaded_content(m.content, ref, options.head_chars),
+                tool_call_id=m.tool_call_id,
+            )
+            if self.__store is not None:
+                self.__store.write(
+                    self.__session, self.__global_index(i), msgs[i].to_json()
+                )
+
+    def __maybe_compact(self):
+        if self.__compaction_task is not None:
+            return
+        head = self.__head()
+        body = self.__messages[len(head) :]
+        tokens = sum(self.count_tokens(m) for m in body)
+        if tokens <= self.__compaction_threshold:
+            return
+        if self.__hidden > 0:
+            # Summarize from the very beginning of a resumed session
+            self.__load_hidden()
+            body = self.__messages[len(head) :]
+            tokens = sum(self.count_tokens(m) for m in body)
+        # Summarize the oldest whole turns, but never the current (last) one
+        span: list[Message] = []
+        for block in self.__blocks(body)[:-1]:
+            if tokens <= self.__compaction_keep:
+                break
+            tokens -= sum(self.count_tokens(m) for m in block)
+            span.extend(block)
+        if len(span) == 0:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self.__compaction_task = loop.create_task(self.__compact(span))
+
+    async def __compact(self, span: list[Message]):
+        try:
+            assert self.__summarize is not None
+            summary = await self.__summarize(span)
+        finally:
+            self.__compaction_task = None
+        if summary is None:
+            return
+        # The history may have been reset or replaced in the meantime
+        start = len(self.__head())
+        end = start + len(span)
+        current = self.__messages[start:end]
+        if len(current) != len(span) or any(a is not b for a, b in zip(current, span)):
+            return
+        self.__messages[start:end] = [summary]
+        self.__trim_start = 0
+        self.__persist_from(start)
+        alive = {id(m) for m in self.__messages}
+        self.__token_counts = {
+            k: v for k, v in self.__token_counts.items() if k in alive
+        }
+
+    def __update_prefix_stability(self, messages: list[Message]):
+        prev = self.__last_request
+        common = 0
+        for a, b in zip(prev, messages):
+            if a is not b:
+                break
+            common += 1
+        total = sum(self.count_tokens(m) for m in messages)
+        stable = sum(self.count_tokens(m) for m in messages[:common])
+        self.prefix_stability = stable / total if total > 0 else 1.0
+        self.__last_request = messages
+
+
+Summarize = Callable[[list[Message]], Awaitable[Message | None]]
+
+
+def _count_tokens(m: Message) -> int:
+    from .message import AssistantMessage, ContentPartText
+
+    tokens = 0
+    if isinstance(m.content, str):
+        tokens += len(ENCODING.encode(m.content))
+    elif isinstance(m.content, list):
+        for part in m.content:
+            if isinstance(part, ContentPartText):
+                tokens += len(ENCODING.encode(part.content))
+    if isinstance(m, AssistantMessage):
+        for t in m.tool_calls:
+            tokens += len(ENCODING.encode(t.function.arguments_string()))
+    return tokens
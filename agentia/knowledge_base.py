@@ -7,6 +7,8 @@ from llama_index.core.schema import NodeWithScore
 from llama_index.core.base.response.schema import Response
 from agentia.utils.retrieval.vector_store import VectorStore, is_file_supported
 from agentia.utils.retrieval.retriever import TOP_K, MultiRetriever
+from agentia.utils.tracing import start_span
+from agentia.utils.deadline import with_deadline
 
 
 class KnowledgeBase:
@@ -55,8 +57,9 @@ class KnowledgeBase:
 
     async def query(self, query: str, file: str | None) -> str:
         """Query the knowledge base"""
-        self.__retriever.file = file
-        response = await self.__query_engine.aquery(query)
+        with start_span("knowledge_base.query", file=file):
+            self.__retriever.file = file
+            response = await with_deadline(self.__query_engine.aquery(query))
         if len(response.source_nodes) == 0:
             return "ERROR: No results found because the knowledge base is empty."
         formatted_response = str(response) + "\n\n\nSOURCES:\n\n"
@@ -1,15 +1,43 @@
+import asyncio
 from dataclasses import dataclass
 from logging import Logger
-from typing import Any, AsyncGenerator, Literal, Sequence, overload
+import sys
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncGenerator,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Literal,
+    Sequence,
+    TypeVar,
+    overload,
+)
 
 from ..tools import ToolRegistry
-from ..message import AssistantMessage, Message, MessageStream
+from ..message import (
+    AssistantMessage,
+    Message,
+    MessageStream,
+    ReasoningMessageStream,
+    UserMessage,
+)
 from ..agent import ChatCompletion
 from ..history import History
+from .cache import CompletionCache, CachedMessageStream
+from .usage import RequestUsage, UsageTracker
+from ..utils.images import ImageOptions, preprocess_message_images
+from ..utils.tracing import Span, start_span, iterate_in_span
+from ..utils.deadline import Deadline, DeadlineExceeded, current_deadline
 
-from dataclasses import dataclass
 from .. import MSG_LOGGER
 
+if TYPE_CHECKING:
+    from .routing import ModelRouter
+
+T = TypeVar("T")
+
 
 @dataclass
 class ModelOptions:
@@ -44,6 +72,10 @@ class LLMBackend:
     def support_tools(self) -> bool:
         return True
 
+    def _cache_identity(self) -> Any:
+        """Everything besides the model and the request that affects the responses, e.g. the endpoint"""
+        return type(self).__name__
+
     def __init__(
         self,
         model: str,
@@ -56,27 +88,57 @@ class LLMBackend:
         self.tools = tools
         self.history = history
         self.log = tools._agent.log
+        self.cache: CompletionCache | None = None
+        self.usage = UsageTracker(tools._agent)
+        self.image_options: ImageOptions | None = ImageOptions()
+        """Options to downscale and re-encode inline images of user messages. Set to None to send images unchanged."""
+        self.max_tool_iterations: int | None = None
+        """Stop a turn after this many rounds of tool calls"""
+        self.router: "ModelRouter | None" = None
+        """Send some requests of a turn to a cheaper and faster model"""
 
     @overload
     def chat_completion(
-        self, messages: Sequence[Message], stream: Literal[False] = False
+        self,
+        messages: Sequence[Message],
+        stream: Literal[False] = False,
+        history: History | None = None,
+        deadline: Deadline | None = None,
     ) -> ChatCompletion[AssistantMessage]: ...
 
     @overload
     def chat_completion(
-        self, messages: Sequence[Message], stream: Literal[True]
+        self,
+        messages: Sequence[Message],
+        stream: Literal[True],
+        history: History | None = None,
+        deadline: Deadline | None = None,
     ) -> ChatCompletion[MessageStream]: ...
 
     def chat_completion(
-        self, messages: Sequence[Message], stream: bool = False
+        self,
+        messages: Sequence[Message],
+        stream: bool = False,
+        history: History | None = None,
+        deadline: Deadline | None = None,
     ) -> ChatCompletion[MessageStream] | ChatCompletion[AssistantMessage]:
+        """
+        :param history: Run the turn on this history instead of `self.history`, e.g. an isolated session.
+        :param deadline: Stop the turn once the deadline expires. Defaults to the deadline of the calling turn, if any.
+        """
         if stream:
             return ChatCompletion(
-                self.tools._agent, self._chat_completion(messages, stream=True)
+                self.tools._agent,
+                self._chat_completion(
+                    messages, stream=True, history=history, deadline=deadline
+                ),
             )
         else:
             return ChatCompletion(
-                self.tools._agent, self._chat_completion(messages, stream=False)
+                self.tools._agent,
+                self._chat_completion(
+                    messages, stream=False, history=history, deadline=deadline
+                ),
             )
 
     async def _on_new_chat_message(self, msg: Message):
@@ -84,7 +146,7 @@ class LLMBackend:
 
     @overload
     async def _chat_completion_request(
-        self, messages: list[Message], stream: Literal[False]
+        self, messages: Sequence[Message], stream: Literal[False]
     ) -> AssistantMessage: ...
 
     @overload
@@ -99,58 +161,298 @@ class LLMBackend:
 
     @overload
     async def _chat_completion(
-        self, messages: Sequence[Message], stream: Literal[False]
+        self,
+        messages: Sequence[Message],
+        stream: Literal[False],
+        history: History | None = None,
+        deadline: Deadline | None = None,
     ) -> AsyncGenerator[AssistantMessage, None]: ...
 
     @overload
     async def _chat_completion(
-        self, messages: Sequence[Message], stream: Literal[True]
+        self,
+        messages: Sequence[Message],
+        stream: Literal[True],
+        history: History | None = None,
+        deadline: Deadline | None = None,
     ) -> AsyncGenerator[MessageStream, None]: ...
 
     async def _chat_completion(
-        self, messages: Sequence[Message], stream: bool
+        self,
+        messages: Sequence[Message],
+        stream: bool,
+        history: History | None = None,
+        deadline: Deadline | None = None,
     ) -> AsyncGenerator[AssistantMessage | MessageStream, None]:
+        history = history if history is not None else self.history
+        # Colleagues inherit the deadline of the leader's turn
+        deadline = deadline or current_deadline()
         for m in messages:
+            if isinstance(m, UserMessage) and self.image_options is not None:
+                m = await preprocess_message_images(m, self.image_options)
             self.log.info(f"{m}")
-            self.history.add(m)
+            history.add(m)
             await self._on_new_chat_message(m)
-        # First completion request
-        message: AssistantMessage
-        trimmed_history = self.history.get_for_inference(keep_last=len(messages))
+        keep_last = len(messages)
+        self.usage.start_turn(history)
+        turn = start_span("agent.turn", agent=self.tools._agent.name)
+        iterations = 0
+        # The stream being consumed, to abort it if the turn is closed early
+        pending: MessageStream | None = None
+        try:
+            # Submit requests and run tools until convergence
+            while True:
+                if deadline is not None and deadline.expired:
+                    self.__stop_turn(turn, "deadline_exceeded")
+                    break
+                with turn.activate():
+                    with start_span("history.trim") as span:
+                        trimmed_history = history.get_for_inference(keep_last=keep_last)
+                        span.set(prefix_stability=history.prefix_stability)
+                    backend = self.__route(turn, history, trimmed_history)
+                    cache_key = self.__cache_key(backend, trimmed_history)
+                    request = self.__request(
+                        backend, trimmed_history, stream, cache_key
+                    )
+                    try:
+                        if deadline is not None:
+                            response, cached = await deadline.run(request)
+                        else:
+                            response, cached = await request
+                    except DeadlineExceeded:
+                        self.__stop_turn(turn, "deadline_exceeded")
+                        break
+                if cached:
+                    turn.event("completion_cache_hit")
+                message: AssistantMessage
+                partial = False
+                if isinstance(response, MessageStream):
+                    if deadline is not None:
+                        response = _DeadlineMessageStream(response, deadline)
+                    pending = response
+                    yield response
+                    message = await response.wait_for_completion()
+                    pending = None
+                    partial = isinstance(response, _DeadlineMessageStream) and (
+                        response.interrupted
+                    )
+                else:
+                    message = response
+                    if message.content is not None:
+                        yield message
+                if (
+                    self.cache is not None
+                    and cache_key is not None
+                    and not cached
+                    and not partial
+                ):
+                    await self.cache.aput(cache_key, message)
+                history.add(message)
+                self.log.info(f"{message}")
+                await self._on_new_chat_message(message)
+                if partial:
+                    self.__stop_turn(turn, "deadline_exceeded")
+                    break
+                if len(message.tool_calls) == 0:
+                    break
+                # Run tools
+                count = 0
+                tool_events = self.tools.call_tools(message.tool_calls, deadline)
+                async for event in iterate_in_span(turn, tool_events):
+                    if isinstance(event, Message):
+                        history.add(event)
+                        count += 1
+                    else:
+                        yield event
+                keep_last = count + 1
+                iterations += 1
+                if (
+                    self.max_tool_iterations is not None
+                    and iterations >= self.max_tool_iterations
+                ):
+                    self.__stop_turn(turn, "max_tool_iterations")
+                    break
+        finally:
+            if pending is not None:
+                await pending.aclose()
+            turn.end()
+
+    def __stop_turn(self, turn: Span, reason: str):
+        """End the turn early. The history is left consistent, so the conversation can continue."""
+        self.log.warning(f"TURN STOPPED: {reason}")
+        turn.event(reason)
+
+    def __route(
+        self, turn: Span, history: History, messages: Sequence[Message]
+    ) -> "LLMBackend":
+        """Pick the backend for the next request of the turn"""
+        if self.router is None:
+            return self
+        tier = self.router.route(history, messages)
+        backend = self.router.fast if tier == "fast" else self
+        self.log.debug(f"ROUTED TO {tier.upper()} MODEL: {backend.model}")
+        turn.event("route", tier=tier, model=backend.model)
+        return backend
+
+    def __cache_key(
+        self, backend: "LLMBackend", messages: Sequence[Message]
+    ) -> str | None:
+        if self.cache is None:
+            return None
+        tools = self.tools.to_json() if not self.tools.is_empty() else None
+        return self.cache.key(
+            backend._cache_identity(),
+            backend.model,
+            self.options.as_kwargs(),
+            messages,
+            tools,
+        )
+
+    async def __request(
+        self,
+        backend: "LLMBackend",
+        messages: Sequence[Message],
+        stream: bool,
+        cache_key: str | None,
+    ) -> tuple[AssistantMessage | MessageStream, bool]:
+        """Send a completion request. Returns the response and whether it is served from the cache."""
+        if self.cache is not None and cache_key is not None:
+            if (message := await self.cache.aget(cache_key)) is not None:
+                self.log.debug("COMPLETION-CACHE HIT")
+                self.usage.record(RequestUsage(model=backend.model, cached=True))
+                return (CachedMessageStream(message) if stream else message), True
         if stream:
-            s = await self._chat_completion_request(trimmed_history, stream=True)
-            yield s
-            message = await s.wait_for_completion()
+            return await backend._chat_completion_request(messages, stream=True), False
         else:
-            message = await self._chat_completion_request(trimmed_history, stream=False)
-            if message.content is not None:
-                yield message
-        self.history.add(message)
-        self.log.info(f"{message}")
-        await self._on_new_chat_message(message)
-        # Run tools and submit results until convergence
-        while len(message.tool_calls) > 0:
-            # Run tools
-            count = 0
-            async for event in self.tools.call_tools(message.tool_calls):
-                if isinstance(event, Message):
-                    self.history.add(event)
-                    count += 1
-                else:
-                    yield event
-            trimmed_history = self.history.get_for_inference(keep_last=count + 1)
-            # Submit results
-            message: AssistantMessage
-            if stream:
-                r = await self._chat_completion_request(trimmed_history, stream=True)
-                yield r
-                message = await r.wait_for_completion()
-            else:
-                message = await self._chat_completion_request(
-                    trimmed_history, stream=False
-                )
-                if message.content is not None:
-                    yield message
-            self.history.add(message)
-            self.log.info(f"{message}")
-            await self._on_new_chat_message(message)
+            return await backend._chat_completion_request(messages, stream=False), False
+
+
+class _DeadlineScope:
+    """Interrupt the reads of a stream once the deadline expires. One timer is set for the whole stream, not one per chunk."""
+
+    def __init__(self, deadline: Deadline):
+        self.deadline = deadline
+        self.expired = deadline.expired
+        self.__reading: asyncio.Task[Any] | None = None
+        self.__remove: Callable[[], None] | None = None
+
+    def __expire(self):
+        if self.expired:
+            return
+        self.expired = True
+        if self.__reading is not None:
+            self.__reading.cancel()
+
+    async def read(self, aw: Awaitable[T]) -> T:
+        """Await the next chunk. Raises `DeadlineExceeded` once the deadline expires."""
+        if self.__remove is None and not self.expired:
+            self.__remove = self.deadline.on_expire(self.__expire)
+        if self.expired:
+            if asyncio.iscoroutine(aw):
+                aw.close()
+            raise DeadlineExceeded("Deadline exceeded")
+        task = asyncio.current_task()
+        self.__reading = task
+        try:
+            return await aw
+        except asyncio.CancelledError:
+            if not self.expired:
+                raise
+            # Only absorb our own cancellation
+            if sys.version_info >= (3, 11) and task is not None and task.uncancel() > 0:
+                raise
+            raise DeadlineExceeded("Deadline exceeded")
+        finally:
+            self.__reading = None
+
+    def close(self):
+        if self.__remove is not None:
+            self.__remove()
+
+
+class _DeadlineReasoningStream(ReasoningMessageStream):
+    def __init__(self, stream: ReasoningMessageStream, scope: _DeadlineScope):
+        self.__stream = stream
+        self.__scope = scope
+        self.__iter = stream.__aiter__()
+        self.__content: list[str] = []
+        self.interrupted = False
+
+    @property
+    def content(self) -> str:
+        return "".join(self.__content)
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self
+
+    async def __anext__(self) -> str:
+        if self.interrupted:
+            raise StopAsyncIteration()
+        try:
+            delta = await self.__scope.read(self.__iter.__anext__())
+        except DeadlineExceeded:
+            self.interrupted = True
+            raise StopAsyncIteration()
+        self.__content.append(delta)
+        return delta
+
+    async def wait_for_completion(self) -> str:
+        async for _ in self:
+            ...
+        if self.interrupted:
+            return self.content
+        return await self.__stream.wait_for_completion()
+
+    async def aclose(self):
+        await self.__stream.aclose()
+
+
+class _DeadlineMessageStream(MessageStream):
+    """Stop a stream and its reasoning once the deadline expires, and complete it with the content received so far"""
+
+    def __init__(self, stream: MessageStream, deadline: Deadline):
+        self.__stream = stream
+        self.__scope = _DeadlineScope(deadline)
+        self.__iter = stream.__aiter__()
+        self.__content: list[str] = []
+        self.__partial: AssistantMessage | None = None
+        self.__reasoning: _DeadlineReasoningStream | None = None
+        if stream.reasoning is not None:
+            self.__reasoning = _DeadlineReasoningStream(stream.reasoning, self.__scope)
+        self.reasoning = self.__reasoning
+
+    @property
+    def interrupted(self) -> bool:
+        return self.__partial is not None
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self
+
+    async def __anext__(self) -> str:
+        if self.__partial is not None:
+            raise StopAsyncIteration()
+        try:
+            delta = await self.__scope.read(self.__iter.__anext__())
+        except DeadlineExceeded:
+            reasoning = self.__reasoning.content if self.__reasoning else None
+            self.__partial = AssistantMessage(
+                content="".join(self.__content) or None, reasoning=reasoning or None
+            )
+            await self.aclose()
+            raise StopAsyncIteration()
+        except StopAsyncIteration:
+            self.__scope.close()
+            raise
+        self.__content.append(delta)
+        return delta
+
+    async def wait_for_completion(self) -> AssistantMessage:
+        async for _ in self:
+            ...
+        if self.__partial is not None:
+            return self.__partial
+        return await self.__stream.wait_for_completion()
+
+    async def aclose(self):
+        self.__scope.close()
+        await self.__stream.aclose()
@@ -0,0 +1,156 @@
+import asyncio
+from pathlib import Path
+import re
+from typing import Any, AsyncIterator, Sequence
+
+from ..message import (
+    AssistantMessage,
+    Message,
+    MessageStream,
+    ReasoningMessageStream,
+    ToolCall,
+)
+from ..utils.cache import TieredCache, stable_hash
+
+_CHUNK_PATTERN = re.compile(r"\S+\s*|\s+")
+
+
+class CompletionCache:
+    def __init__(
+        self,
+        path: Path | None = None,
+        max_entries: int = 1024,
+        max_disk_entries: int = 100000,
+        ttl: float | None = None,
+    ):
+        """
+        Exact-match cache of completion responses.
+        Requests are keyed by the provider, the model, the model options, the messages and the tool schemas.
+
+        :param path: Path to the on-disk cache database. Only the memory tier is used if not provided.
+        :param max_entries: Maximum number of responses kept in memory.
+        :param max_disk_entries: Maximum number of responses kept on disk.
+        :param ttl: Optional time-to-live of each response, in seconds.
+        """
+        self.__cache = TieredCache(
+            path=path,
+            max_entries=max_entries,
+            max_disk_entries=max_disk_entries,
+            ttl=ttl,
+        )
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def shared(path: Path) -> "CompletionCache":
+        """Get a cache instance shared by all agents in this process that use the same database"""
+        if path not in _SHARED_CACHES:
+            _SHARED_CACHES[path] = CompletionCache(path=path)
+        return _SHARED_CACHES[path]
+
+    def key(
+        self,
+        provider: Any,
+        model: str,
+        options: dict[str, Any],
+        messages: Sequence[Message],
+        tools: Any,
+    ) -> str:
+        return stable_hash(
+            provider, model, options, [m.to_json() for m in messages], tools
+        )
+
+    def get(self, key: str) -> AssistantMessage | None:
+        data = self.__cache.get(key)
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return AssistantMessage(
+            content=data["content"],
+            reasoning=data.get("reasoning"),
+            tool_calls=[ToolCall.from_dict(tc) for tc in data.get("tool_calls", [])],
+        )
+
+    def put(self, key: str, message: AssistantMessage):
+        self.__cache.put(key, self.__to_json(message))
+
+    async def aget(self, key: str) -> AssistantMessage | None:
+        """Like `get`, but the disk tier is read in a thread, so the event loop is not blocked"""
+        if self.__cache.disk is None or self.__cache.memory.get(key) is not None:
+            return self.get(key)
+        return await asyncio.to_thread(self.get, key)
+
+    async def aput(self, key: str, message: AssistantMessage):
+        """Like `put`, but the disk tier is written in a thread, so the event loop is not blocked"""
+        data = self.__to_json(message)
+        self.__cache.memory.put(key, data)
+        if self.__cache.disk is not None:
+            await asyncio.to_thread(self.__cache.disk.put, key, data)
+
+    def __to_json(self, message: AssistantMessage) -> Any:
+        return {
+            "content": message.content,
+            "reasoning": message.reasoning,
+            "tool_calls": [tc.to_dict() for tc in message.tool_calls],
+        }
+
+    def clear(self):
+        self.__cache.clear()
+
+
+_SHARED_CACHES: dict[Path, CompletionCache] = {}
+
+
+def _split_chunks(text: str) -> list[str]:
+    return _CHUNK_PATTERN.findall(text)
+
+
+class CachedMessageStream(MessageStream):
+    """Replay a cached response as a message stream, chunked roughly by words"""
+
+    def __init__(self, message: AssistantMessage):
+        self.__message = message
+        self.__chunks = iter(_split_chunks(message.content or ""))
+        if message.reasoning:
+            self.reasoning = CachedReasoningMessageStream(message.reasoning)
+
+    async def __anext__(self) -> str:
+        if self.reasoning is not None:
+            async for _ in self.reasoning:
+                ...
+        chunk = next(self.__chunks, None)
+        if chunk is None:
+            raise StopAsyncIteration()
+        # Yield to the event loop between chunks, like a real stream does
+        await asyncio.sleep(0)
+        return chunk
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self
+
+    async def wait_for_completion(self) -> AssistantMessage:
+        async for _ in self:
+            ...
+        return self.__message
+
+
+class CachedReasoningMessageStream(ReasoningMessageStream):
+    def __init__(self, reasoning: str):
+        self.__reasoning = reasoning
+        self.__chunks = iter(_split_chunks(reasoning))
+
+    async def __anext__(self) -> str:
+        chunk = next(self.__chunks, None)
+        if chunk is None:
+            raise StopAsyncIteration()
+        await asyncio.sleep(0)
+        return chunk
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self
+
+    async def wait_for_completion(self) -> str:
+        async for _ in self:
+            ...
+        return self.__reasoning
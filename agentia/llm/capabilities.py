@@ -0,0 +1,129 @@
+import asyncio
+from dataclasses import asdict, dataclass
+import logging
+from pathlib import Path
+import time
+from typing import Any
+
+import httpx
+
+from ..utils.cache import TieredCache
+from ..utils.singleflight import SingleFlight
+
+LOGGER = logging.getLogger("agentia.llm.capabilities")
+
+OPENROUTER_MODELS_URL = "https://openrouter.ai/api/v1/models"
+
+
+@dataclass
+class ModelCapabilities:
+    reasoning: bool = False
+    """Whether the model returns its reasoning"""
+    tools: bool = False
+    """Whether the model supports tool calls"""
+    context_length: int | None = None
+
+    @staticmethod
+    def from_openrouter(model: Any) -> "ModelCapabilities":
+        params = model.get("supported_parameters") or []
+        return ModelCapabilities(
+            reasoning="include_reasoning" in params or "reasoning" in params,
+            tools="tools" in params,
+            context_length=model.get("context_length"),
+        )
+
+
+class CapabilityRegistry:
+    def __init__(
+        self,
+        path: Path | None = None,
+        url: str = OPENROUTER_MODELS_URL,
+        ttl: float = 24 * 60 * 60,
+        timeout: float = 10.0,
+    ):
+        """
+        Capabilities of the models of a provider, filled by one bulk fetch of its model list.
+        Nothing is fetched until the first lookup.
+
+        :param path: Path to the on-disk cache database, shared by all processes. Only kept in memory if not provided.
+        :param ttl: Seconds before the model list is fetched again. A stale list is still used if the fetch fails.
+        :param timeout: Timeout of the fetch, in seconds.
+        """
+        self.path = path
+        self.url = url
+        self.ttl = ttl
+        self.timeout = timeout
+        self.__cache: TieredCache | None = None
+        self.__models: dict[str, ModelCapabilities] | None = None
+        self.__fetched_at = 0.0
+        self.__inflight = SingleFlight()
+
+    @staticmethod
+    def shared(path: Path) -> "CapabilityRegistry":
+        """Get a registry shared by all agents in this process that use the same database"""
+        if path not in _SHARED_REGISTRIES:
+            _SHARED_REGISTRIES[path] = CapabilityRegistry(path=path)
+        return _SHARED_REGISTRIES[path]
+
+    def __fresh(self) -> bool:
+        return self.__models is not None and time.time() - self.__fetched_at < self.ttl
+
+    async def get(self, model: str) -> ModelCapabilities | None:
+        """Get the capabilities of a model. Returns None if the model is unknown, or the model list is unavailable."""
+        if not self.__fresh():
+            # Concurrent lookups share one fetch
+            await self.__inflight.do(self.url, self.refresh)
+        return (self.__models or {}).get(model)
+
+    async def refresh(self, force: bool = False):
+        """Load the model list from the disk cache, or fetch it if missing or expired"""
+        if not force and self.__models is None and self.path is not None:
+            await asyncio.to_thread(self.__load)
+            if self.__fresh():
+                return
+        try:
+            async with httpx.AsyncClient(timeout=self.timeout) as client:
+                res = await client.get(self.url)
+                res.raise_for_status()
+                data = res.json().get("data", [])
+        except (httpx.HTTPError, ValueError) as e:
+            LOGGER.warning(f"Failed to fetch the model list from {self.url}: {e}")
+            if self.__models is None:
+                self.__models = {}
+            # Keep using the stale list, and retry in a minute
+            self.__fetched_at = time.time() - self.ttl + min(self.ttl, 60)
+            return
+        self.__models = {
+            m["id"]: ModelCapabilities.from_openrouter(m) for m in data if "id" in m
+        }
+        self.__fetched_at = time.time()
+        if self.path is not None:
+            await asyncio.to_thread(self.__save)
+
+    def __disk(self) -> TieredCache:
+        assert self.path is not None
+        if self.__cache is None:
+            self.__cache = TieredCache(path=self.path, max_entries=1)
+        return self.__cache
+
+    def __load(self):
+        entry = self.__disk().get(self.url)
+        if entry is None:
+            return
+        self.__models = {
+            k: ModelCapabilities(**v) for k, v in entry.get("models", {}).items()
+        }
+        self.__fetched_at = entry.get("fetched_at", 0.0)
+
+    def __save(self):
+        assert self.__models is not None
+        self.__disk().put(
+            self.url,
+            {
+                "fetched_at": self.__fetched_at,
+                "models": {k: asdict(v) for k, v in self.__models.items()},
+            },
+        )
+
+
+_SHARED_REGISTRIES: dict[Path, CapabilityRegistry] = {}
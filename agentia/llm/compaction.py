@@ -0,0 +1,110 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Sequence
+
+from ..message import (
+    AssistantMessage,
+    ContentPartText,
+    Message,
+    SystemMessage,
+    ToolMessage,
+    UserMessage,
+)
+from ..utils.cache import TieredCache, stable_hash
+from ..utils.tracing import start_span
+
+if TYPE_CHECKING:
+    from . import LLMBackend
+
+DEFAULT_SUMMARY_MODELS = {
+    "openai": "gpt-4o-mini",
+    "openrouter": "openai/gpt-4o-mini",
+    "deepseek": "deepseek-chat",
+}
+
+SUMMARY_PREFIX = "SUMMARY OF THE EARLIER CONVERSATION:\n"
+
+SUMMARY_INSTRUCTIONS = """
+You are summarizing the beginning of a conversation between a user and an AI assistant, so that the assistant can continue the conversation without the original messages.
+Write a concise summary that keeps all the facts, decisions, user preferences, open questions and important tool results (e.g. file names, URLs, numbers) that may be needed later.
+If the transcript starts with a previous summary, merge it into the new summary.
+Only output the summary.
+""".strip()
+
+MAX_TOOL_RESULT_CHARS = 2000
+
+
+@dataclass
+class CompactionOptions:
+    model: str | None = None
+    """The model used for summarization, e.g. `openai:gpt-4o-mini`. Default to a cheap model of the agent's provider."""
+    threshold: int = 64000
+    """Compact the history when it grows beyond this number of tokens"""
+    keep_ratio: float = 0.5
+    """The most recent turns, up to `threshold * keep_ratio` tokens, are kept verbatim"""
+
+
+def is_summary(m: Message) -> bool:
+    return isinstance(m, SystemMessage) and m.content.startswith(SUMMARY_PREFIX)
+
+
+class Summarizer:
+    def __init__(self, backend: "LLMBackend", cache_path: Path | None = None):
+        """
+        Summarize spans of the conversation history with a (usually cheaper) model.
+        Summaries are cached by the exact span of messages.
+        """
+        self.backend = backend
+        self.__cache = TieredCache(path=cache_path, max_entries=64)
+
+    async def summarize(self, messages: Sequence[Message]) -> SystemMessage | None:
+        transcript = _render_transcript(messages)
+        key = stable_hash(self.backend.model, SUMMARY_INSTRUCTIONS, transcript)
+        if (summary := self.__cache.get(key)) is not None:
+            return SystemMessage(SUMMARY_PREFIX + summary)
+        with start_span(
+            "history.compact", model=self.backend.model, messages=len(messages)
+        ):
+            try:
+                response = await self.backend._chat_completion_request(
+                    [SystemMessage(SUMMARY_INSTRUCTIONS), UserMessage(transcript)],
+                    stream=False,
+                )
+            except Exception as e:
+                self.backend.log.warning(f"History compaction failed: {e}")
+                return None
+        if not response.content:
+            return None
+        self.__cache.put(key, response.content)
+        return SystemMessage(SUMMARY_PREFIX + response.content)
+
+
+def _render_transcript(messages: Sequence[Message]) -> str:
+    lines: list[str] = []
+    for m in messages:
+        if is_summary(m):
+            assert isinstance(m, SystemMessage)
+            lines.append(f"PREVIOUS SUMMARY:\n{m.content.removeprefix(SUMMARY_PREFIX)}")
+        elif isinstance(m, SystemMessage):
+            lines.append(f"SYSTEM: {m.content}")
+        elif isinstance(m, UserMessage):
+            if isinstance(m.content, str):
+                content = m.content
+            else:
+                content = " ".join(
+                    p.content if isinstance(p, ContentPartText) else "[image]"
+                    for p in m.content
+                )
+            lines.append(f"USER: {content}")
+        elif isinstance(m, AssistantMessage):
+            if m.content:
+                lines.append(f"ASSISTANT: {m.content}")
+            for t in m.tool_calls:
+                args = t.function.arguments_string()
+                lines.append(f"ASSISTANT CALLED TOOL: {t.function.name}({args})")
+        elif isinstance(m, ToolMessage):
+            content = m.content
+            if len(content) > MAX_TOOL_RESULT_CHARS:
+                content = content[:MAX_TOOL_RESULT_CHARS] + " ... (truncated)"
+            lines.append(f"TOOL RESULT: {content}")
+    return "\n\n".join(lines)
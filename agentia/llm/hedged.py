@@ -0,0 +1,207 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field
+import time
+from typing import Any, Literal, Sequence, overload, override
+
+from agentia.history import History
+
+from . import LLMBackend, ModelOptions
+from ..message import AssistantMessage, Message, MessageStream
+from ..tools import ToolRegistry
+from ..utils.tracing import start_span
+from .openai import ChatMessageStream, OpenAIBackend
+
+
+@dataclass
+class ProviderStats:
+    """Latency and error statistics of a provider and model, shared by all agents in the process"""
+
+    latency: float | None = None
+    """EWMA of the time to first chunk (streams) or the response time (other requests), in seconds"""
+    error_rate: float = 0.0
+    """EWMA of the fraction of failed requests"""
+    samples: deque[float] = field(default_factory=lambda: deque(maxlen=100))
+
+    def record(self, latency: float | None, alpha: float):
+        error = 1.0 if latency is None else 0.0
+        self.error_rate += alpha * (error - self.error_rate)
+        if latency is None:
+            return
+        self.samples.append(latency)
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += alpha * (latency - self.latency)
+
+    def record_censored(self, elapsed: float, alpha: float):
+        """
+        Record a request cancelled after `elapsed` seconds, before it responded.
+        Its latency is only known to be at least `elapsed`, so it can raise the estimate but never lower it.
+        """
+        if self.latency is None:
+            self.latency = elapsed
+        elif elapsed > self.latency:
+            self.latency += alpha * (elapsed - self.latency)
+
+    def percentile(self, p: float) -> float | None:
+        if len(self.samples) == 0:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+_STATS: dict[str, ProviderStats] = {}
+
+
+def get_provider_stats(backend: OpenAIBackend) -> ProviderStats:
+    key = f"{backend.client.base_url}#{backend.model}"
+    if key not in _STATS:
+        _STATS[key] = ProviderStats()
+    return _STATS[key]
+
+
+class HedgedBackend(LLMBackend):
+    def __init__(
+        self,
+        backends: Sequence[OpenAIBackend],
+        tools: ToolRegistry,
+        options: ModelOptions,
+        history: History,
+        hedge_percentile: float = 0.9,
+        hedge_delay: float = 2.0,
+        min_samples: int = 10,
+        alpha: float = 0.2,
+        error_penalty: float = 10.0,
+    ):
+        """
+        Send requests to the fastest healthy provider among `backends`, and fail over to the next one on errors.
+
+        If the provider has not started responding after the `hedge_percentile` of its usual time to first chunk,
+        a hedged request is sent to the next provider. The first one to respond is used, and the other one is cancelled.
+
+        :param hedge_delay: Seconds to wait before hedging, until `min_samples` latencies of the provider are known.
+        :param alpha: Smoothing factor of the latency and error EWMAs.
+        :param error_penalty: Providers are ranked by `latency * (1 + error_penalty * error_rate)`.
+        """
+        assert len(backends) > 0, "At least one backend is required"
+        super().__init__(backends[0].model, tools, options, history)
+        self.backends = list(backends)
+        self.hedge_percentile = hedge_percentile
+        self.hedge_delay = hedge_delay
+        self.min_samples = min_samples
+        self.alpha = alpha
+        self.error_penalty = error_penalty
+        for b in self.backends:
+            # Account all requests to this agent
+            b.usage = self.usage
+
+    def __rank(self) -> list[OpenAIBackend]:
+        def score(b: OpenAIBackend) -> float:
+            stats = get_provider_stats(b)
+            latency = stats.latency if stats.latency is not None else self.hedge_delay
+            return latency * (1 + self.error_penalty * stats.error_rate)
+
+        # Ties are kept in the configured order
+        return sorted(self.backends, key=score)
+
+    @override
+    def _cache_identity(self) -> Any:
+        # Any of the providers may answer
+        return [b._cache_identity() for b in self.backends]
+
+    def __delay(self, backend: OpenAIBackend) -> float:
+        stats = get_provider_stats(backend)
+        if len(stats.samples) < self.min_samples:
+            return self.hedge_delay
+        return stats.percentile(self.hedge_percentile) or self.hedge_delay
+
+    async def __attempt(
+        self, backend: OpenAIBackend, messages: Sequence[Message], stream: bool
+    ) -> AssistantMessage | MessageStream:
+        stats = get_provider_stats(backend)
+        start = time.monotonic()
+        response: AssistantMessage | MessageStream | None = None
+        try:
+            response = await backend._chat_completion_request(messages, stream=stream)
+            if isinstance(response, ChatMessageStream):
+                await response.wait_for_first_chunk()
+        except asyncio.CancelledError:
+            # Lost the race. Abort the request, and remember that it was at least this slow.
+            stats.record_censored(time.monotonic() - start, self.alpha)
+            if isinstance(response, MessageStream):
+                await response.aclose()
+            raise
+        except Exception:
+            stats.record(None, self.alpha)
+            raise
+        stats.record(time.monotonic() - start, self.alpha)
+        return response
+
+    @overload
+    async def _chat_completion_request(
+        self, messages: Sequence[Message], stream: Literal[False]
+    ) -> AssistantMessage: ...
+
+    @overload
+    async def _chat_completion_request(
+        self, messages: Sequence[Message], stream: Literal[True]
+    ) -> MessageStream: ...
+
+    @override
+    async def _chat_completion_request(
+        self, messages: Sequence[Message], stream: bool
+    ) -> AssistantMessage | MessageStream:
+        candidates = self.__rank()
+        running: dict[asyncio.Task[AssistantMessage | MessageStream], OpenAIBackend] = (
+            {}
+        )
+        error: BaseException | None = None
+        span = start_span("llm.hedge", providers=len(candidates))
+
+        def launch():
+            b = candidates.pop(0)
+            span.event("request", model=b.model, base_url=str(b.client.base_url))
+            with span.activate():
+                task = asyncio.create_task(self.__attempt(b, messages, stream))
+            running[task] = b
+            return b
+
+        try:
+            delay: float | None = self.__delay(launch())
+            while len(running) > 0:
+                done, _ = await asyncio.wait(
+                    running.keys(),
+                    timeout=delay if len(candidates) > 0 else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if len(done) == 0:
+                    # The provider is slower than usual. Hedge with the next one.
+                    self.log.debug("HEDGED REQUEST")
+                    span.set(hedged=True)
+                    launch()
+                    delay = None
+                    continue
+                for task in done:
+                    backend = running.pop(task)
+                    if (e := task.exception()) is None:
+                        span.set(model=backend.model)
+                        return task.result()
+                    self.log.warning(f"Request to {backend.model} failed: {e}")
+                    error = e
+                if len(running) == 0 and len(candidates) > 0:
+                    # Fail over to the next provider
+                    span.set(failover=True)
+                    delay = self.__delay(launch())
+            assert error is not None
+            span.set(error=repr(error))
+            raise error
+        finally:
+            for task in running:
+                task.cancel()
+            if len(running) > 0:
+                losers = await asyncio.gather(*running, return_exceptions=True)
+                for r in losers:
+                    if isinstance(r, MessageStream):
+                        await r.aclose()
+            span.end()
@@ -1,23 +1,45 @@
+from dataclasses import dataclass, field
 import json
 import os
-from typing import AsyncIterator, Literal, Any, Sequence, overload, override
+import time
+from typing import (
+    AsyncIterator,
+    Callable,
+    Literal,
+    Any,
+    Sequence,
+    overload,
+    override,
+)
 
 from agentia.history import History
 
 from .. import MSG_LOGGER
 
 from . import LLMBackend, ModelOptions
+from .usage import RequestUsage
 from ..tools import ToolRegistry
+from ..utils.cache import stable_hash
+from ..utils.singleflight import SingleFlight
+from ..utils.tracing import Span, start_span
 
+from ..blobs import MISSING_BLOB_PLACEHOLDER, is_blob_url
 from ..message import (
     AssistantMessage,
+    ContentPart,
+    ContentPartImage,
+    ContentPartText,
     Message,
     MessageStream,
     ReasoningMessageStream,
     ToolCall,
     FunctionCall,
 )
-from openai.types.chat import ChatCompletionMessageParam
+from openai.types.chat import (
+    ChatCompletionContentPartParam,
+    ChatCompletionMessageParam,
+)
+from openai.types.completion_usage import CompletionUsage
 from openai.types.chat import (
     ChatCompletionChunk,
     ChatCompletionMessageParam,
@@ -43,6 +65,8 @@ from openai.types.chat.chat_completion_chunk import (
 import openai
 from openai.types.chat import ChatCompletionChunk
 
+_INFLIGHT_REQUESTS = SingleFlight()
+
 
 class OpenAIBackend(LLMBackend):
     def __init__(
@@ -65,6 +89,14 @@ class OpenAIBackend(LLMBackend):
         self.extra_body: dict[str, Any] = {}
         self.has_reasoning = False
 
+    @override
+    def _cache_identity(self) -> Any:
+        return {
+            "base_url": str(self.client.base_url),
+            "extra_headers": self.extra_headers,
+            "extra_body": self.extra_body,
+        }
+
     @overload
     async def _chat_completion_request(
         self, messages: Sequence[Message], stream: Literal[False]
@@ -79,41 +111,104 @@ class OpenAIBackend(LLMBackend):
     async def _chat_completion_request(
         self, messages: Sequence[Message], stream: bool
     ) -> AssistantMessage | MessageStream:
-        msgs: list[ChatCompletionMessageParam] = [
-            self.__message_to_ccmp(m) for m in messages
-        ]
-        args: Any = {
-            "model": self.model,
-            "messages": msgs,
-            **self.options.as_kwargs(),
-        }
-        if not self.tools.is_empty():
-            if self.support_tools():
-                args["tools"] = self.tools.to_json()
-                args["tool_choice"] = "auto"
-            else:
-                raise NotImplementedError("Functions are not supported")
+        start_ns = time.time_ns()
+        span = start_span("llm.request", model=self.model, stream=stream)
+        with start_span("llm.request.build", parent=span):
+            msgs: list[ChatCompletionMessageParam] = [
+                self.__message_to_ccmp(m) for m in messages
+            ]
+            args: Any = {
+                "model": self.model,
+                "messages": msgs,
+                **self.options.as_kwargs(),
+            }
+            if not self.tools.is_empty():
+                if self.support_tools():
+                    args["tools"] = self.tools.to_json()
+                    args["tool_choice"] = "auto"
+                else:
+                    raise NotImplementedError("Functions are not supported")
         if stream:
-            response = await self.client.chat.completions.create(
-                **args,
-                extra_headers=self.extra_headers,
-                extra_body=self.extra_body,
-                stream=True,
+            try:
+                response = await self.client.chat.completions.create(
+                    **args,
+                    extra_headers=self.extra_headers,
+                    extra_body=self.extra_body,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                )
+            except BaseException as e:
+                span.set(error=repr(e))
+                span.end()
+                raise
+            # The span ends when the stream is fully consumed
+            state = _StreamState(span=span, start_ns=start_ns)
+            cms = ChatMessageStream(
+                _ChunkStream(response),
+                self.has_reasoning,
+                state,
+                self.__on_stream_complete,
             )
-            cms = ChatMessageStream(response, self.has_reasoning)
             return cms
-        else:
-            response = await self.client.chat.completions.create(
-                **args,
-                extra_headers=self.extra_headers,
-                extra_body=self.extra_body,
-                stream=False,
+        with span:
+            # Identical concurrent requests (e.g. from sessions created from the same
+            # template) share one upstream request.
+            key = stable_hash(
+                str(self.client.base_url),
+                stable_hash(self.client.api_key),
+                args,
+                self.extra_headers,
+                self.extra_body,
+            )
+            coalesced = _INFLIGHT_REQUESTS.in_flight(key)
+            if coalesced:
+                self.log.debug("COALESCED REQUEST")
+                span.set(coalesced=True)
+            response = await _INFLIGHT_REQUESTS.do(
+                key,
+                lambda: self.client.chat.completions.create(
+                    **args,
+                    extra_headers=self.extra_headers,
+                    extra_body=self.extra_body,
+                    stream=False,
+                ),
+            )
+            self.__record_usage(
+                response.usage, start_ns, None, time.time_ns(), coalesced=coalesced
             )
             if response.choices is None:
                 print(response)
                 raise RuntimeError("response.choices is None")
             return self.__ccm_to_message(response.choices[0].message)
 
+    def __on_stream_complete(self, state: "_StreamState"):
+        self.__record_usage(
+            state.usage, state.start_ns, state.first_token_ns, time.time_ns()
+        )
+
+    def __record_usage(
+        self,
+        usage: CompletionUsage | None,
+        start_ns: int,
+        first_token_ns: int | None,
+        end_ns: int,
+        coalesced: bool = False,
+    ):
+        r = RequestUsage(
+            model=self.model,
+            ttft=(first_token_ns - start_ns) / 1e9 if first_token_ns else None,
+            duration=(end_ns - start_ns) / 1e9,
+            coalesced=coalesced,
+        )
+        if usage is not None:
+            r.prompt_tokens = usage.prompt_tokens
+            r.completion_tokens = usage.completion_tokens
+            if d := usage.prompt_tokens_details:
+                r.cached_tokens = d.cached_tokens or 0
+            if d := usage.completion_tokens_details:
+                r.reasoning_tokens = d.reasoning_tokens or 0
+        self.usage.record(r)
+
     def __message_to_ccmp(self, m: Message) -> ChatCompletionMessageParam:
         content = m.content or ""
         if m.role == "system":
@@ -133,7 +228,7 @@ class OpenAIBackend(LLMBackend):
             _content = (
                 content
                 if isinstance(content, str)
-                else [c.to_openai_content_part() for c in content]
+                else [self.__content_part_to_openai(c) for c in content]
             )
             return ChatCompletionUserMessageParam(role="user", content=_content)
         if m.role == "assistant":
@@ -152,6 +247,18 @@ class OpenAIBackend(LLMBackend):
             )
         raise RuntimeError("Unreachable")
 
+    def __content_part_to_openai(
+        self, c: ContentPart
+    ) -> ChatCompletionContentPartParam:
+        if isinstance(c, ContentPartImage) and is_blob_url(c.url):
+            # Images are only kept as blob references in the history
+            if (url := self.history.materialize_url(c.url)) is None:
+                return ContentPartText(
+                    MISSING_BLOB_PLACEHOLDER
+                ).to_openai_content_part()
+            return ContentPartImage(url).to_openai_content_part()
+        return c.to_openai_content_part()
+
     def __ccm_to_message(self, m: ChatCompletionMessage) -> "AssistantMessage":
         assert m.role == "assistant"
         assert m.function_call is None
@@ -193,50 +300,112 @@ class OpenAIBackend(LLMBackend):
         )
 
 
+@dataclass
+class _ToolCallBuffer:
+    id: list[str] = field(default_factory=list)
+    name: list[str] = field(default_factory=list)
+    arguments: list[str] = field(default_factory=list)
+
+
+@dataclass
+class _StreamState:
+    """Request statistics shared by a message stream and its reasoning stream"""
+
+    span: Span
+    start_ns: int
+    first_token_ns: int | None = None
+    usage: CompletionUsage | None = None
+
+    def on_token(self):
+        if self.first_token_ns is None:
+            self.first_token_ns = time.time_ns()
+            self.span.event("first_token")
+            self.span.set(ttft=(self.first_token_ns - self.start_ns) / 1e9)
+
+
+class _ChunkStream:
+    """The chunks of a streamed response, shared by a message stream and its reasoning stream"""
+
+    def __init__(self, response: openai.AsyncStream[ChatCompletionChunk]):
+        self.response = response
+        self.__aiter = response.__aiter__()
+        self.__buffer: list[ChatCompletionChunk] = []
+
+    def __aiter__(self) -> AsyncIterator[ChatCompletionChunk]:
+        return self
+
+    async def __anext__(self) -> ChatCompletionChunk:
+        if self.__buffer:
+            return self.__buffer.pop(0)
+        return await self.__aiter.__anext__()
+
+    async def peek(self):
+        """Read the first chunk ahead, without consuming it"""
+        if not self.__buffer:
+            try:
+                self.__buffer.append(await self.__aiter.__anext__())
+            except StopAsyncIteration:
+                pass
+
+    async def close(self):
+        await self.response.close()
+
+
 class ChatMessageStream(MessageStream):
     def __init__(
         self,
-        response: openai.AsyncStream[ChatCompletionChunk],
+        response: _ChunkStream,
         has_reasoning: bool,
+        state: _StreamState,
+        on_complete: Callable[[_StreamState], None],
     ):
-        self.__aiter = response.__aiter__()
+        self.__response = response
+        self.__aiter = response
         self.__message = AssistantMessage()
-        self.__tool_calls: list[ChoiceDeltaToolCall] = []
+        # Deltas are accumulated in lists and joined once at the end of the stream
+        self.__content: list[str] | None = None
+        self.__tool_calls: list[_ToolCallBuffer] = []
         self.__final_message: AssistantMessage | None = None
         self.__final_reasoning: str | None = None
+        self.__state = state
+        self.__on_complete = on_complete
         if has_reasoning:
-            self.reasoning = ReasoningMessageStreamImpl(response)
+            self.reasoning = ReasoningMessageStreamImpl(response, state)
 
     def __get_final_merged_tool_calls(self) -> list[ToolCall]:
         return [
             ToolCall(
-                id=t.id or "",
+                id="".join(t.id),
                 function=FunctionCall(
-                    name=t.function.name or "",
-                    arguments=json.loads(t.function.arguments or ""),
+                    name="".join(t.name),
+                    arguments=json.loads("".join(t.arguments) or "{}"),
                 ),
                 type="function",
             )
             for t in self.__tool_calls
-            if t.function is not None
         ]
 
     def __merge_tool_calls(self, delta: list[ChoiceDeltaToolCall]):
         for d in delta:
             if d.index is not None and d.index < len(self.__tool_calls):
                 t = self.__tool_calls[d.index]
-                assert t.id is not None
-                t.id += d.id or ""
-                assert t.function is not None
-                assert d.function is not None
-                t.function.name = (t.function.name or "") + (d.function.name or "")
-                t.function.arguments = (t.function.arguments or "") + (
-                    d.function.arguments or ""
-                )
             else:
                 # assert d.index == len(self.__tool_calls)
                 assert d.function is not None
-                self.__tool_calls.append(d)
+                t = _ToolCallBuffer()
+                self.__tool_calls.append(t)
+            if d.id:
+                t.id.append(d.id)
+            if d.function is not None:
+                if d.function.name:
+                    t.name.append(d.function.name)
+                if d.function.arguments:
+                    t.arguments.append(d.function.arguments)
+
+    def __append_content(self, content: str):
+        if self.__content is None:
+            self.__content = []
+        self.__content.append(content)
 
     async def __anext_impl(self) -> str:
         if self.__final_message is not None:
@@ -244,19 +413,30 @@ class ChatMessageStream(MessageStream):
         try:
             chunk = await self.__aiter.__anext__()
         except StopAsyncIteration:
+            if self.__content is not None:
+                self.__message.content = "".join(self.__content)
             self.__message.tool_calls = self.__get_final_merged_tool_calls()
             self.__final_message = self.__message
+            self.__on_complete(self.__state)
+            self.__state.span.end()
             raise StopAsyncIteration()
+        except BaseException as e:
+            self.__state.span.set(error=repr(e))
+            self.__state.span.end()
+            raise
         if hasattr(chunk, "error"):
             raise RuntimeError(chunk.error["message"])  # type: ignore
+        if chunk.usage is not None:
+            self.__state.usage = chunk.usage
+        if len(chunk.choices) == 0:
+            # The usage chunk at the end of the stream has no choices
+            return ""
         delta = chunk.choices[0].delta
+        if delta.content or delta.tool_calls:
+            self.__state.on_token()
         # merge self.__message and delta
         if delta.content is not None:
-            if self.__message.content is None:
-                self.__message.content = ""
-            assert isinstance(delta.content, str)
-            assert isinstance(self.__message.content, str)
-            self.__message.content += delta.content
+            self.__append_content(delta.content)
         if delta.tool_calls is not None:
             self.__merge_tool_calls(delta.tool_calls)
         return delta.content or ""
@@ -270,9 +450,7 @@ class ChatMessageStream(MessageStream):
             if self.reasoning.leftover:
                 leftover = self.reasoning.leftover
                 self.reasoning.leftover = None
-                if self.__message.content is None:
-                    self.__message.content = ""
-                self.__message.content += leftover
+                self.__append_content(leftover)
                 return leftover
         while True:
             delta = await self.__anext_impl()
@@ -295,14 +473,38 @@ class ChatMessageStream(MessageStream):
             self.__final_message.reasoning = self.__final_reasoning
         return self.__final_message
 
+    async def wait_for_first_chunk(self):
+        """Wait until the provider starts responding, without consuming the stream"""
+        await self.__response.peek()
+
+    async def aclose(self):
+        if self.__final_message is not None:
+            return
+        if self.reasoning is not None:
+            assert isinstance(self.reasoning, ReasoningMessageStreamImpl)
+            await self.reasoning.aclose()
+            self.__final_reasoning = await self.reasoning.wait_for_completion()
+        # Closing the response aborts the request and releases the connection
+        await self.__response.close()
+        # Incomplete tool calls are dropped
+        if self.__content is not None:
+            self.__message.content = "".join(self.__content)
+        self.__final_message = self.__message
+        self.__state.span.set(aborted=True)
+        self.__on_complete(self.__state)
+        self.__state.span.end()
+
 
 class ReasoningMessageStreamImpl(ReasoningMessageStream):
     def __init__(
         self,
-        response: openai.AsyncStream[ChatCompletionChunk],
+        response: _ChunkStream,
+        state: _StreamState,
     ):
-        self.__aiter = response.__aiter__()
-        self.__message = ""
+        self.__response = response
+        self.__aiter = response
+        self.__state = state
+        self.__message: list[str] = []
         self.__final_message: str | None = None
         self.__delta = None
         self.leftover: str | None = None
@@ -312,17 +514,23 @@ class ReasoningMessageStreamImpl(ReasoningMessageStream):
             raise StopAsyncIteration()
         try:
             chunk = await self.__aiter.__anext__()
+            if chunk.usage is not None:
+                self.__state.usage = chunk.usage
+            if len(chunk.choices) == 0:
+                return ""
             delta = chunk.choices[0].delta.to_dict()
             reasoning = delta.get("reasoning")
             assert reasoning is None or isinstance(reasoning, str)
-            self.__message += reasoning or ""
+            if reasoning:
+                self.__state.on_token()
+                self.__message.append(reasoning)
             self.__delta = chunk.choices[0].delta.content
             content = chunk.choices[0].delta.content
             if content is not None and content != "" and (reasoning or "") == "":
                 raise StopAsyncIteration()
             return reasoning or ""
         except StopAsyncIteration:
-            self.__final_message = self.__message
+            self.__final_message = "".join(self.__message)
             self.leftover = self.__delta
             raise StopAsyncIteration()
 
@@ -340,3 +548,8 @@ class ReasoningMessageStreamImpl(ReasoningMessageStream):
             ...
         assert self.__final_message is not None
         return self.__final_message
+
+    async def aclose(self):
+        if self.__final_message is None:
+            self.__final_message = "".join(self.__message)
+        await self.__response.close()
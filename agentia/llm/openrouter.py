@@ -1,9 +1,11 @@
 import os
+from typing import Literal, Sequence, overload, override
 from agentia.history import History
 from . import ModelOptions
+from ..message import AssistantMessage, Message, MessageStream
 from ..tools import ToolRegistry
+from .capabilities import CapabilityRegistry
 from .openai import OpenAIBackend
-import requests
 
 
 class OpenRouterBackend(OpenAIBackend):
@@ -24,21 +26,38 @@ class OpenRouterBackend(OpenAIBackend):
             self.extra_body["provider"] = {
                 "order": [x.strip() for x in providers.strip().split(",")]
             }
-        self.has_reasoning = self.__model_has_reasoning(model)
         self.extra_body["transforms"] = ["middle-out"]
+        # Resolved on the first request
+        self.__capabilities_resolved = False
 
-    def __model_has_reasoning(self, model: str):
-        global _REASONING_MODELS
-        if model in _REASONING_MODELS:
-            return _REASONING_MODELS[model]
-        res = requests.get(f"https://openrouter.ai/api/v1/models/{model}/endpoints")
-        endpoints = res.json().get("data", {}).get("endpoints", [])
-        has_reasoning = False
-        if len(endpoints) > 0:
-            e = endpoints[0]
-            has_reasoning = "include_reasoning" in e.get("supported_parameters", [])
-        _REASONING_MODELS[model] = has_reasoning
-        return has_reasoning
+    async def __resolve_capabilities(self):
+        from ..agent import _get_global_cache_dir
 
+        registry = CapabilityRegistry.shared(
+            _get_global_cache_dir() / "openrouter-models.db"
+        )
+        capabilities = await registry.get(self.model)
+        self.has_reasoning = capabilities is not None and capabilities.reasoning
+        # Otherwise look up again on the next request, once the registry has retried
+        self.__capabilities_resolved = capabilities is not None
 
-_REASONING_MODELS: dict[str, bool] = {}
+    @overload
+    async def _chat_completion_request(
+        self, messages: Sequence[Message], stream: Literal[False]
+    ) -> AssistantMessage: ...
+
+    @overload
+    async def _chat_completion_request(
+        self, messages: Sequence[Message], stream: Literal[True]
+    ) -> MessageStream: ...
+
+    @override
+    async def _chat_completion_request(
+        self, messages: Sequence[Message], stream: bool
+    ) -> AssistantMessage | MessageStream:
+        if not self.__capabilities_resolved:
+            await self.__resolve_capabilities()
+        if stream:
+            return await super()._chat_completion_request(messages, stream=True)
+        else:
+            return await super()._chat_completion_request(messages, stream=False)
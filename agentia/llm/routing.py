@@ -0,0 +1,74 @@
+from dataclasses import dataclass
+import re
+from typing import TYPE_CHECKING, Callable, Literal, Sequence
+
+from ..history import History
+from ..message import Message, SystemMessage, ToolMessage, UserMessage
+
+if TYPE_CHECKING:
+    from . import LLMBackend
+
+Tier = Literal["fast", "strong"]
+
+# Messages that do not ask for any work, e.g. acknowledgements and greetings
+_SMALL_TALK = re.compile(
+    r"^\s*(thanks|thank you|thx|ty|ok|okay|k|great|cool|nice|perfect|awesome|got it|sounds good|yes|yep|no|nope|sure|hi|hello|hey|bye|good night)\b[\s!.,:)]*(thanks|thank you)?[\s!.]*$",
+    re.IGNORECASE,
+)
+
+
+@dataclass
+class RoutingRequest:
+    """What the routing rules are based on"""
+
+    messages: Sequence[Message]
+    """The messages to send"""
+    tokens: int
+    """Number of tokens of the messages"""
+    tool_followup: bool
+    """Whether the request follows tool results, e.g. to summarize or format them"""
+
+
+@dataclass
+class RoutingOptions:
+    fast: str
+    """The model of the fast tier, e.g. `openai:gpt-4o-mini`. The agent's model is the strong tier."""
+    tool_followups: bool = True
+    """Send requests that follow tool results to the fast tier"""
+    small_talk: bool = True
+    """Send turns that do not ask for any work (e.g. "thanks!") to the fast tier"""
+    max_fast_tokens: int = 16000
+    """Larger requests always go to the strong tier"""
+    rule: Callable[[RoutingRequest], Tier | None] | None = None
+    """A custom rule, checked first. Return None to fall back to the rules above."""
+
+
+class ModelRouter:
+    def __init__(self, options: RoutingOptions, fast: "LLMBackend"):
+        """Pick the fast or the strong tier for each request of a turn"""
+        self.options = options
+        self.fast = fast
+
+    def route(self, history: History, messages: Sequence[Message]) -> Tier:
+        conversation = [m for m in messages if not isinstance(m, SystemMessage)]
+        last = conversation[-1] if len(conversation) > 0 else None
+        request = RoutingRequest(
+            messages=messages,
+            tokens=sum(history.count_tokens(m) for m in messages),
+            tool_followup=isinstance(last, ToolMessage),
+        )
+        if self.options.rule is not None:
+            if (tier := self.options.rule(request)) is not None:
+                return tier
+        if request.tokens > self.options.max_fast_tokens:
+            return "strong"
+        if self.options.tool_followups and request.tool_followup:
+            return "fast"
+        if (
+            self.options.small_talk
+            and isinstance(last, UserMessage)
+            and isinstance(last.content, str)
+            and _SMALL_TALK.match(last.content)
+        ):
+            return "fast"
+        return "strong"
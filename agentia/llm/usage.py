@@ -0,0 +1,189 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+import json
+from pathlib import Path
+import threading
+import time
+from typing import Any, Iterable, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from ..agent import Agent
+    from ..history import History
+
+
+@dataclass
+class Usage:
+    requests: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    reasoning_tokens: int = 0
+    cached_tokens: int = 0
+    """Prompt tokens served from the provider's prompt cache"""
+    cache_hits: int = 0
+    """Requests served from the local completion cache"""
+    duration: float = 0.0
+    """Total request time, in seconds"""
+    generation_time: float = 0.0
+    """Total time spent generating output tokens (after the first token), in seconds"""
+
+    def __add__(self, other: "Usage") -> "Usage":
+        return Usage(
+            **{k: getattr(self, k) + getattr(other, k) for k in asdict(self).keys()}
+        )
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    @property
+    def prompt_cache_hit_ratio(self) -> float:
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    @property
+    def output_tokens_per_second(self) -> float:
+        if self.generation_time <= 0:
+            return 0.0
+        return self.completion_tokens / self.generation_time
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            **asdict(self),
+            "total_tokens": self.total_tokens,
+            "prompt_cache_hit_ratio": self.prompt_cache_hit_ratio,
+            "output_tokens_per_second": self.output_tokens_per_second,
+        }
+
+
+@dataclass
+class RequestUsage:
+    model: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    reasoning_tokens: int = 0
+    cached_tokens: int = 0
+    ttft: float | None = None
+    """Time to first token, in seconds"""
+    duration: float = 0.0
+    cached: bool = False
+    """Whether the response was served from the local completion cache"""
+    coalesced: bool = False
+    """Whether the response was shared with an identical in-flight request, which is billed instead"""
+    prefix_stability: float | None = None
+    """Fraction of the prompt tokens that are a prefix of the previous request, i.e. cacheable by the provider"""
+    agent: str = ""
+    session: str = ""
+    turn: int = 0
+    timestamp: float = field(default_factory=time.time)
+
+    @property
+    def output_tokens_per_second(self) -> float:
+        generation_time = self.duration - (self.ttft or 0.0)
+        if generation_time <= 0:
+            return 0.0
+        return self.completion_tokens / generation_time
+
+    def to_usage(self) -> Usage:
+        billed = not self.cached and not self.coalesced
+        return Usage(
+            requests=1,
+            prompt_tokens=self.prompt_tokens if billed else 0,
+            completion_tokens=self.completion_tokens if billed else 0,
+            reasoning_tokens=self.reasoning_tokens if billed else 0,
+            cached_tokens=self.cached_tokens if billed else 0,
+            cache_hits=1 if self.cached else 0,
+            duration=self.duration,
+            generation_time=(
+                self.duration - (self.ttft or 0.0)
+                if billed and self.completion_tokens > 0
+                else 0.0
+            ),
+        )
+
+    def to_json(self) -> dict[str, Any]:
+        return asdict(self)
+
+    @staticmethod
+    def from_json(data: dict[str, Any]) -> "RequestUsage":
+        return RequestUsage(**data)
+
+
+# Usage records are appended in order by one background thread, off the event loop
+_WRITER = ThreadPoolExecutor(max_workers=1, thread_name_prefix="agentia-usage")
+
+
+def _append_lines(path: Path, pending: list[str], lock: threading.Lock):
+    """Append the pending lines to `path`, until there are none left"""
+    while True:
+        with lock:
+            lines = pending[:]
+            pending.clear()
+        if len(lines) == 0:
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "a") as f:
+            f.writelines(lines)
+
+
+class UsageTracker:
+    MAX_RECORDS = 1000
+
+    def __init__(self, agent: "Agent", persist: bool = True):
+        """
+        Per-agent token usage accounting. Totals cover the lifetime of the agent (i.e. one session).
+        Each request is also appended to `<agent data folder>/usage.jsonl`, for `agentia stats`.
+        Records are written in a background thread.
+        """
+        self.agent_id = agent.id
+        self.session_id = agent.session_id
+        self.path = agent.agent_data_folder / "usage.jsonl" if persist else None
+        # The history of the current turn, which may not be the agent's own
+        self.history: "History" = agent.history
+        self.totals = Usage()
+        self.records: deque[RequestUsage] = deque(maxlen=UsageTracker.MAX_RECORDS)
+        self.turn = 0
+        self.__pending: list[str] = []
+        self.__lock = threading.Lock()
+
+    def start_turn(self, history: "History"):
+        self.turn += 1
+        self.history = history
+
+    def record(self, r: RequestUsage):
+        r.agent = self.agent_id
+        r.session = self.session_id
+        r.turn = self.turn
+        if r.prefix_stability is None:
+            r.prefix_stability = self.history.prefix_stability
+        self.totals = self.totals + r.to_usage()
+        self.records.append(r)
+        if self.path is not None:
+            with self.__lock:
+                self.__pending.append(json.dumps(r.to_json()) + "\n")
+            _WRITER.submit(_append_lines, self.path, self.__pending, self.__lock)
+
+    def flush(self):
+        """Wait until all the records are written"""
+        if self.path is not None:
+            _WRITER.submit(
+                _append_lines, self.path, self.__pending, self.__lock
+            ).result()
+
+
+def load_usage_records(path: Path) -> list[RequestUsage]:
+    if not path.exists():
+        return []
+    records = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(RequestUsage.from_json(json.loads(line)))
+    return records
+
+
+def summarize(records: Iterable[RequestUsage]) -> Usage:
+    total = Usage()
+    for r in records:
+        total = total + r.to_usage()
+    return total
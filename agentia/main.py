@@ -1,3 +1,4 @@
+from typing import Optional
 import typer
 import agentia.utils
 
@@ -20,9 +21,24 @@ def __check_group():
 
 
 @app.command(help="Start the command line REPL")
-def repl(agent: str):
+def repl(
+    agent: str,
+    markdown: bool = typer.Option(False, help="Render responses as markdown"),
+):
     __check_group()
-    agentia.utils.repl.run(agent)
+    agentia.utils.repl.run(agent, markdown=markdown)
+
+
+@app.command(help="Show token usage and throughput statistics")
+def stats(
+    agent: Optional[str] = typer.Argument(
+        None, help="The agent id. Default to all agents."
+    ),
+    turns: bool = typer.Option(
+        False, help="Also show per-turn statistics of the latest session"
+    ),
+):
+    agentia.utils.stats.run(agent, turns)
 
 
 @app.command(help="Start the web app server")
@@ -1,6 +1,7 @@
 from io import BytesIO, StringIO
 from pathlib import Path
 from typing import (
+    AsyncIterable,
     AsyncIterator,
     Literal,
     Optional,
@@ -15,6 +16,7 @@ from typing import (
     override,
 )
 import json
+import time
 from dataclasses import dataclass, field
 from openai.types.chat import (
     ChatCompletionContentPartTextParam,
@@ -200,7 +202,7 @@ class SystemMessage(BaseMessage):
 
     @override
     def to_json(self) -> Mapping[str, Any]:
-        data: Mapping[str, Any] = {"role": "systen", "content": self.content}
+        data: Mapping[str, Any] = {"role": "system", "content": self.content}
         return data
 
 
@@ -269,6 +271,21 @@ class MessageStream:
     async def wait_for_completion(self) -> AssistantMessage:
         raise NotImplementedError()
 
+    async def aclose(self):
+        """
+        Stop the stream early and abort the underlying request, so that the provider stops generating.
+        The message is then completed with the content received so far.
+        """
+
+    def coalesce(
+        self, interval: float = 0.05, max_chars: int = 4096
+    ) -> AsyncIterator[str]:
+        """
+        Iterate the stream in batches of deltas instead of per token.
+        See `coalesce_deltas`.
+        """
+        return coalesce_deltas(self, interval=interval, max_chars=max_chars)
+
 
 class ReasoningMessageStream:
     type: Literal["message.stream.reasoning"] = "message.stream.reasoning"
@@ -278,3 +295,36 @@ class ReasoningMessageStream:
 
     async def wait_for_completion(self) -> str:
         raise NotImplementedError()
+
+    async def aclose(self):
+        """Stop the stream early and abort the underlying request"""
+
+    def coalesce(
+        self, interval: float = 0.05, max_chars: int = 4096
+    ) -> AsyncIterator[str]:
+        return coalesce_deltas(self, interval=interval, max_chars=max_chars)
+
+
+async def coalesce_deltas(
+    deltas: AsyncIterable[str], interval: float = 0.05, max_chars: int = 4096
+) -> AsyncIterator[str]:
+    """
+    Batch a stream of text deltas. A batch is yielded once `interval` seconds have passed since the previous one,
+    or once it has at least `max_chars` characters. The rest is yielded at the end of the stream.
+    """
+    batch: list[str] = []
+    size = 0
+    last = time.monotonic()
+    async for delta in deltas:
+        if not delta:
+            continue
+        batch.append(delta)
+        size += len(delta)
+        now = time.monotonic()
+        if size >= max_chars or now - last >= interval:
+            yield "".join(batch)
+            batch.clear()
+            size = 0
+            last = now
+    if batch:
+        yield "".join(batch)
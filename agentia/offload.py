@@ -0,0 +1,78 @@
+from dataclasses import dataclass
+import hashlib
+import os
+from pathlib import Path
+import shutil
+
+OFFLOADED_PREFIX = "[Tool result offloaded"
+
+
+@dataclass
+class ToolResultAging:
+    max_age: int = 2
+    """Keep the tool results of the current and the last `max_age` turns"""
+    max_tokens: int | None = 16000
+    """Also offload the oldest tool results once all tool results exceed this number of tokens"""
+    min_chars: int = 1000
+    """Tool results shorter than this are always kept"""
+    head_chars: int = 400
+    """Number of leading characters kept inline. Set to 0 to only keep a reference."""
+
+
+class OffloadStore:
+    def __init__(self, path: Path | None = None):
+        """
+        Content-addressed store of offloaded tool results.
+
+        :param path: Directory to keep the payloads in. Payloads are kept in memory if not provided.
+        """
+        self.path = path
+        self.__memory: dict[str, str] = {}
+
+    def put(self, content: str) -> str:
+        """Store the content and return its reference"""
+        ref = hashlib.sha256(content.encode()).hexdigest()[:16]
+        if self.path is None:
+            self.__memory[ref] = content
+        else:
+            file = self.path / ref
+            if not file.exists():
+                self.path.mkdir(parents=True, exist_ok=True)
+                file.write_text(content)
+        return ref
+
+    def get(self, ref: str) -> str | None:
+        if self.path is None:
+            return self.__memory.get(ref)
+        file = self.path / ref
+        if not ref.isalnum() or not file.exists():
+            return None
+        return file.read_text()
+
+    def move(self, path: Path):
+        """Move the payloads to `path`, e.g. next to the persisted history once the session is persisted"""
+        if path == self.path:
+            return
+        path.mkdir(parents=True, exist_ok=True)
+        if self.path is None:
+            for ref, content in self.__memory.items():
+                (path / ref).write_text(content)
+            self.__memory = {}
+        elif self.path.exists():
+            for file in self.path.iterdir():
+                os.replace(file, path / file.name)
+            shutil.rmtree(self.path, ignore_errors=True)
+        self.path = path
+
+    def clear(self):
+        """Delete all payloads"""
+        self.__memory = {}
+        if self.path is not None:
+            shutil.rmtree(self.path, ignore_errors=True)
+
+
+def offloaded_content(content: str, ref: str, head_chars: int) -> str:
+    note = f"{OFFLOADED_PREFIX}: {len(content)} chars, ref={ref}. Call `_get_tool_result` with this ref to read the full content.]"
+    if head_chars <= 0:
+        return note
+    return f"{note}\n{content[:head_chars]} ..."
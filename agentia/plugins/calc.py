@@ -4,7 +4,7 @@ from typing import Annotated
 
 
 class CalculatorPlugin(Plugin):
-    @tool
+    @tool(cache=True)
     def evaluate(
         self,
         expression: Annotated[
@@ -64,7 +64,7 @@ class SearchPlugin(Plugin):
             return {"error": "Failed to get search result"}
         return [r.to_dict() for r in res.tasks[0].result or []]
 
-    @tool
+    @tool(cache=True, cache_ttl=3600, cache_on_disk=True)
     def google_search(self, keywords: Annotated[str, "The keywords to search"]):
         """Perform Google Search using the given keywords. Returning the top 10 search result in json format. When necessary, you need to combine this tool with the getWebPageContent tools (if available), to browse the web in depth by jumping through links."""
         response = self.__api.google_organic_live_regular(
@@ -79,7 +79,7 @@ class SearchPlugin(Plugin):
         )
         return self.__process_result(response)
 
-    @tool
+    @tool(cache=True, cache_ttl=3600, cache_on_disk=True)
     def google_news_search(self, keywords: Annotated[str, "The keywords to search"]):
         """Perform Google News Search using the given keywords, to search news related to the given topics. Returning the top 5 search result in json format."""
         response = self.__api.google_news_live_advanced(
@@ -94,7 +94,7 @@ class SearchPlugin(Plugin):
         )
         return self.__process_result(response)
 
-    @tool
+    @tool(cache=True, cache_ttl=3600, cache_on_disk=True)
     def google_map_search(self, keywords: Annotated[str, "The keywords to search"]):
         """Perform Google Map Search using the given keywords. Returning the top 10 search result in json format. This is helpful to get the address, website, opening hours, and contact information of a place or store."""
         response = self.__api.google_maps_live_advanced(
@@ -1,6 +1,7 @@
 from typing import Annotated, Any
 
 from ..decorators import *
+from ..utils.images import preprocess_image_url
 from . import Plugin
 from openai import AsyncOpenAI
 
@@ -20,6 +21,7 @@ class VisionPlugin(Plugin):
         image_url: Annotated[str, "The URL of the image to analyze."],
     ):
         """Use gpt-4-vision-preview to analyze an image. Returning the analysis result."""
+        image_url = await preprocess_image_url(image_url)
         response = await self.client.chat.completions.create(
             model="gpt-4o",
             messages=[
@@ -1,13 +1,38 @@
+import asyncio
 from io import BytesIO
 from ..decorators import *
 from . import Plugin
-from typing import Annotated
-import requests
-from markdownify import markdownify
+from typing import Annotated, Any
+import httpx
 import uuid
+from ..utils.html import PageContent, extract_main_content
+from ..utils.http import Fetcher, HTTPResponse
+
+
+def _share_budget(sizes: dict[str, int], budget: int) -> dict[str, int]:
+    """Split a token budget between pages. Short pages get all they need, and the rest is shared equally by the longer ones."""
+    shares: dict[str, int] = {}
+    ordered = sorted(sizes, key=lambda k: sizes[k])
+    for i, k in enumerate(ordered):
+        shares[k] = min(sizes[k], budget // (len(ordered) - i))
+        budget -= shares[k]
+    return shares
 
 
 class WebPlugin(Plugin):
+    async def init(self):
+        from ..agent import _get_global_cache_dir
+
+        config = self.config or {}
+        # Pages are cached across agents and sessions, following their HTTP caching headers
+        self.__fetcher = Fetcher.shared(_get_global_cache_dir() / "http-cache.db")
+        self.__max_bytes: int | None = config.get("max_bytes")
+        # Long pages are split into pages of this many tokens
+        self.__max_tokens: int = config.get("max_tokens", 4000)
+        # Limits of get_webpages
+        self.__max_urls: int = config.get("max_urls", 10)
+        self.__batch_max_tokens: int = config.get("batch_max_tokens", 8000)
+        self.__batch_timeout: float = config.get("batch_timeout", 30)
 
     def __embed_file(self, content: bytes, file_ext: str):
         assert self.agent.knowledge_base is not None
@@ -22,18 +47,98 @@ class WebPlugin(Plugin):
             "hint": f"This is a .{file_ext} file and it is embeded in the knowledge base. Use _file_search to query the content.",
         }
 
-    @tool
-    def get_webpage_content(
-        self,
-        url: Annotated[str, "The URL of the web page to get the content of"],
-    ):
-        """Access a web page by a URL, and fetch the content of this web page (in markdown format). You can always use this tool to directly access web content or access external sites. Use it at any time when you think you may need to access the internet."""
-        res = requests.get(url)
-        content_type = res.headers.get("content-type")
-        if content_type == "application/pdf":
+    async def __fetch_page(
+        self, url: str
+    ) -> tuple[HTTPResponse, PageContent] | dict[str, Any]:
+        """Fetch and extract a web page. Returns the tool result instead if it can't be extracted."""
+        try:
+            res = await self.__fetcher.fetch(url, max_bytes=self.__max_bytes)
+        except httpx.HTTPError as e:
+            return {"error": f"Failed to fetch {url}: {e!r}"}
+        if res.status >= 400:
+            return {"error": f"Failed to fetch {url}: HTTP {res.status}"}
+        if res.content_type == "application/pdf":
             # Add this file to the knowledge base
             if self.agent.knowledge_base is not None:
                 return self.__embed_file(res.content, "pdf")
             return {"content": "This is a PDF file. You don't know how to view it."}
-        md = markdownify(res.text)
-        return {"content": md}
+        extract = await extract_main_content(
+            res.text,
+            page_tokens=self.__max_tokens,
+            is_html="html" in res.content_type or res.content_type == "",
+        )
+        return res, extract
+
+    @tool(cache=True, cache_ttl=600)
+    async def get_webpage_content(
+        self,
+        url: Annotated[str, "The URL of the web page to get the content of"],
+        page: Annotated[
+            int, "Long web pages are split into pages. Default to the first page."
+        ] = 1,
+    ):
+        """Access a web page by a URL, and fetch the main content of this web page (in markdown format). You can always use this tool to directly access web content or access external sites. Use it at any time when you think you may need to access the internet."""
+        page_or_result = await self.__fetch_page(url)
+        if isinstance(page_or_result, dict):
+            return page_or_result
+        res, extract = page_or_result
+        pages = len(extract.pages)
+        if page < 1 or page > pages:
+            return {"error": f"Invalid page {page}. The web page has {pages} pages."}
+        result: dict[str, Any] = {"content": extract.pages[page - 1]}
+        if extract.title is not None:
+            result["title"] = extract.title
+        if pages > 1:
+            result["page"] = f"{page} of {pages}"
+            if page < pages:
+                result["hint"] = f"Call again with page={page + 1} to read more."
+        if res.truncated:
+            result["truncated"] = True
+        return result
+
+    @tool
+    async def get_webpages(
+        self,
+        urls: Annotated[list[str], "The URLs of the web pages to get the content of"],
+    ):
+        """Fetch the main content of multiple web pages at once (in markdown format). Prefer this over calling get_webpage_content once per URL, e.g. to read several search results. Long pages are shortened to share one token budget. Use get_webpage_content to read more of a page."""
+        urls = list(dict.fromkeys(urls))
+        skipped = urls[self.__max_urls :]
+        urls = urls[: self.__max_urls]
+        tasks = {asyncio.ensure_future(self.__fetch_page(url)): url for url in urls}
+        try:
+            _, pending = await asyncio.wait(tasks, timeout=self.__batch_timeout)
+        finally:
+            for task in tasks:
+                task.cancel()
+        if len(pending) > 0:
+            await asyncio.wait(pending)
+        results: dict[str, dict[str, Any]] = {}
+        extracts: dict[str, tuple[HTTPResponse, PageContent]] = {}
+        for task, url in tasks.items():
+            if task in pending:
+                error = f"Timed out after {self.__batch_timeout} seconds"
+                results[url] = {"error": f"Failed to fetch {url}: {error}"}
+            elif (e := task.exception()) is not None:
+                results[url] = {"error": f"Failed to fetch {url}: {e!r}"}
+            elif isinstance(r := task.result(), dict):
+                results[url] = r
+            else:
+                extracts[url] = r
+        budgets = _share_budget(
+            {url: sum(e.tokens) for url, (_, e) in extracts.items()},
+            self.__batch_max_tokens,
+        )
+        for url, (res, extract) in extracts.items():
+            result: dict[str, Any] = {"content": extract.head(budgets[url])}
+            if extract.title is not None:
+                result["title"] = extract.title
+            if budgets[url] < sum(extract.tokens) or res.truncated:
+                result["truncated"] = True
+            results[url] = result
+        output: list[dict[str, Any]] = [{"url": url, **results[url]} for url in urls]
+        for url in skipped:
+            output.append(
+                {"url": url, "error": f"Skipped. At most {self.__max_urls} URLs."}
+            )
+        return output
@@ -0,0 +1,260 @@
+import abc
+import json
+import logging
+import os
+from pathlib import Path
+import re
+import sqlite3
+import threading
+from typing import Any, Iterator, Mapping
+
+LOGGER = logging.getLogger("agentia.session_store")
+
+_INDEX_PATTERN = re.compile(rb'^\{"i": (\d+)')
+_TRUNCATE_PATTERN = re.compile(rb'^\{"truncate": (\d+)')
+# Session IDs are used as file names, so they must not contain path separators or start with a dot
+_SESSION_PATTERN = re.compile(r"[A-Za-z0-9_][A-Za-z0-9._-]*")
+
+
+class SessionStore(abc.ABC):
+    """
+    Persistent storage of conversation histories, keyed by session ID.
+    Each message is stored as it is added to the history, so a crashed or restarted process can resume the session.
+    """
+
+    @abc.abstractmethod
+    def write(self, session: str, index: int, message: Mapping[str, Any]):
+        """Set the message at `index`. Appends the message if `index` is the length of the session."""
+        ...
+
+    @abc.abstractmethod
+    def truncate(self, session: str, length: int):
+        """Remove all messages from `length` onwards"""
+        ...
+
+    @abc.abstractmethod
+    def length(self, session: str) -> int: ...
+
+    @abc.abstractmethod
+    def read(
+        self, session: str, start: int = 0, end: int | None = None
+    ) -> list[Mapping[str, Any]]: ...
+
+    def read_reversed(self, session: str) -> Iterator[tuple[int, Mapping[str, Any]]]:
+        """Read messages from the newest to the oldest, together with their indices"""
+        for i in range(self.length(session) - 1, -1, -1):
+            yield i, self.read(session, i, i + 1)[0]
+
+    @abc.abstractmethod
+    def delete(self, session: str): ...
+
+
+class JsonlSessionStore(SessionStore):
+    def __init__(self, path: Path, compact_ratio: float = 2.0):
+        """
+        Store each session as an append-only JSONL log under `path`.
+        Each line either sets a message (`{"i": index, "m": message}`) or truncates the session (`{"truncate": length}`).
+        Resuming a session only parses the messages that are actually read.
+
+        The log of a session is rewritten once it has more than `compact_ratio` times as many records as live messages.
+        A session must only be written by one process at a time. Use `SqliteSessionStore` for multi-process access.
+        """
+        self.path = path
+        self.compact_ratio = compact_ratio
+        self.__offsets: dict[str, list[int]] = {}
+        self.__records: dict[str, int] = {}
+        self.__lock = threading.Lock()
+
+    def __file(self, session: str) -> Path:
+        if _SESSION_PATTERN.fullmatch(session) is None:
+            raise ValueError(f"Invalid session ID: {session!r}")
+        return self.path / f"{session}.jsonl"
+
+    def __load_offsets(self, session: str) -> list[int]:
+        """Scan the log to find the latest record of each message, without parsing the messages"""
+        if session in self.__offsets:
+            return self.__offsets[session]
+        offsets: list[int] = []
+        records = 0
+        file = self.__file(session)
+        pos = 0
+        torn = False
+        if file.exists():
+            with open(file, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # A partial record from a crash during a write
+                        torn = True
+                        break
+                    records += 1
+                    if m := _INDEX_PATTERN.match(line):
+                        i = int(m.group(1))
+                        if i == len(offsets):
+                            offsets.append(pos)
+                        elif i < len(offsets):
+                            offsets[i] = pos
+                    elif m := _TRUNCATE_PATTERN.match(line):
+                        del offsets[int(m.group(1)) :]
+                    pos += len(line)
+        if torn:
+            # Drop it, so that new records are not appended to it
+            LOGGER.warning(f"Dropping a partial record at the end of {file}")
+            os.truncate(file, pos)
+        self.__offsets[session] = offsets
+        self.__records[session] = records
+        return offsets
+
+    def __append(self, session: str, record: dict[str, Any]) -> int:
+        """Append a record and return its offset"""
+        file = self.__file(session)
+        file.parent.mkdir(parents=True, exist_ok=True)
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with open(file, "ab") as f:
+            offset = f.tell()
+            f.write(line.encode())
+        self.__records[session] += 1
+        return offset
+
+    def write(self, session: str, index: int, message: Mapping[str, Any]):
+        with self.__lock:
+            offsets = self.__load_offsets(session)
+            assert index <= len(offsets), "Message index out of range"
+            offset = self.__append(session, {"i": index, "m": message})
+            if index == len(offsets):
+                offsets.append(offset)
+            else:
+                offsets[index] = offset
+            self.__maybe_compact(session)
+
+    def truncate(self, session: str, length: int):
+        with self.__lock:
+            offsets = self.__load_offsets(session)
+            if length >= len(offsets):
+                return
+            self.__append(session, {"truncate": length})
+            del offsets[length:]
+            self.__maybe_compact(session)
+
+    def length(self, session: str) -> int:
+        with self.__lock:
+            return len(self.__load_offsets(session))
+
+    def read(
+        self, session: str, start: int = 0, end: int | None = None
+    ) -> list[Mapping[str, Any]]:
+        with self.__lock:
+            offsets = self.__load_offsets(session)[start:end]
+            if len(offsets) == 0:
+                return []
+            messages = []
+            with open(self.__file(session), "rb") as f:
+                for offset in offsets:
+                    f.seek(offset)
+                    messages.append(json.loads(f.readline())["m"])
+            return messages
+
+    def read_reversed(self, session: str) -> Iterator[tuple[int, Mapping[str, Any]]]:
+        with self.__lock:
+            offsets = list(self.__load_offsets(session))
+        if len(offsets) == 0:
+            return
+        with open(self.__file(session), "rb") as f:
+            for i in range(len(offsets) - 1, -1, -1):
+                f.seek(offsets[i])
+                yield i, json.loads(f.readline())["m"]
+
+    def delete(self, session: str):
+        with self.__lock:
+            self.__offsets.pop(session, None)
+            self.__records.pop(session, None)
+            self.__file(session).unlink(missing_ok=True)
+
+    def __maybe_compact(self, session: str):
+        offsets = self.__offsets[session]
+        if self.__records[session] <= max(len(offsets), 16) * self.compact_ratio:
+            return
+        # Rewrite the live messages to a new log, and atomically replace the old one
+        file = self.__file(session)
+        tmp = file.with_suffix(".jsonl.tmp")
+        new_offsets: list[int] = []
+        with open(file, "rb") as src, open(tmp, "wb") as dst:
+            for i, offset in enumerate(offsets):
+                src.seek(offset)
+                record = json.loads(src.readline())
+                new_offsets.append(dst.tell())
+                line = json.dumps({"i": i, "m": record["m"]}, ensure_ascii=False)
+                dst.write((line + "\n").encode())
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(tmp, file)
+        self.__offsets[session] = new_offsets
+        self.__records[session] = len(new_offsets)
+
+
+class SqliteSessionStore(SessionStore):
+    def __init__(self, path: Path):
+        """
+        Store sessions in a SQLite database in WAL mode, which can be shared by multiple processes.
+        Messages are updated in place, so no compaction is needed.
+        """
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(str(path), check_same_thread=False)
+        self.__db.execute("PRAGMA journal_mode=WAL")
+        self.__db.execute("PRAGMA synchronous=NORMAL")
+        self.__db.execute(
+            "CREATE TABLE IF NOT EXISTS messages (session TEXT NOT NULL, idx INTEGER NOT NULL, message TEXT NOT NULL, PRIMARY KEY (session, idx))"
+        )
+        self.__db.commit()
+
+    def write(self, session: str, index: int, message: Mapping[str, Any]):
+        with self.__lock:
+            self.__db.execute(
+                "INSERT OR REPLACE INTO messages (session, idx, message) VALUES (?, ?, ?)",
+                (session, index, json.dumps(message, ensure_ascii=False)),
+            )
+            self.__db.commit()
+
+    def truncate(self, session: str, length: int):
+        with self.__lock:
+            self.__db.execute(
+                "DELETE FROM messages WHERE session = ? AND idx >= ?", (session, length)
+            )
+            self.__db.commit()
+
+    def length(self, session: str) -> int:
+        with self.__lock:
+            (count,) = self.__db.execute(
+                "SELECT COUNT(*) FROM messages WHERE session = ?", (session,)
+            ).fetchone()
+            return count
+
+    def read(
+        self, session: str, start: int = 0, end: int | None = None
+    ) -> list[Mapping[str, Any]]:
+        with self.__lock:
+            rows = self.__db.execute(
+                "SELECT message FROM messages WHERE session = ? AND idx >= ? AND idx < ? ORDER BY idx",
+                (session, start, end if end is not None else 2**62),
+            ).fetchall()
+            return [json.loads(row[0]) for row in rows]
+
+    def read_reversed(self, session: str) -> Iterator[tuple[int, Mapping[str, Any]]]:
+        end = 2**62
+        while True:
+            with self.__lock:
+                rows = self.__db.execute(
+                    "SELECT idx, message FROM messages WHERE session = ? AND idx < ? ORDER BY idx DESC LIMIT 64",
+                    (session, end),
+                ).fetchall()
+            if len(rows) == 0:
+                return
+            for idx, message in rows:
+                yield idx, json.loads(message)
+            end = rows[-1][0]
+
+    def delete(self, session: str):
+        with self.__lock:
+            self.__db.execute("DELETE FROM messages WHERE session = ?", (session,))
+            self.__db.commit()
@@ -1,12 +1,15 @@
-from dataclasses import dataclass
+import asyncio
+from dataclasses import dataclass, field
 from enum import Enum, StrEnum
 import inspect
 from inspect import Parameter
 import json
+import time
 import types
 from typing import (
     Annotated,
     Any,
+    Awaitable,
     Callable,
     Literal,
     Sequence,
@@ -23,9 +26,12 @@ from agentia.agent import ToolCallEvent
 from .message import JSON, FunctionCall, Message, Role, ToolCall, ToolMessage
 
 from .plugins import Plugin
+from .utils.cache import DiskCache, MemoryCache, stable_hash
+from .utils.singleflight import SingleFlight
+from .utils.deadline import Deadline, DeadlineExceeded
+from .utils.tracing import start_span
 from pydantic import BaseModel
 
-
 Tool = Plugin | Callable[..., Any]
 
 Tools = Sequence[Tool]
@@ -37,6 +43,28 @@ NAME_TAG = "agentia_tool_name"
 DISPLAY_NAME_TAG = "agentia_tool_display_name"
 IS_TOOL_TAG = "agentia_tool_is_tool"
 DESCRIPTION_TAG = "agentia_tool_description"
+PURE_TAG = "agentia_tool_pure"
+CACHE_TAG = "agentia_tool_cache"
+
+_INFLIGHT_TOOL_CALLS = SingleFlight()
+
+
+@dataclass
+class ToolCacheOptions:
+    ttl: float | None = None
+    max_size: int = 1024
+    on_disk: bool = False
+    memory: MemoryCache = field(init=False)
+
+    def __post_init__(self):
+        # The memory tier is shared by all agents that use this tool
+        self.memory = MemoryCache(max_entries=self.max_size, ttl=self.ttl)
+
+
+@dataclass
+class ToolCacheStats:
+    hits: int = 0
+    misses: int = 0
 
 
 @dataclass
@@ -46,6 +74,9 @@ class ToolInfo:
     description: str
     parameters: dict[str, Any]
     callable: Callable[..., Any]
+    pure: bool = False
+    cache: ToolCacheOptions | None = None
+    cache_stats: ToolCacheStats = field(default_factory=ToolCacheStats)
 
     def to_json(self) -> JSON:
         return {
@@ -65,6 +96,7 @@ class ToolRegistry:
     def __init__(self, agent: "Agent", tools: Tools | None = None) -> None:
         self.__functions: dict[str, ToolInfo] = {}
         self.__plugins: dict[str, Plugin] = {}
+        self.__disk_cache: DiskCache | None = None
         self._agent = agent
         for t in tools or []:
             if inspect.isfunction(t):
@@ -140,6 +172,14 @@ class ToolRegistry:
                 # integer type
                 case x if x == int:
                     prop["type"] = "integer"
+                # string to string mapping
+                case x if get_origin(x) == dict and get_args(x) == (str, str):
+                    prop["type"] = "object"
+                    prop["additionalProperties"] = {"type": "string"}
+                # list of strings
+                case x if get_origin(x) == list and get_args(x) == (str,):
+                    prop["type"] = "array"
+                    prop["items"] = {"type": "string"}
                 # string enum
                 case x if get_origin(x) == Annotated and get_args(x)[0] == str:
                     prop["type"] = "string"
@@ -191,6 +231,8 @@ class ToolRegistry:
             description=getattr(f, DESCRIPTION_TAG, f.__doc__) or "",
             parameters=params,
             callable=f,
+            pure=getattr(f, PURE_TAG, False),
+            cache=getattr(f, CACHE_TAG, None),
         )
         self.__functions[tool_info.name] = tool_info
         return tool_info
@@ -274,23 +316,113 @@ class ToolRegistry:
         # key = func_name if not func_name.startswith("functions.") else func_name[10:]
         if name not in self.__functions:
             return {"error": f"Tool `{name}` not found"}
-        func = self.__functions[name].callable
-        raw_args = args
+        info = self.__functions[name]
+        func = info.callable
         args, kw_args = self.__filter_args(func, args)
-        try:
+
+        async def invoke():
             result_or_coroutine = func(*args, **kw_args)
             if inspect.iscoroutine(result_or_coroutine):
-                result = await result_or_coroutine
+                return await result_or_coroutine
+            return result_or_coroutine
+
+        try:
+            if info.pure:
+                key = stable_hash(
+                    self.__tool_identity(info), self.__normalize_args(args, kw_args)
+                )
+
+                async def coalesced():
+                    return await _INFLIGHT_TOOL_CALLS.do(key, invoke)
+
+                # Only async tools can have concurrent calls to share
+                call = coalesced if inspect.iscoroutinefunction(func) else invoke
+                if info.cache is not None:
+                    result = await self.__call_cached(info, key, call)
+                else:
+                    result = await call()
             else:
-                result = result_or_coroutine
+                result = await invoke()
         except BaseException as e:
             # print(e)
             raise e
             result = {"error": f"Failed to run tool `{name}`: {e}"}
-        result_s = json.dumps(result)
+        result_s = json.dumps(result, default=str)
         self._agent.log.info(f"TOOL#{tool_id} {name} -> {result_s}")
         return result
 
+    def __normalize_args(self, args: list[Any], kw_args: dict[str, Any]) -> JSON:
+        """Arguments with defaults filled in, excluding the injected agent"""
+        from .agent import Agent
+
+        return [
+            [a for a in args if not isinstance(a, Agent)],
+            {k: v for k, v in kw_args.items() if not isinstance(v, Agent)},
+        ]
+
+    async def __call_cached(
+        self, info: ToolInfo, key: str, invoke: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        assert info.cache is not None
+        # Results are wrapped so that `None` results can be cached as well
+        entry = info.cache.memory.get(key)
+        if entry is None and info.cache.on_disk:
+            disk = self.__get_disk_cache()
+            disk_entry = await asyncio.to_thread(disk.get_entry, key)
+            ttl = info.cache.ttl
+            if disk_entry is not None and (
+                ttl is None or time.time() - disk_entry[1] <= ttl
+            ):
+                entry, created = disk_entry
+                info.cache.memory.put(key, entry, created=created)
+        if entry is not None:
+            info.cache_stats.hits += 1
+            self._agent.log.debug(f"TOOL-CACHE HIT {info.name}")
+            return entry["result"]
+        info.cache_stats.misses += 1
+        result = await invoke()
+        if isinstance(result, dict) and "error" in result:
+            return result
+        entry = {"result": result}
+        info.cache.memory.put(key, entry)
+        if info.cache.on_disk:
+            try:
+                disk = self.__get_disk_cache()
+                await asyncio.to_thread(disk.put, key, entry)
+            except (TypeError, ValueError) as e:
+                # Not JSON-serializable. Only cached in memory.
+                self._agent.log.debug(f"TOOL-CACHE {info.name} not stored on disk: {e}")
+        return result
+
+    def __get_disk_cache(self) -> DiskCache:
+        # Shared by all the tools of this agent. TTLs are checked per tool on lookup.
+        if self.__disk_cache is None:
+            path = self._agent.agent_data_folder / "tool-cache.db"
+            self.__disk_cache = DiskCache(path)
+        return self.__disk_cache
+
+    def get_cache_stats(self) -> dict[str, ToolCacheStats]:
+        """Get the cache hit and miss counters of all the tools with caching enabled"""
+        return {
+            name: info.cache_stats
+            for name, info in self.__functions.items()
+            if info.cache is not None
+        }
+
+    def __tool_identity(self, info: ToolInfo) -> JSON:
+        """A key that identifies the implementation of a tool across agents and sessions"""
+        func = info.callable
+        owner = getattr(func, "__self__", None)
+        if isinstance(owner, Plugin):
+            # Plugin methods of the same class behave the same if the configs are the same
+            cls = owner.__class__
+            return [cls.__module__, cls.__qualname__, func.__name__, owner.config]
+        qualname = func.__qualname__
+        if "<locals>" in qualname or "<lambda>" in qualname:
+            # Closures and lambdas with the same name may behave differently
+            return [func.__module__, qualname, id(func)]
+        return [func.__module__, qualname]
+
     async def call_function(
         self, function_call: FunctionCall, tool_id: str | None
     ) -> Any:
@@ -299,7 +431,14 @@ class ToolRegistry:
         result = await self.call_function_raw(func_name, arguments, tool_id)
         return result
 
-    async def call_tools(self, tool_calls: Sequence[ToolCall]):
+    async def call_tools(
+        self, tool_calls: Sequence[ToolCall], deadline: Deadline | None = None
+    ):
+        """
+        Run the tool calls one by one, and yield their results.
+        If `deadline` expires, the running and remaining tool calls are cancelled and yield errors,
+        so every tool call still gets a result.
+        """
         for t in tool_calls:
             assert t.type == "function"
             assert t.function.name in self.__functions
@@ -311,7 +450,21 @@ class ToolRegistry:
                     agent=self._agent, tool=info, id=t.id, function=t.function
                 )
             )
-            raw_result = await self.call_function(t.function, tool_id=t.id)
+            with start_span("tool", tool=name, agent=self._agent.name) as span:
+                if deadline is None:
+                    raw_result = await self.call_function(t.function, tool_id=t.id)
+                else:
+                    try:
+                        # Tools (and colleagues called by them) inherit the deadline
+                        with deadline.activate():
+                            raw_result = await deadline.run(
+                                self.call_function(t.function, tool_id=t.id)
+                            )
+                    except DeadlineExceeded:
+                        span.set(error="deadline_exceeded")
+                        raw_result = {
+                            "error": f"Tool `{name}` was cancelled: the deadline of this turn was exceeded"
+                        }
             await self._agent._emit_tool_call_event(
                 ToolCallEvent(
                     agent=self._agent,
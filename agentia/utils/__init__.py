@@ -1,3 +1,12 @@
-from . import config, voice, repl
+from . import cache, config, images, render, tracing, voice, repl, stats
 
-__all__ = ["voice", "config", "repl"]
+__all__ = [
+    "cache",
+    "voice",
+    "config",
+    "images",
+    "render",
+    "repl",
+    "tracing",
+    "stats",
+]
@@ -0,0 +1,241 @@
+from collections import OrderedDict
+from pathlib import Path
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Callable
+
+
+def stable_hash(*parts: Any) -> str:
+    """
+    Hash a sequence of JSON-serializable values into a stable hex digest.
+    Dictionary keys are sorted so that logically equal values always produce the same hash.
+    """
+    data = json.dumps(
+        parts, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class MemoryCache:
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: float | None = None,
+        max_bytes: int | None = None,
+        sizeof: Callable[[Any], int] | None = None,
+    ):
+        """
+        An in-memory LRU cache.
+
+        :param max_entries: Maximum number of entries to keep. The least recently used entries are evicted first.
+        :param ttl: Optional time-to-live of each entry, in seconds.
+        :param max_bytes: Optional limit of the total size of the values, as measured by `sizeof`. Larger values are not cached.
+        """
+        assert max_bytes is None or sizeof is not None, "sizeof is required"
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.__entries: OrderedDict[str, tuple[float, Any, int]] = OrderedDict()
+        self.__bytes = 0
+        self.__lock = threading.Lock()
+
+    def get(self, key: str) -> Any | None:
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                return None
+            created, value, size = entry
+            if self.ttl is not None and time.time() - created > self.ttl:
+                del self.__entries[key]
+                self.__bytes -= size
+                return None
+            self.__entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: Any, created: float | None = None):
+        size = self.sizeof(value) if self.sizeof is not None else 0
+        with self.__lock:
+            if (old := self.__entries.pop(key, None)) is not None:
+                self.__bytes -= old[2]
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self.__entries[key] = (created or time.time(), value, size)
+            self.__bytes += size
+            while len(self.__entries) > self.max_entries or (
+                self.max_bytes is not None and self.__bytes > self.max_bytes
+            ):
+                self.__bytes -= self.__entries.popitem(last=False)[1][2]
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.__bytes = 0
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+
+class DiskCache:
+    def __init__(
+        self,
+        path: Path,
+        max_entries: int = 100000,
+        ttl: float | None = None,
+        max_bytes: int | None = None,
+    ):
+        """
+        A persistent LRU cache backed by a SQLite database. Values must be JSON-serializable.
+
+        :param path: Path to the database file. Parent directories are created if necessary.
+        :param max_entries: Maximum number of entries to keep. The least recently used entries are evicted first.
+        :param ttl: Optional time-to-live of each entry, in seconds.
+        :param max_bytes: Optional limit of the total size of the serialized values.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(str(path), check_same_thread=False)
+        self.__db.execute("PRAGMA journal_mode=WAL")
+        self.__db.execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL, size INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = [row[1] for row in self.__db.execute("PRAGMA table_info(entries)")]
+        if "size" not in columns:
+            # Databases created before sizes were recorded
+            self.__db.execute(
+                "ALTER TABLE entries ADD COLUMN size INTEGER NOT NULL DEFAULT 0"
+            )
+            self.__db.execute("UPDATE entries SET size = LENGTH(value)")
+        # Covers the eviction queries, without reading the values
+        self.__db.execute(
+            "CREATE INDEX IF NOT EXISTS entries_lru ON entries (accessed, size, key)"
+        )
+        self.__db.commit()
+
+    def get(self, key: str) -> Any | None:
+        entry = self.get_entry(key)
+        return entry[0] if entry is not None else None
+
+    def get_entry(self, key: str) -> tuple[Any, float] | None:
+        """Get a value together with its creation time"""
+        with self.__lock:
+            row = self.__db.execute(
+                "SELECT value, created FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            now = time.time()
+            if self.ttl is not None and now - created > self.ttl:
+                self.__db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.__db.commit()
+                return None
+            self.__db.execute(
+                "UPDATE entries SET accessed = ? WHERE key = ?", (now, key)
+            )
+            self.__db.commit()
+            return json.loads(value), created
+
+    def put(self, key: str, value: Any):
+        now = time.time()
+        data = json.dumps(value)
+        with self.__lock:
+            self.__db.execute(
+                "INSERT OR REPLACE INTO entries (key, value, created, accessed, size) VALUES (?, ?, ?, ?, ?)",
+                (key, data, now, now, len(data)),
+            )
+            self.__evict()
+            self.__db.commit()
+
+    def __evict(self):
+        if self.ttl is not None:
+            self.__db.execute(
+                "DELETE FROM entries WHERE created < ?", (time.time() - self.ttl,)
+            )
+        (count,) = self.__db.execute("SELECT COUNT(*) FROM entries").fetchone()
+        if count > self.max_entries:
+            self.__db.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY accessed ASC LIMIT ?)",
+                (count - self.max_entries,),
+            )
+        if self.max_bytes is not None:
+            (total,) = self.__db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+            if total <= self.max_bytes:
+                return
+            excess = total - self.max_bytes
+            evicted: list[str] = []
+            for key, size in self.__db.execute(
+                "SELECT key, size FROM entries ORDER BY accessed ASC"
+            ):
+                evicted.append(key)
+                excess -= size
+                if excess <= 0:
+                    break
+            self.__db.executemany(
+                "DELETE FROM entries WHERE key = ?", [(k,) for k in evicted]
+            )
+
+    def clear(self):
+        with self.__lock:
+            self.__db.execute("DELETE FROM entries")
+            self.__db.commit()
+
+    def __len__(self) -> int:
+        with self.__lock:
+            (count,) = self.__db.execute("SELECT COUNT(*) FROM entries").fetchone()
+            return count
+
+
+class TieredCache:
+    def __init__(
+        self,
+        path: Path | None = None,
+        max_entries: int = 1024,
+        max_disk_entries: int = 100000,
+        ttl: float | None = None,
+    ):
+        """
+        A two-level cache: a small in-memory LRU tier in front of an optional on-disk tier.
+
+        :param path: Path to the on-disk database. The disk tier is disabled if not provided.
+        :param max_entries: Maximum number of entries in the memory tier.
+        :param max_disk_entries: Maximum number of entries in the disk tier.
+        :param ttl: Optional time-to-live of each entry, in seconds.
+        """
+        self.memory = MemoryCache(max_entries=max_entries, ttl=ttl)
+        self.disk = (
+            DiskCache(path, max_entries=max_disk_entries, ttl=ttl)
+            if path is not None
+            else None
+        )
+
+    def get(self, key: str) -> Any | None:
+        value = self.memory.get(key)
+        if value is not None or self.disk is None:
+            return value
+        entry = self.disk.get_entry(key)
+        if entry is None:
+            return None
+        # Promote to the memory tier, keeping the original creation time for TTL
+        value, created = entry
+        self.memory.put(key, value, created=created)
+        return value
+
+    def put(self, key: str, value: Any):
+        self.memory.put(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
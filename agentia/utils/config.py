@@ -2,7 +2,10 @@ from typing import Any
 import yaml
 from pathlib import Path
 
-from agentia.agent import Agent
+from agentia.agent import Agent, ColleagueSessions
+from agentia.llm.compaction import CompactionOptions
+from agentia.llm.routing import RoutingOptions
+from agentia.offload import ToolResultAging
 from agentia.plugins import ALL_PLUGINS, Plugin
 
 AGENTS_SEARCH_PATHS = [
@@ -53,6 +56,48 @@ def __create_tools(
     return tools, tool_configs
 
 
+def __load_compaction(config: Any) -> CompactionOptions | bool:
+    if config is None or isinstance(config, bool):
+        return config or False
+    if not isinstance(config, dict):
+        raise ValueError("Invalid compaction configuration: must be a bool or a dict")
+    return CompactionOptions(**config)
+
+
+def __load_tool_result_aging(config: Any) -> ToolResultAging | bool:
+    if config is None or isinstance(config, bool):
+        return config or False
+    if not isinstance(config, dict):
+        raise ValueError(
+            "Invalid tool_result_aging configuration: must be a bool or a dict"
+        )
+    return ToolResultAging(**config)
+
+
+def __load_colleague_sessions(config: Any) -> ColleagueSessions | None:
+    if config is None:
+        return None
+    if isinstance(config, str):
+        return ColleagueSessions(scope=config)  # type: ignore
+    if not isinstance(config, dict):
+        raise ValueError(
+            "Invalid colleague_sessions configuration: must be a scope name or a dict"
+        )
+    return ColleagueSessions(**config)
+
+
+def __load_routing(config: Any) -> RoutingOptions | None:
+    if config is None:
+        return None
+    if isinstance(config, str):
+        return RoutingOptions(fast=config)
+    if not isinstance(config, dict):
+        raise ValueError(
+            "Invalid routing configuration: must be a model name or a dict"
+        )
+    return RoutingOptions(**config)
+
+
 def __load_agent_from_config(
     file: Path,
     pending: set[Path],
@@ -96,6 +141,12 @@ def __load_agent_from_config(
         knowledge_base=(
             Path(knowledge_base) if isinstance(knowledge_base, str) else knowledge_base
         ),
+        cache=config.get("cache", False),
+        compaction=__load_compaction(config.get("compaction")),
+        tool_result_aging=__load_tool_result_aging(config.get("tool_result_aging")),
+        colleague_sessions=__load_colleague_sessions(config.get("colleague_sessions")),
+        max_tool_iterations=config.get("max_tool_iterations"),
+        routing=__load_routing(config.get("routing")),
     )
     agent.original_config = config
     pending.remove(file)
@@ -0,0 +1,117 @@
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+import time
+from typing import Any, Awaitable, Callable, TypeVar
+
+T = TypeVar("T")
+
+_CURRENT_DEADLINE: ContextVar["Deadline | None"] = ContextVar(
+    "agentia_deadline", default=None
+)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class Deadline:
+    def __init__(self, timeout: float | None = None):
+        """
+        A deadline and cancellation token for an agent turn.
+
+        Everything the turn waits for (provider requests, streams, tool calls, colleague turns and knowledge base queries)
+        is cancelled once `timeout` seconds have passed, or once `cancel()` is called. The turn then ends cleanly with the partial result.
+        Tools and colleagues inherit the deadline of the turn that called them (see `current_deadline`).
+
+        :param timeout: Seconds from now. The deadline only expires when cancelled if None.
+        """
+        self.expires_at = time.monotonic() + timeout if timeout is not None else None
+        self.__cancelled = False
+        self.__tasks: set[asyncio.Future[Any]] = set()
+        self.__callbacks: set[Callable[[], None]] = set()
+
+    def cancel(self):
+        """Cancel everything that runs under this deadline. Must be called from the event loop thread."""
+        self.__cancelled = True
+        for task in list(self.__tasks):
+            task.cancel()
+        for callback in list(self.__callbacks):
+            callback()
+
+    def on_expire(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """
+        Call `callback` from the event loop once the deadline expires or is cancelled. Returns a function that removes the callback.
+        Unlike `run`, this sets a single timer, e.g. for all the chunks of a stream.
+        """
+        self.__callbacks.add(callback)
+        handle: asyncio.TimerHandle | None = None
+        if (remaining := self.remaining()) is not None:
+            loop = asyncio.get_running_loop()
+            handle = loop.call_at(loop.time() + remaining, callback)
+
+        def remove():
+            self.__callbacks.discard(callback)
+            if handle is not None:
+                handle.cancel()
+
+        return remove
+
+    def remaining(self) -> float | None:
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.__cancelled or self.remaining() == 0.0
+
+    def check(self):
+        if self.expired:
+            raise DeadlineExceeded("Deadline exceeded")
+
+    async def run(self, aw: Awaitable[T]) -> T:
+        """Await `aw`, and cancel it once the deadline expires. Raises `DeadlineExceeded` in that case."""
+        if self.expired:
+            if asyncio.iscoroutine(aw):
+                aw.close()
+            self.check()
+        task = asyncio.ensure_future(aw)
+        self.__tasks.add(task)
+        try:
+            done, _ = await asyncio.wait({task}, timeout=self.remaining())
+        except BaseException:
+            task.cancel()
+            raise
+        finally:
+            self.__tasks.discard(task)
+        if task not in done:
+            task.cancel()
+            # Let it clean up
+            await asyncio.wait({task})
+            raise DeadlineExceeded("Deadline exceeded")
+        if task.cancelled() and self.__cancelled:
+            raise DeadlineExceeded("Cancelled")
+        return task.result()
+
+    @contextmanager
+    def activate(self):
+        """Make this the current deadline, e.g. while running a tool. Must not be held across `yield`s."""
+        token = _CURRENT_DEADLINE.set(self)
+        try:
+            yield self
+        finally:
+            _CURRENT_DEADLINE.reset(token)
+
+
+def current_deadline() -> Deadline | None:
+    """The deadline of the turn that (directly or indirectly) called the current tool, if any"""
+    return _CURRENT_DEADLINE.get()
+
+
+async def with_deadline(aw: Awaitable[T]) -> T:
+    """Await `aw` under the current deadline, if any"""
+    deadline = current_deadline()
+    if deadline is None:
+        return await aw
+    return await deadline.run(aw)
@@ -0,0 +1,182 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import hashlib
+import importlib.util
+import re
+
+from bs4 import BeautifulSoup, Tag
+from markdownify import MarkdownConverter
+
+from .cache import MemoryCache, stable_hash
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="agentia-html")
+_CACHE = MemoryCache(max_entries=64)
+
+# Elements that never contain the main content
+_BOILERPLATE_TAGS = [
+    "script",
+    "style",
+    "noscript",
+    "template",
+    "svg",
+    "canvas",
+    "iframe",
+    "form",
+    "button",
+    "input",
+    "select",
+    "nav",
+    "header",
+    "footer",
+    "aside",
+    "dialog",
+]
+_BOILERPLATE_ROLES = {"navigation", "banner", "contentinfo", "complementary", "search"}
+_BOILERPLATE_NAMES = re.compile(
+    r"\b(cookie|consent|advert|ads?|promo|newsletter|subscribe|share|social|related|comments?|sidebar|breadcrumbs?|menu|popup|modal|skip-link)\b",
+    re.IGNORECASE,
+)
+_BLANK_LINES = re.compile(r"\n\s*\n(\s*\n)+")
+
+
+@dataclass
+class PageContent:
+    title: str | None
+    pages: list[str]
+    """The content in markdown, split into pages within the token budget"""
+    tokens: list[int]
+    """Number of tokens of each page"""
+
+    def head(self, max_tokens: int) -> str:
+        """The beginning of the content, within `max_tokens` tokens. Cut at a paragraph boundary if possible."""
+        parts: list[str] = []
+        for page, tokens in zip(self.pages, self.tokens):
+            if tokens > max_tokens:
+                if max_tokens > 0:
+                    head = _paginate(page, max_tokens)[0][0]
+                    parts.append(head)
+                break
+            parts.append(page)
+            max_tokens -= tokens
+        return "\n\n".join(parts)
+
+
+def __is_boilerplate(tag: Tag) -> bool:
+    if tag.name in ["html", "body", "main", "article"]:
+        return False
+    if tag.get("role") in _BOILERPLATE_ROLES or tag.get("aria-hidden") == "true":
+        return True
+    classes = tag.get("class") or []
+    names = " ".join([*classes, str(tag.get("id") or "")])
+    return _BOILERPLATE_NAMES.search(names) is not None
+
+
+def __main_content(soup: BeautifulSoup) -> Tag:
+    for main in [soup.find("main"), soup.find(role="main")]:
+        if isinstance(main, Tag) and main.get_text(strip=True) != "":
+            return main
+    articles = [a for a in soup.find_all("article") if isinstance(a, Tag)]
+    if len(articles) > 0:
+        return max(articles, key=lambda a: len(a.get_text()))
+    return soup.body or soup
+
+
+def _paginate(text: str, page_tokens: int) -> tuple[list[str], list[int]]:
+    from ..history import ENCODING
+
+    pages: list[str] = []
+    counts: list[int] = []
+    current: list[str] = []
+    tokens = 0
+    for block in text.split("\n\n"):
+        encoded = ENCODING.encode(block)
+        n = len(encoded)
+        if tokens + n > page_tokens and len(current) > 0:
+            pages.append("\n\n".join(current))
+            counts.append(tokens)
+            current, tokens = [], 0
+        if n > page_tokens:
+            # Hard-split blocks that do not fit in a page
+            for i in range(0, n, page_tokens):
+                pages.append(ENCODING.decode(encoded[i : i + page_tokens]))
+                counts.append(min(page_tokens, n - i))
+            continue
+        current.append(block)
+        tokens += n
+    if len(current) > 0 or len(pages) == 0:
+        pages.append("\n\n".join(current))
+        counts.append(tokens)
+    return pages, counts
+
+
+def __strip_boilerplate(main: Tag):
+    """Remove boilerplate inside the main content. Wrappers of most of the content (e.g. ASP.NET forms) are kept."""
+    chars = len(main.get_text(strip=True))
+
+    def is_wrapper(tag: Tag) -> bool:
+        return chars > 0 and len(tag.get_text(strip=True)) > chars / 2
+
+    for tag in main.find_all(_BOILERPLATE_TAGS):
+        if tag.decomposed:
+            continue
+        # Keep the headers and footers of articles, e.g. the title and the byline
+        if tag.name in ["header", "footer"] and tag.find_parent(["main", "article"]):
+            continue
+        if not is_wrapper(tag):
+            tag.decompose()
+    for tag in [t for t in main.find_all(True) if isinstance(t, Tag)]:
+        if not tag.decomposed and __is_boilerplate(tag) and not is_wrapper(tag):
+            tag.decompose()
+
+
+def __to_markdown(tag: Tag) -> str:
+    md = MarkdownConverter(heading_style="ATX").convert_soup(tag)
+    return _BLANK_LINES.sub("\n\n", md).strip()
+
+
+def _extract(html: str, page_tokens: int) -> PageContent:
+    parser = "lxml" if importlib.util.find_spec("lxml") is not None else "html.parser"
+    soup = BeautifulSoup(html, parser)
+    title = soup.title.get_text(strip=True) if soup.title is not None else None
+    for tag in soup.find_all(["script", "style", "noscript", "template"]):
+        tag.decompose()
+    # Choose the main content first, so that none of its ancestors are removed
+    main = __main_content(soup)
+    __strip_boilerplate(main)
+    md = __to_markdown(main)
+    if md == "":
+        # Nothing left. Fall back to the whole page.
+        soup = BeautifulSoup(html, parser)
+        for tag in soup.find_all(["script", "style", "noscript", "template"]):
+            tag.decompose()
+        md = __to_markdown(soup.body or soup)
+    pages, tokens = _paginate(md, page_tokens)
+    return PageContent(title=title or None, pages=pages, tokens=tokens)
+
+
+def _split(text: str, page_tokens: int) -> PageContent:
+    pages, tokens = _paginate(text.strip(), page_tokens)
+    return PageContent(title=None, pages=pages, tokens=tokens)
+
+
+async def extract_main_content(
+    content: str, page_tokens: int = 4000, is_html: bool = True
+) -> PageContent:
+    """
+    Extract the main content of a web page as markdown, without navigation, scripts, ads and other boilerplate.
+    The content is split into pages of at most `page_tokens` tokens, so it can be read on demand.
+
+    Results are cached by content hash. The work is done in a thread pool.
+    """
+    key = stable_hash(
+        hashlib.sha256(content.encode()).hexdigest(), page_tokens, is_html
+    )
+    if (cached := _CACHE.get(key)) is not None:
+        return cached
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(
+        _EXECUTOR, _extract if is_html else _split, content, page_tokens
+    )
+    _CACHE.put(key, result)
+    return result
@@ -0,0 +1,342 @@
+import asyncio
+import base64
+from dataclasses import dataclass, field, replace
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import logging
+from pathlib import Path
+import time
+from typing import Any
+from urllib.parse import urlsplit
+
+import httpx
+
+from .cache import DiskCache, MemoryCache
+
+LOGGER = logging.getLogger("agentia.http")
+
+USER_AGENT = "Mozilla/5.0 (compatible; agentia)"
+
+
+@dataclass
+class HTTPResponse:
+    url: str
+    status: int
+    headers: dict[str, str]
+    content: bytes
+    truncated: bool = False
+    """Whether the body is cut at `max_bytes`"""
+    from_cache: bool = False
+
+    @property
+    def content_type(self) -> str:
+        return self.headers.get("content-type", "").split(";")[0].strip().lower()
+
+    @property
+    def encoding(self) -> str:
+        for part in self.headers.get("content-type", "").split(";")[1:]:
+            k, _, v = part.strip().partition("=")
+            if k.lower() == "charset" and v:
+                return v.strip("\"'")
+        return "utf-8"
+
+    @property
+    def text(self) -> str:
+        try:
+            return self.content.decode(self.encoding, errors="replace")
+        except LookupError:
+            return self.content.decode("utf-8", errors="replace")
+
+
+@dataclass
+class _CacheEntry:
+    response: HTTPResponse
+    stored_at: float
+    max_age: float
+    """Seconds the response is fresh for. Stale responses are revalidated."""
+    validators: dict[str, str] = field(default_factory=dict)
+    vary: dict[str, str | None] = field(default_factory=dict)
+    """The request headers listed in `Vary`, and their values when the response was stored"""
+
+    def fresh(self) -> bool:
+        return time.time() - self.stored_at < self.max_age
+
+    def matches(self, headers: httpx.Headers) -> bool:
+        """Whether the response can be reused for a request with these headers"""
+        return all(headers.get(k) == v for k, v in self.vary.items())
+
+    def to_json(self) -> Any:
+        r = self.response
+        return {
+            "url": r.url,
+            "status": r.status,
+            "headers": r.headers,
+            "content": base64.b64encode(r.content).decode(),
+            "stored_at": self.stored_at,
+            "max_age": self.max_age,
+            "validators": self.validators,
+            "vary": self.vary,
+        }
+
+    @staticmethod
+    def from_json(data: Any) -> "_CacheEntry":
+        response = HTTPResponse(
+            url=data["url"],
+            status=data["status"],
+            headers=data["headers"],
+            content=base64.b64decode(data["content"]),
+            from_cache=True,
+        )
+        return _CacheEntry(
+            response=response,
+            stored_at=data["stored_at"],
+            max_age=data["max_age"],
+            validators=data["validators"],
+            vary=data.get("vary", {}),
+        )
+
+
+def _cache_control(headers: httpx.Headers) -> dict[str, str | None]:
+    directives: dict[str, str | None] = {}
+    for part in headers.get("cache-control", "").split(","):
+        k, sep, v = part.strip().partition("=")
+        if k:
+            directives[k.lower()] = v.strip('"') if sep else None
+    return directives
+
+
+def _vary(headers: httpx.Headers) -> list[str] | None:
+    """The request headers a response varies on. None if it must not be reused, i.e. `Vary: *`."""
+    names = [h.strip().lower() for h in headers.get("vary", "").split(",")]
+    names = [h for h in names if h]
+    return None if "*" in names else names
+
+
+def _parse_date(value: str | None) -> datetime | None:
+    if value is None:
+        return None
+    try:
+        d = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return d if d.tzinfo is not None else d.replace(tzinfo=timezone.utc)
+
+
+def _freshness(headers: httpx.Headers) -> float | None:
+    """Seconds a response is fresh for, following RFC 9111. None if it must not be stored."""
+    cc = _cache_control(headers)
+    if "no-store" in cc:
+        return None
+    if "no-cache" in cc:
+        return 0.0
+    if (max_age := cc.get("max-age")) is not None:
+        try:
+            return max(0.0, float(max_age) - float(headers.get("age", 0)))
+        except ValueError:
+            return 0.0
+    now = _parse_date(headers.get("date")) or datetime.now(timezone.utc)
+    if (expires := _parse_date(headers.get("expires"))) is not None:
+        return max(0.0, (expires - now).total_seconds())
+    if (modified := _parse_date(headers.get("last-modified"))) is not None:
+        # Heuristic freshness: 10% of the time since the last modification, up to a day
+        return min(86400.0, max(0.0, (now - modified).total_seconds() * 0.1))
+    return 0.0
+
+
+def _capped(response: HTTPResponse, max_bytes: int) -> HTTPResponse:
+    """A copy of a cached response, cut at `max_bytes`. The cached response is never modified."""
+    if len(response.content) <= max_bytes:
+        return replace(response)
+    return replace(response, content=response.content[:max_bytes], truncated=True)
+
+
+class Fetcher:
+    def __init__(
+        self,
+        cache_path: Path | None = None,
+        max_connections: int = 32,
+        max_connections_per_host: int = 4,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 20.0,
+        max_bytes: int = 5 * 1024 * 1024,
+        max_cache_entries: int = 10000,
+        max_memory_cache_bytes: int = 32 * 1024 * 1024,
+        max_cache_bytes: int = 512 * 1024 * 1024,
+    ):
+        """
+        A pooled async HTTP client with connection limits, timeouts, a cap on the size of downloads, and an HTTP cache.
+
+        Responses are cached following their `Cache-Control`, `Expires` and `Last-Modified` headers,
+        and stale responses are revalidated with `If-None-Match` and `If-Modified-Since`.
+        Responses are only reused for requests with the same headers listed in `Vary`, and never with `Vary: *`.
+
+        :param cache_path: Path to the on-disk cache database, to share responses across sessions. Only cached in memory if not provided.
+        :param max_connections_per_host: Maximum number of concurrent requests to the same host.
+        :param max_bytes: Bodies are truncated after this many bytes.
+        :param max_memory_cache_bytes: Maximum total size of the bodies cached in memory.
+        :param max_cache_bytes: Maximum total size of the on-disk cache. Bodies are stored in base64, so they take a third more space.
+        """
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.max_bytes = max_bytes
+        # Entries are only serialized for the disk tier
+        self.memory = MemoryCache(
+            max_entries=256,
+            max_bytes=max_memory_cache_bytes,
+            sizeof=lambda e: len(e.response.content),
+        )
+        self.disk = (
+            DiskCache(
+                cache_path, max_entries=max_cache_entries, max_bytes=max_cache_bytes
+            )
+            if cache_path is not None
+            else None
+        )
+        # Clients and semaphores are bound to the event loop that created them
+        self.__loop: asyncio.AbstractEventLoop | None = None
+        self.__client: httpx.AsyncClient | None = None
+        self.__hosts: dict[str, asyncio.Semaphore] = {}
+
+    @staticmethod
+    def shared(cache_path: Path) -> "Fetcher":
+        """Get a fetcher shared by all agents in this process that use the same cache database"""
+        if cache_path not in _SHARED_FETCHERS:
+            _SHARED_FETCHERS[cache_path] = Fetcher(cache_path=cache_path)
+        return _SHARED_FETCHERS[cache_path]
+
+    async def __get_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self.__client is not None and self.__loop is loop:
+            return self.__client
+        old_client, old_loop = self.__client, self.__loop
+        self.__loop = loop
+        self.__hosts = {}
+        self.__client = client = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+            ),
+            follow_redirects=True,
+            headers={"user-agent": USER_AGENT},
+        )
+        if old_client is not None:
+            await self.__close_client(old_client, old_loop)
+        return client
+
+    async def __close_client(
+        self, client: httpx.AsyncClient, loop: asyncio.AbstractEventLoop | None
+    ):
+        """Close a client, possibly created in another event loop"""
+        if (
+            loop is not None
+            and loop is not asyncio.get_running_loop()
+            and loop.is_running()
+        ):
+            # The loop of another thread
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+            return
+        try:
+            await client.aclose()
+        except Exception as e:
+            # The connections of a closed loop may fail to shut down cleanly
+            LOGGER.debug(
+                f"Failed to close the HTTP client of a previous event loop: {e}"
+            )
+
+    async def aclose(self):
+        """Close the connection pool. It is reopened on the next request."""
+        if self.__client is not None:
+            client, loop = self.__client, self.__loop
+            self.__client, self.__loop, self.__hosts = None, None, {}
+            await self.__close_client(client, loop)
+
+    def __host_limit(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc.lower()
+        if host not in self.__hosts:
+            self.__hosts[host] = asyncio.Semaphore(self.max_connections_per_host)
+        return self.__hosts[host]
+
+    async def __get_cached(self, url: str) -> _CacheEntry | None:
+        entry: _CacheEntry | None = self.memory.get(url)
+        if entry is None and self.disk is not None:
+            data = await asyncio.to_thread(self.disk.get, url)
+            if data is not None:
+                entry = _CacheEntry.from_json(data)
+                self.memory.put(url, entry)
+        return entry
+
+    async def __put_cached(self, url: str, entry: _CacheEntry):
+        self.memory.put(url, entry)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.put, url, entry.to_json())
+
+    async def fetch(self, url: str, max_bytes: int | None = None) -> HTTPResponse:
+        """
+        GET a URL. Raises `httpx.HTTPError` on network errors and timeouts.
+
+        :param max_bytes: Override the default cap on the size of the body.
+        """
+        max_bytes = max_bytes or self.max_bytes
+        client = await self.__get_client()
+        cached = await self.__get_cached(url)
+        if cached is not None and not cached.matches(client.headers):
+            # Stored for another variant
+            cached = None
+        if cached is not None and cached.fresh():
+            return _capped(cached.response, max_bytes)
+        headers: dict[str, str] = {}
+        if cached is not None:
+            if etag := cached.validators.get("etag"):
+                headers["if-none-match"] = etag
+            if modified := cached.validators.get("last-modified"):
+                headers["if-modified-since"] = modified
+        async with self.__host_limit(url):
+            async with client.stream("GET", url, headers=headers) as res:
+                if res.status_code == 304 and cached is not None:
+                    max_age = _freshness(res.headers)
+                    if max_age is not None:
+                        cached.stored_at = time.time()
+                        cached.max_age = max_age
+                        await self.__put_cached(url, cached)
+                    return _capped(cached.response, max_bytes)
+                chunks: list[bytes] = []
+                size = 0
+                truncated = False
+                async for chunk in res.aiter_bytes():
+                    chunks.append(chunk)
+                    size += len(chunk)
+                    if size > max_bytes:
+                        truncated = True
+                        break
+        content = b"".join(chunks)[:max_bytes]
+        if truncated:
+            LOGGER.debug(f"Truncated {url} at {max_bytes} bytes")
+        response = HTTPResponse(
+            url=str(res.url),
+            status=res.status_code,
+            headers={k.lower(): v for k, v in res.headers.items()},
+            content=content,
+            truncated=truncated,
+        )
+        max_age = _freshness(res.headers)
+        validators = {
+            k: res.headers[k] for k in ["etag", "last-modified"] if k in res.headers
+        }
+        vary = _vary(res.headers)
+        if (
+            res.status_code == 200
+            and not truncated
+            and max_age is not None
+            and (max_age > 0 or len(validators) > 0)
+            and vary is not None
+        ):
+            cached_response = replace(response, from_cache=True)
+            entry = _CacheEntry(cached_response, time.time(), max_age, validators)
+            entry.vary = {h: res.request.headers.get(h) for h in vary}
+            await self.__put_cached(url, entry)
+        return response
+
+
+_SHARED_FETCHERS: dict[Path, Fetcher] = {}
@@ -0,0 +1,115 @@
+import asyncio
+import base64
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+import hashlib
+import importlib.util
+import io
+import logging
+from typing import Literal
+
+from agentia.blobs import parse_data_url
+from agentia.message import ContentPartImage, UserMessage
+from .cache import MemoryCache, stable_hash
+
+LOGGER = logging.getLogger("agentia.images")
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="agentia-images")
+_CACHE = MemoryCache(max_entries=64)
+
+
+@dataclass
+class ImageOptions:
+    max_long_side: int = 2048
+    """Images are first scaled down to fit in a `max_long_side` square"""
+    max_short_side: int = 768
+    """And then scaled down so that the shorter side is at most `max_short_side`, which is the effective resolution of most vision models"""
+    format: Literal["WEBP", "JPEG", "PNG"] = "WEBP"
+    quality: int = 85
+
+
+def _target_size(width: int, height: int, options: ImageOptions) -> tuple[int, int]:
+    scale = min(1.0, options.max_long_side / max(width, height))
+    scale *= min(1.0, options.max_short_side / (min(width, height) * scale))
+    if scale >= 1.0:
+        return width, height
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _process(mime: str, data: bytes, options: ImageOptions) -> tuple[str, bytes]:
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        size = _target_size(image.width, image.height, options)
+        resized = size != image.size
+        if not resized and len(data) < 256 * 1024:
+            # Small enough already. Keep the original encoding.
+            return mime, data
+        image.load()
+        if resized:
+            image = image.resize(size, Image.Resampling.LANCZOS)
+        if options.format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        elif image.mode not in ("RGB", "RGBA", "L", "LA"):
+            image = image.convert("RGBA")
+        out = io.BytesIO()
+        image.save(out, format=options.format, quality=options.quality)
+    encoded = out.getvalue()
+    if not resized and len(encoded) >= len(data):
+        return mime, data
+    return f"image/{options.format.lower()}", encoded
+
+
+async def preprocess_image_url(url: str, options: ImageOptions | None = None) -> str:
+    """
+    Downscale a base64 `data:` image to the effective resolution of vision models, and re-encode it in an efficient format.
+    Other URLs are returned as-is. Requires `pillow`, otherwise images are sent unchanged.
+
+    Results are cached by content hash. The work is done in a thread pool.
+    """
+    options = options or ImageOptions()
+    parsed = parse_data_url(url)
+    if parsed is None or not parsed[0].startswith("image/"):
+        return url
+    if importlib.util.find_spec("PIL") is None:
+        LOGGER.debug("pillow is not installed. Images are not preprocessed.")
+        return url
+    mime, data = parsed
+    key = stable_hash(hashlib.sha256(data).hexdigest(), asdict(options))
+    if (cached := _CACHE.get(key)) is not None:
+        return cached
+    loop = asyncio.get_running_loop()
+    try:
+        mime, data = await loop.run_in_executor(
+            _EXECUTOR, _process, mime, data, options
+        )
+    except Exception as e:
+        LOGGER.warning(f"Failed to preprocess image: {e}")
+        return url
+    result = f"data:{mime};base64,{base64.b64encode(data).decode()}"
+    _CACHE.put(key, result)
+    return result
+
+
+async def preprocess_message_images(
+    m: UserMessage, options: ImageOptions | None = None
+) -> UserMessage:
+    """Preprocess all inline images of a user message. See `preprocess_image_url`."""
+    if isinstance(m.content, str):
+        return m
+    if not any(isinstance(p, ContentPartImage) for p in m.content):
+        return m
+    parts = list(m.content)
+    urls = await asyncio.gather(
+        *(
+            preprocess_image_url(p.url, options)
+            for p in parts
+            if isinstance(p, ContentPartImage)
+        )
+    )
+    it = iter(urls)
+    content = [
+        ContentPartImage(next(it)) if isinstance(p, ContentPartImage) else p
+        for p in parts
+    ]
+    return UserMessage(content=content, name=m.name, files=m.files)
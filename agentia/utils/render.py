@@ -0,0 +1,122 @@
+import time
+from typing import TYPE_CHECKING, Any
+
+from rich.console import Console
+from rich.live import Live
+from rich.markdown import Markdown
+from rich.status import Status
+
+from agentia.message import Message, MessageStream
+
+if TYPE_CHECKING:
+    from agentia.agent import Agent, ChatCompletion, ToolCallEvent
+
+_DEFAULT_RENDERER: "TerminalRenderer | None" = None
+
+
+class TerminalRenderer:
+    def __init__(
+        self, console: Console | None = None, fps: int = 20, markdown: bool = False
+    ):
+        """
+        Render chat completions to the terminal with a single persistent console.
+        Stream deltas are batched into frames, so the number of terminal writes per second is bounded by `fps`.
+
+        :param markdown: Render messages as live markdown instead of plain text.
+        """
+        self.console = console or Console()
+        self.fps = fps
+        self.markdown = markdown
+        self.__running_tools: dict[str, tuple[str, float]] = {}
+        self.__status: Status | None = None
+
+    @staticmethod
+    def default() -> "TerminalRenderer":
+        global _DEFAULT_RENDERER
+        if _DEFAULT_RENDERER is None:
+            _DEFAULT_RENDERER = TerminalRenderer()
+        return _DEFAULT_RENDERER
+
+    def print_name(self, agent: "Agent"):
+        name = f"[{agent.icon} {agent.name}]" if agent.icon else f"[{agent.name}]"
+        self.console.print(name, style="bold blue", markup=False, highlight=False)
+
+    def print_message(self, agent: "Agent", message: Message):
+        self.print_name(agent)
+        content = message.content if isinstance(message.content, str) else ""
+        if self.markdown:
+            self.console.print(Markdown(content))
+        else:
+            self.console.print(content, markup=False, highlight=False)
+
+    async def render_stream(self, agent: "Agent", stream: MessageStream):
+        name_printed = False
+        if self.markdown:
+            chunks: list[str] = []
+            live: Live | None = None
+            try:
+                async for batch in stream.coalesce(interval=1 / self.fps):
+                    if not name_printed:
+                        self.print_name(agent)
+                        name_printed = True
+                        live = Live(
+                            console=self.console,
+                            auto_refresh=False,
+                            vertical_overflow="visible",
+                        )
+                        live.start()
+                    assert live is not None
+                    chunks.append(batch)
+                    live.update(Markdown("".join(chunks)), refresh=True)
+            finally:
+                if live is not None:
+                    live.stop()
+                    if not self.console.is_terminal:
+                        # Live only ends the line in terminals
+                        self.console.line()
+            return
+        out = self.console.file
+        async for batch in stream.coalesce(interval=1 / self.fps):
+            if not name_printed:
+                self.print_name(agent)
+                name_printed = True
+            out.write(batch)
+            out.flush()
+        if name_printed:
+            out.write("\n")
+            out.flush()
+
+    async def render(self, completion: "ChatCompletion[Any]", agent: "Agent"):
+        async for msg in completion:
+            if isinstance(msg, Message):
+                self.print_message(agent, msg)
+            elif isinstance(msg, MessageStream):
+                await self.render_stream(agent, msg)
+
+    def on_tool_start(self, e: "ToolCallEvent"):
+        """Show the running tools with a spinner. Use as an `Agent.on_tool_start` listener."""
+        self.__running_tools[e.id] = (e.tool.display_name, time.monotonic())
+        self.__update_status()
+
+    def on_tool_end(self, e: "ToolCallEvent"):
+        """Use as an `Agent.on_tool_end` listener"""
+        name, start = self.__running_tools.pop(e.id, (e.tool.display_name, None))
+        elapsed = f" ({time.monotonic() - start:.1f}s)" if start is not None else ""
+        self.console.print(
+            f"[green]✓[/green] [magenta]{name}[/magenta][bright_black]{elapsed}[/bright_black]"
+        )
+        self.__update_status()
+
+    def __update_status(self):
+        if len(self.__running_tools) == 0:
+            if self.__status is not None:
+                self.__status.stop()
+                self.__status = None
+            return
+        names = ", ".join(name for name, _ in self.__running_tools.values())
+        text = f"[magenta]Running {names}...[/magenta]"
+        if self.__status is None:
+            self.__status = self.console.status(text)
+            self.__status.start()
+        else:
+            self.__status.update(text)
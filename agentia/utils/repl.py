@@ -2,54 +2,99 @@ import asyncio
 from agentia.agent import Agent, ToolCallEvent, CommunicationEvent
 from agentia.message import Message, UserMessage
 from agentia.utils.config import load_agent_from_config
-import rich
+from agentia.utils.render import TerminalRenderer
 
 
-async def __run_async(agent: Agent):
+async def __run_async(agent: Agent, renderer: TerminalRenderer):
     await agent.init()
     while True:
         try:
-            console = rich.console.Console()
-            prompt = console.input("[bold green]>[/bold green] ").strip()
+            prompt = renderer.console.input("[bold green]>[/bold green] ").strip()
             if prompt == "exit" or prompt == "quit":
                 break
         except EOFError:
             break
         response = agent.chat_completion([UserMessage(prompt)], stream=True)
-        await response.dump()
+        await response.dump(renderer)
 
 
-def run(agent: Agent | str):
+def run(agent: Agent | str, markdown: bool = False):
     if isinstance(agent, str):
         agent = load_agent_from_config(agent)
+    renderer = TerminalRenderer(markdown=markdown)
+    console = renderer.console
 
     def tool_start(e: ToolCallEvent):
         agent = f"{e.agent.icon} {e.agent.name}" if e.agent.icon else f"{e.agent.name}"
         tool = e.tool.display_name
-        if tool == "_communiate":
+        if tool in ("_communiate", "_communiate_all"):
             return
-        rich.print(f"[bold magenta][{agent}][/bold magenta] [magenta]{tool}[/magenta]")
+        console.print(
+            f"[bold magenta][{agent}][/bold magenta] [magenta]{tool}[/magenta]"
+        )
+        renderer.on_tool_start(e)
+
+    def tool_end(e: ToolCallEvent):
+        if e.tool.display_name in ("_communiate", "_communiate_all"):
+            return
+        renderer.on_tool_end(e)
 
     def communication_start(e: CommunicationEvent):
         p, c = e.parent, e.child
         from_agent = f"{p.icon} {p.name}" if p.icon else f"{p.name}"
         to_agent = f"{c.icon} {c.name}" if c.icon else f"{c.name}"
-        rich.print(
+        console.print(
             f"[bold magenta][{from_agent} -> {to_agent}][/bold magenta] [bright_black]{e.message}[/bright_black]"
         )
 
+    # The communication whose reply is being streamed, and those that were streamed
+    streaming: str | None = None
+    streamed: set[str] = set()
+
+    def communication_delta(e: CommunicationEvent):
+        nonlocal streaming
+        if streaming != e.id:
+            if streaming is not None:
+                console.print()
+            p, c = e.parent, e.child
+            from_agent = f"{p.icon} {p.name}" if p.icon else f"{p.name}"
+            to_agent = f"{c.icon} {c.name}" if c.icon else f"{c.name}"
+            console.print(
+                f"[bold magenta][{from_agent} <- {to_agent}][/bold magenta] ", end=""
+            )
+            streaming = e.id
+            streamed.add(e.id)
+        console.print(
+            e.delta, style="bright_black", end="", markup=False, highlight=False
+        )
+
     def communication_end(e: CommunicationEvent):
+        nonlocal streaming
+        if streaming is not None:
+            console.print()
+            streaming = None
         p, c = e.parent, e.child
         from_agent = f"{p.icon} {p.name}" if p.icon else f"{p.name}"
         to_agent = f"{c.icon} {c.name}" if c.icon else f"{c.name}"
-        rich.print(
+        if e.id in streamed and e.error is None:
+            # Already shown as it was streamed
+            streamed.discard(e.id)
+            return
+        if e.error is not None:
+            console.print(
+                f"[bold magenta][{from_agent} <- {to_agent}][/bold magenta] [red]{e.error}[/red]"
+            )
+            return
+        console.print(
             f"[bold magenta][{from_agent} <- {to_agent}][/bold magenta] [bright_black]{e.response}[/bright_black]"
         )
 
     all_agents = agent.all_agents()
     for a in all_agents:
         a.on_tool_start(tool_start)
+        a.on_tool_end(tool_end)
         a.on_commuication_start(communication_start)
         a.on_commuication_end(communication_end)
+        a.on_commuication_delta(communication_delta)
 
-    asyncio.run(__run_async(agent))
+    asyncio.run(__run_async(agent, renderer))
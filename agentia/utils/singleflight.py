@@ -0,0 +1,58 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Generic, TypeVar
+import weakref
+
+T = TypeVar("T")
+
+
+@dataclass
+class _Call(Generic[T]):
+    task: asyncio.Future[T]
+    waiters: int = 0
+
+
+class SingleFlight:
+    """
+    Deduplicate concurrent calls with the same key.
+    The first caller starts the work, and later callers with the same key share its result until it completes.
+
+    Calls are only shared within the same event loop, since futures cannot be awaited from other loops.
+    """
+
+    def __init__(self) -> None:
+        self.__loops: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, dict[str, _Call[Any]]
+        ] = weakref.WeakKeyDictionary()
+
+    def __calls(self) -> dict[str, _Call[Any]]:
+        loop = asyncio.get_running_loop()
+        if loop not in self.__loops:
+            self.__loops[loop] = {}
+        return self.__loops[loop]
+
+    def in_flight(self, key: str) -> bool:
+        return key in self.__calls()
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        calls = self.__calls()
+        call = calls.get(key)
+        if call is None:
+            call = _Call(task=asyncio.ensure_future(fn()))
+            calls[key] = call
+
+            def forget(_task: asyncio.Future[T], call: _Call[Any] = call):
+                if calls.get(key) is call:
+                    del calls[key]
+
+            call.task.add_done_callback(forget)
+        call.waiters += 1
+        try:
+            # Shield the shared task so that one cancelled caller does not cancel the others
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
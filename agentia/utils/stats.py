@@ -0,0 +1,81 @@
+from collections import defaultdict
+from pathlib import Path
+import rich
+from rich.table import Table
+
+from agentia.agent import _get_global_cache_dir
+from agentia.llm.usage import RequestUsage, load_usage_records, summarize
+
+
+def __fmt_ttft(records: list[RequestUsage]) -> str:
+    ttfts = [r.ttft for r in records if r.ttft is not None]
+    return f"{sum(ttfts) / len(ttfts):.2f}s" if ttfts else "-"
+
+
+def __session_table(agent_id: str, records: list[RequestUsage]) -> Table:
+    table = Table(title=f"Agent: {agent_id}")
+    for col in ["Session", "Turns", "Requests", "Prompt", "Completion"]:
+        table.add_column(col, justify="right" if col != "Session" else "left")
+    for col in ["Reasoning", "Cached", "Cache Hits", "Avg TTFT", "Output Tok/s"]:
+        table.add_column(col, justify="right")
+    sessions: dict[str, list[RequestUsage]] = defaultdict(list)
+    for r in records:
+        sessions[r.session].append(r)
+    for session, rs in sessions.items():
+        u = summarize(rs)
+        table.add_row(
+            session,
+            str(len({r.turn for r in rs})),
+            str(u.requests),
+            str(u.prompt_tokens),
+            str(u.completion_tokens),
+            str(u.reasoning_tokens),
+            f"{u.cached_tokens} ({u.prompt_cache_hit_ratio:.0%})",
+            str(u.cache_hits),
+            __fmt_ttft(rs),
+            f"{u.output_tokens_per_second:.1f}",
+        )
+    return table
+
+
+def __turn_table(records: list[RequestUsage]) -> Table:
+    session = records[-1].session
+    table = Table(title=f"Session: {session}")
+    for col in ["Turn", "Requests", "Prompt", "Completion", "TTFT", "Output Tok/s"]:
+        table.add_column(col, justify="right")
+    turns: dict[int, list[RequestUsage]] = defaultdict(list)
+    for r in records:
+        if r.session == session:
+            turns[r.turn].append(r)
+    for turn, rs in turns.items():
+        u = summarize(rs)
+        # Time to first token of a turn is the time to first token of its first request
+        ttft = rs[0].ttft
+        table.add_row(
+            str(turn),
+            str(u.requests),
+            str(u.prompt_tokens),
+            str(u.completion_tokens),
+            f"{ttft:.2f}s" if ttft is not None else "-",
+            f"{u.output_tokens_per_second:.1f}",
+        )
+    return table
+
+
+def run(agent: str | None = None, turns: bool = False):
+    agents_dir = _get_global_cache_dir() / "agents"
+    if agent is not None:
+        dirs = [agents_dir / agent]
+    else:
+        dirs = sorted(agents_dir.iterdir()) if agents_dir.exists() else []
+    found = False
+    for dir in dirs:
+        records = load_usage_records(Path(dir) / "usage.jsonl")
+        if len(records) == 0:
+            continue
+        found = True
+        rich.print(__session_table(dir.name, records))
+        if turns:
+            rich.print(__turn_table(records))
+    if not found:
+        rich.print("[yellow]No usage records found.[/yellow]")
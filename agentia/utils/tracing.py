@@ -0,0 +1,326 @@
+from contextvars import ContextVar, Token
+from itertools import count
+import json
+import os
+from pathlib import Path
+import threading
+import time
+from typing import Any, AsyncIterable, AsyncIterator, Protocol, TypeVar
+
+T = TypeVar("T")
+
+_CURRENT_SPAN: ContextVar["Span | None"] = ContextVar(
+    "agentia_current_span", default=None
+)
+_SPAN_IDS = count(1)
+
+
+class Span:
+    recording = True
+
+    def __init__(
+        self,
+        tracer: "Tracer | None",
+        name: str,
+        parent: "Span | None",
+        attributes: dict[str, Any],
+    ):
+        self.name = name
+        self.id = next(_SPAN_IDS)
+        self.parent = parent
+        self.root: Span = parent.root if parent is not None else self
+        self.attributes = attributes
+        self.events: list[tuple[str, int, dict[str, Any]]] = []
+        self.children: list[Span] = []
+        self.start_ns = time.time_ns()
+        self.end_ns: int | None = None
+        self.__tracer = tracer
+        self.__tokens: list[Token[Span | None]] = []
+        if parent is not None:
+            parent.children.append(self)
+
+    @property
+    def duration(self) -> float | None:
+        """Duration in seconds, or `None` if the span is still running"""
+        if self.end_ns is None:
+            return None
+        return (self.end_ns - self.start_ns) / 1e9
+
+    def set(self, **attributes: Any):
+        self.attributes.update(attributes)
+
+    def event(self, name: str, **attributes: Any):
+        """Record a point in time within this span, e.g. the first token of a stream"""
+        self.events.append((name, time.time_ns(), attributes))
+
+    def end(self):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if self.parent is None and self.__tracer is not None:
+            self.__tracer._export(self)
+
+    def activate(self) -> "_Activation":
+        """Make this span the parent of spans started in the current context, without ending it on exit"""
+        return _Activation(self)
+
+    def __enter__(self) -> "Span":
+        self.__tokens.append(_CURRENT_SPAN.set(self))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _CURRENT_SPAN.reset(self.__tokens.pop())
+        if exc_value is not None:
+            self.set(error=repr(exc_value))
+        self.end()
+
+
+class _Activation:
+    def __init__(self, span: Span):
+        self.__span = span
+        self.__token: Token[Span | None] | None = None
+
+    def __enter__(self) -> Span:
+        self.__token = _CURRENT_SPAN.set(self.__span)
+        return self.__span
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        assert self.__token is not None
+        _CURRENT_SPAN.reset(self.__token)
+
+
+class _NoopSpan(Span):
+    recording = False
+
+    def __init__(self):
+        self.name = ""
+        self.id = 0
+        self.parent = None
+        self.root = self
+        self.attributes = {}
+        self.events = []
+        self.children = []
+        self.start_ns = 0
+        self.end_ns = 0
+
+    def set(self, **attributes: Any): ...
+
+    def event(self, name: str, **attributes: Any): ...
+
+    def end(self): ...
+
+    def activate(self) -> Any:
+        return self
+
+    def __enter__(self) -> Span:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback): ...
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class SpanExporter(Protocol):
+    def export(self, root: Span) -> None:
+        """Export a finished trace, given its root span"""
+        ...
+
+    def shutdown(self) -> None: ...
+
+
+class Tracer:
+    def __init__(self, exporters: list[SpanExporter]):
+        self.exporters = exporters
+        self.__lock = threading.Lock()
+
+    def start_span(self, name: str, parent: Span | None, **attributes: Any) -> Span:
+        return Span(self, name, parent, attributes)
+
+    def _export(self, root: Span):
+        with self.__lock:
+            for e in self.exporters:
+                e.export(root)
+
+    def shutdown(self):
+        for e in self.exporters:
+            e.shutdown()
+
+
+_tracer: Tracer | None = None
+
+
+def enable(*exporters: SpanExporter) -> Tracer:
+    """
+    Enable tracing. Finished traces are sent to all the given exporters.
+
+        tracing.enable(tracing.ChromeTraceExporter("trace.json"))
+    """
+    global _tracer
+    disable()
+    _tracer = Tracer(list(exporters))
+    return _tracer
+
+
+def disable():
+    """Disable tracing and shut down the exporters"""
+    global _tracer
+    if _tracer is not None:
+        _tracer.shutdown()
+    _tracer = None
+
+
+def is_enabled() -> bool:
+    return _tracer is not None
+
+
+def current_span() -> Span | None:
+    return _CURRENT_SPAN.get()
+
+
+def start_span(name: str, parent: Span | None = None, **attributes: Any) -> Span:
+    """
+    Start a span under the given parent, or the current span if not provided.
+
+    Use it as a context manager to also make it the current span:
+
+        with start_span("tool", name=name):
+            ...
+    """
+    if _tracer is None:
+        return NOOP_SPAN
+    if parent is None or not parent.recording:
+        parent = _CURRENT_SPAN.get()
+    return _tracer.start_span(name, parent, **attributes)
+
+
+def iterate_in_span(span: Span, aiter: AsyncIterable[T]) -> AsyncIterable[T]:
+    """
+    Iterate an async iterator with `span` activated only while the iterator itself is running.
+    This is the safe way to parent the spans of an async generator, as context variables must not be held across `yield`s.
+    """
+    if not span.recording:
+        return aiter
+    return _iterate_in_span(span, aiter)
+
+
+async def _iterate_in_span(span: Span, aiter: AsyncIterable[T]) -> AsyncIterator[T]:
+    it = aiter.__aiter__()
+    while True:
+        with span.activate():
+            try:
+                item = await it.__anext__()
+            except StopAsyncIteration:
+                return
+        yield item
+
+
+def _walk(span: Span):
+    yield span
+    for c in span.children:
+        yield from _walk(c)
+
+
+class ChromeTraceExporter:
+    def __init__(self, path: str | Path):
+        """
+        Write traces in the Chrome trace event format. Open the file with `chrome://tracing` or https://ui.perfetto.dev.
+        Events are appended to the file after each finished trace, as a JSON array without the closing `]`, which the viewers accept.
+        """
+        self.path = Path(path)
+        self.__started = False
+        self.__lock = threading.Lock()
+
+    def export(self, root: Span):
+        pid = os.getpid()
+        assert root.end_ns is not None
+        events: list[dict[str, Any]] = []
+        for span in _walk(root):
+            end_ns = span.end_ns or root.end_ns
+            events.append(
+                {
+                    "name": span.name,
+                    "ph": "X",
+                    "ts": span.start_ns / 1000,
+                    "dur": (end_ns - span.start_ns) / 1000,
+                    "pid": pid,
+                    "tid": root.id,
+                    "args": {k: _to_json(v) for k, v in span.attributes.items()},
+                }
+            )
+            for name, ts, attributes in span.events:
+                events.append(
+                    {
+                        "name": name,
+                        "ph": "i",
+                        "s": "t",
+                        "ts": ts / 1000,
+                        "pid": pid,
+                        "tid": root.id,
+                        "args": {k: _to_json(v) for k, v in attributes.items()},
+                    }
+                )
+        data = ",\n".join(json.dumps(e) for e in events)
+        with self.__lock:
+            if not self.__started:
+                # Start a new file for each exporter
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self.path.write_text("[\n" + data)
+                self.__started = True
+            else:
+                with open(self.path, "a") as f:
+                    f.write(",\n" + data)
+
+    def shutdown(self): ...
+
+
+class OpenTelemetryExporter:
+    def __init__(self, tracer_provider: Any = None):
+        """
+        Forward traces to OpenTelemetry. Requires the `opentelemetry-api` package.
+
+        :param tracer_provider: Optional OpenTelemetry tracer provider. Default to the global one.
+        """
+        try:
+            from opentelemetry import trace
+        except ImportError:
+            raise RuntimeError(
+                "OpenTelemetry is not installed. You may need to install it with `pip install opentelemetry-api opentelemetry-sdk`"
+            )
+        self.__trace = trace
+        self.__tracer = trace.get_tracer("agentia", tracer_provider=tracer_provider)
+
+    def export(self, root: Span):
+        assert root.end_ns is not None
+        self.__export(root, None, root.end_ns)
+
+    def __export(self, span: Span, parent: Any, default_end_ns: int):
+        context = (
+            self.__trace.set_span_in_context(parent) if parent is not None else None
+        )
+        otel_span = self.__tracer.start_span(
+            span.name,
+            context=context,
+            start_time=span.start_ns,
+            attributes={k: _to_otel(v) for k, v in span.attributes.items()},
+        )
+        for name, ts, attributes in span.events:
+            otel_span.add_event(
+                name,
+                attributes={k: _to_otel(v) for k, v in attributes.items()},
+                timestamp=ts,
+            )
+        end_ns = span.end_ns or default_end_ns
+        for c in span.children:
+            self.__export(c, otel_span, end_ns)
+        otel_span.end(end_time=end_ns)
+
+    def shutdown(self): ...
+
+
+def _to_json(v: Any) -> Any:
+    return v if isinstance(v, (str, int, float, bool)) or v is None else str(v)
+
+
+def _to_otel(v: Any) -> Any:
+    return v if isinstance(v, (str, int, float, bool)) else str(v)
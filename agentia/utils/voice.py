@@ -1,4 +1,10 @@
-from typing import Literal
+import asyncio
+import io
+import logging
+import re
+from typing import AsyncIterable, AsyncIterator, Literal
+import wave
+import weakref
 
 import openai
 from pathlib import Path
@@ -6,6 +12,26 @@ import os
 
 Voice = Literal["alloy", "echo", "fable", "onyx", "nova", "shimmer"]
 
+AudioFormat = Literal["mp3", "opus", "aac", "flac", "wav", "pcm"]
+
+LOGGER = logging.getLogger("agentia.voice")
+
+_CLIENTS: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, dict[str | None, openai.AsyncOpenAI]
+] = weakref.WeakKeyDictionary()
+
+# A sentence ends with a terminal punctuation followed by whitespace, or a CJK terminal punctuation, or a blank line
+_SENTENCE_END = re.compile(r"[.!?;…]+[\"')\]]*\s+|[。！？；]+|\n\s*\n")
+
+
+def _get_client(api_key: str | None) -> openai.AsyncOpenAI:
+    """Reuse clients (and their connection pools) across calls in the same event loop"""
+    api_key = api_key or os.environ.get("OPENAI_API_KEY")
+    clients = _CLIENTS.setdefault(asyncio.get_running_loop(), {})
+    if api_key not in clients:
+        clients[api_key] = openai.AsyncOpenAI(api_key=api_key)
+    return clients[api_key]
+
 
 async def tts(
     text: str,
@@ -14,7 +40,7 @@ async def tts(
     voice: Voice = "alloy",
     api_key: str | None = None,
 ):
-    client = openai.AsyncOpenAI(api_key=api_key or os.environ.get("OPENAI_API_KEY"))
+    client = _get_client(api_key)
     response = client.audio.speech.with_streaming_response.create(
         model=model, voice=voice, input=text
     )
@@ -22,14 +48,176 @@ async def tts(
         await r.stream_to_file(output)
 
 
+async def split_sentences(
+    chunks: AsyncIterable[str], min_chars: int = 20, max_chars: int = 400
+) -> AsyncIterator[str]:
+    """
+    Incrementally split a stream of text chunks into sentences.
+
+    :param min_chars: Short sentences are merged with the next one, except for the first sentence, which is yielded as early as possible.
+    :param max_chars: Long sentences are split at the last whitespace before this limit.
+    """
+    buffer = ""
+    first = True
+    async for chunk in chunks:
+        buffer += chunk
+        start = 0
+        for m in _SENTENCE_END.finditer(buffer):
+            sentence = buffer[start : m.end()].strip()
+            if len(sentence) < min_chars and not first:
+                continue
+            if sentence:
+                yield sentence
+                first = False
+            start = m.end()
+        buffer = buffer[start:]
+        while len(buffer) > max_chars:
+            cut = buffer.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            yield buffer[:cut].strip()
+            first = False
+            buffer = buffer[cut:]
+    if buffer.strip():
+        yield buffer.strip()
+
+
+async def tts_stream(
+    text: AsyncIterable[str] | str,
+    model: Literal["tts-1", "tts-1-hd"] = "tts-1",
+    voice: Voice = "alloy",
+    format: AudioFormat = "mp3",
+    concurrency: int = 4,
+    api_key: str | None = None,
+) -> AsyncIterator[bytes]:
+    """
+    Speak a text stream (e.g. a `MessageStream`) while it is still being generated.
+
+    The text is split into sentences, which are synthesized concurrently (up to `concurrency` at a time).
+    Audio chunks are yielded in order, as soon as they are received.
+
+        async for audio in tts_stream(message_stream, format="pcm"):
+            player.write(audio)
+    """
+    client = _get_client(api_key)
+    semaphore = asyncio.Semaphore(concurrency)
+    # One queue of audio chunks per sentence, in order. `None` marks the end of a queue.
+    sentences: asyncio.Queue[asyncio.Queue[bytes | None] | None] = asyncio.Queue()
+    tasks: set[asyncio.Task[None]] = set()
+
+    async def synthesize(sentence: str, out: asyncio.Queue[bytes | None]):
+        try:
+            async with semaphore:
+                response = client.audio.speech.with_streaming_response.create(
+                    model=model, voice=voice, input=sentence, response_format=format
+                )
+                async with response as r:
+                    async for chunk in r.iter_bytes():
+                        out.put_nowait(chunk)
+        except Exception as e:
+            # The sentence is skipped, and the rest of the audio is still played
+            LOGGER.warning(f"Failed to synthesize {repr(sentence)}: {e}", exc_info=e)
+        finally:
+            out.put_nowait(None)
+
+    async def produce():
+        try:
+            if isinstance(text, str):
+                source = split_sentences(_once(text))
+            else:
+                source = split_sentences(text)
+            async for sentence in source:
+                out: asyncio.Queue[bytes | None] = asyncio.Queue()
+                task = asyncio.create_task(synthesize(sentence, out))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                sentences.put_nowait(out)
+        finally:
+            sentences.put_nowait(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while (audio := await sentences.get()) is not None:
+            while (chunk := await audio.get()) is not None:
+                yield chunk
+        # Surface errors of the text stream
+        await producer
+    finally:
+        producer.cancel()
+        for task in list(tasks):
+            task.cancel()
+
+
+async def _once(text: str) -> AsyncIterator[str]:
+    yield text
+
+
 async def stt(
     path: str | Path,
     model: Literal["whisper-1"] = "whisper-1",
     api_key: str | None = None,
 ) -> str:
-    client = openai.AsyncOpenAI(api_key=api_key or os.environ.get("OPENAI_API_KEY"))
+    client = _get_client(api_key)
     with open(path, "rb") as audio_file:
         transcript = await client.audio.transcriptions.create(
             model="whisper-1", file=audio_file
         )
         return transcript.text
+
+
+def _split_audio(path: Path, segment_seconds: float) -> list[tuple[str, bytes]]:
+    """Split an audio file into segments. WAV files are split natively, and other formats require `pydub` (and ffmpeg)."""
+    if path.suffix.lower() == ".wav":
+        segments = []
+        with wave.open(str(path), "rb") as w:
+            frames_per_segment = int(w.getframerate() * segment_seconds)
+            params = w.getparams()
+            i = 0
+            while frames := w.readframes(frames_per_segment):
+                out = io.BytesIO()
+                with wave.open(out, "wb") as o:
+                    o.setparams(params)
+                    o.writeframes(frames)
+                segments.append((f"{path.stem}-{i}.wav", out.getvalue()))
+                i += 1
+        return segments
+    try:
+        from pydub import AudioSegment  # type: ignore
+    except ImportError:
+        LOGGER.warning(
+            "pydub is not installed. Only WAV files can be split for parallel transcription."
+        )
+        return [(path.name, path.read_bytes())]
+    audio = AudioSegment.from_file(str(path))
+    step = int(segment_seconds * 1000)
+    segments = []
+    for i, start in enumerate(range(0, len(audio), step)):
+        out = io.BytesIO()
+        audio[start : start + step].export(out, format="mp3")
+        segments.append((f"{path.stem}-{i}.mp3", out.getvalue()))
+    return segments
+
+
+async def stt_chunked(
+    path: str | Path,
+    segment_seconds: float = 300,
+    concurrency: int = 4,
+    model: Literal["whisper-1"] = "whisper-1",
+    api_key: str | None = None,
+) -> str:
+    """
+    Transcribe a long recording by splitting it into segments and transcribing them in parallel.
+    This also works around the upload size limit of the transcription API.
+    """
+    client = _get_client(api_key)
+    segments = await asyncio.to_thread(_split_audio, Path(path), segment_seconds)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def transcribe(segment: tuple[str, bytes]) -> str:
+        async with semaphore:
+            transcript = await client.audio.transcriptions.create(
+                model=model, file=segment
+            )
+            return transcript.text.strip()
+
+    texts = await asyncio.gather(*(transcribe(s) for s in segments))
+    return " ".join(t for t in texts if t)
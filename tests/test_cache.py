@@ -0,0 +1,89 @@
+from agentia import AssistantMessage, UserMessage, ToolCall
+from agentia.message import FunctionCall
+from agentia.llm.cache import CompletionCache, CachedMessageStream
+from agentia.utils.cache import DiskCache, MemoryCache
+import tempfile
+from pathlib import Path
+import pytest
+
+
+def test_memory_cache_lru():
+    cache = MemoryCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_disk_cache_ttl():
+    with tempfile.TemporaryDirectory() as dir:
+        cache = DiskCache(Path(dir) / "cache.db", ttl=-1)
+        cache.put("a", {"x": 1})
+        assert cache.get("a") is None
+        cache = DiskCache(Path(dir) / "cache.db", max_entries=1)
+        cache.put("a", {"x": 1})
+        cache.put("b", {"x": 2})
+        assert cache.get("a") is None
+        assert cache.get("b") == {"x": 2}
+
+
+def test_cache_max_bytes():
+    cache = MemoryCache(max_bytes=5, sizeof=len)
+    cache.put("a", "abc")
+    cache.put("b", "cd")
+    cache.put("c", "ef")
+    assert cache.get("a") is None and cache.get("c") == "ef"
+    cache.put("d", "too large")
+    assert cache.get("d") is None and len(cache) == 2
+    with tempfile.TemporaryDirectory() as dir:
+        cache = DiskCache(Path(dir) / "cache.db", max_bytes=30)
+        cache.put("a", {"x": "a" * 10})
+        cache.put("b", {"x": "b" * 10})
+        assert cache.get("a") is None
+        assert cache.get("b") == {"x": "b" * 10}
+
+
+@pytest.mark.asyncio
+async def test_completion_cache_replay():
+    with tempfile.TemporaryDirectory() as dir:
+        cache = CompletionCache(path=Path(dir) / "completions.db")
+        messages = [UserMessage("What is the weather like in boston?")]
+        openai = {"base_url": "https://api.openai.com/v1", "extra_body": {}}
+        key = cache.key(openai, "gpt-4o-mini", {"temperature": 0}, messages, None)
+        assert key == cache.key(
+            openai, "gpt-4o-mini", {"temperature": 0}, messages, None
+        )
+        assert key != cache.key(
+            openai, "gpt-4o-mini", {"temperature": 1}, messages, None
+        )
+        # Other endpoints and provider routing may serve other responses
+        other = {"base_url": "https://openrouter.ai/api/v1", "extra_body": {}}
+        assert key != cache.key(
+            other, "gpt-4o-mini", {"temperature": 0}, messages, None
+        )
+        routed = {**openai, "extra_body": {"provider": {"order": ["Azure"]}}}
+        assert key != cache.key(
+            routed, "gpt-4o-mini", {"temperature": 0}, messages, None
+        )
+        assert cache.get(key) is None
+        tool_call = ToolCall(
+            id="call_0",
+            function=FunctionCall(name="get_weather", arguments={"city": "boston"}),
+            type="function",
+        )
+        await cache.aput(
+            key, AssistantMessage("It is 72 degrees.", tool_calls=[tool_call])
+        )
+        assert (await cache.aget(key)) is not None
+        # A fresh instance only hits the disk tier
+        cache = CompletionCache(path=Path(dir) / "completions.db")
+        message = await cache.aget(key)
+        assert message is not None
+        assert message.content == "It is 72 degrees."
+        assert message.tool_calls == [tool_call]
+        deltas = [delta async for delta in CachedMessageStream(message)]
+        assert len(deltas) > 1
+        assert "".join(deltas) == "It is 72 degrees."
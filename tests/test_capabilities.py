@@ -0,0 +1,79 @@
+from pathlib import Path
+import httpx
+import pytest
+
+from agentia.llm import capabilities
+from agentia.llm.capabilities import CapabilityRegistry
+
+MODELS = {
+    "data": [
+        {"id": "a/thinker", "supported_parameters": ["include_reasoning", "tools"]},
+        {"id": "b/chat", "supported_parameters": ["tools"], "context_length": 8192},
+    ]
+}
+
+
+@pytest.mark.asyncio
+async def test_capability_registry(monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+    fetches: list[str] = []
+    status = 200
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        fetches.append(str(request.url))
+        return httpx.Response(status, json=MODELS)
+
+    AsyncClient = httpx.AsyncClient
+    monkeypatch.setattr(
+        capabilities.httpx,
+        "AsyncClient",
+        lambda **kwargs: AsyncClient(transport=httpx.MockTransport(handler), **kwargs),
+    )
+    path = tmp_path / "models.db"
+    registry = CapabilityRegistry(path=path)
+    thinker = await registry.get("a/thinker")
+    assert thinker is not None and thinker.reasoning
+    chat = await registry.get("b/chat")
+    assert chat is not None and not chat.reasoning and chat.context_length == 8192
+    assert await registry.get("c/unknown") is None
+    assert len(fetches) == 1
+    # Persisted across processes
+    assert await CapabilityRegistry(path=path).get("a/thinker") == thinker
+    assert len(fetches) == 1
+    # A stale list is still used if the fetch fails
+    status = 500
+    stale = CapabilityRegistry(path=path, ttl=0)
+    assert await stale.get("a/thinker") == thinker
+    assert len(fetches) == 2
+
+
+@pytest.mark.asyncio
+async def test_openrouter_retries_capabilities(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+):
+    from agentia import Agent
+
+    status = 500
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(status, json=MODELS)
+
+    AsyncClient = httpx.AsyncClient
+    monkeypatch.setattr(
+        capabilities.httpx,
+        "AsyncClient",
+        lambda **kwargs: AsyncClient(transport=httpx.MockTransport(handler), **kwargs),
+    )
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("OPENROUTER_API_KEY", "sk-test")
+    backend = Agent(model="openrouter:a/thinker")._Agent__backend  # type: ignore
+    # Not resolved while the model list is unavailable
+    await backend._OpenRouterBackend__resolve_capabilities()
+    assert not backend.has_reasoning
+    assert not backend._OpenRouterBackend__capabilities_resolved
+    # Picked up once the registry has retried
+    status = 200
+    await CapabilityRegistry.shared(
+        tmp_path / ".cache" / "openrouter-models.db"
+    ).refresh(force=True)
+    await backend._OpenRouterBackend__resolve_capabilities()
+    assert backend.has_reasoning and backend._OpenRouterBackend__capabilities_resolved
@@ -0,0 +1,83 @@
+import json
+from typing import Any
+
+import httpx
+import openai
+import pytest
+
+from agentia import Agent
+from agentia.agent import CommunicationEvent
+from agentia.message import UserMessage
+
+
+def client(replies: list[dict[str, Any]]) -> openai.AsyncOpenAI:
+    """A provider that streams the given replies, one per request"""
+    remaining = list(replies)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        reply = remaining.pop(0)
+        base = {"id": "x", "object": "chat.completion.chunk", "created": 0}
+        base["model"] = body["model"]
+        deltas: list[dict[str, Any]] = []
+        if "content" in reply:
+            text = reply["content"]
+            deltas += [{"content": text[i : i + 4]} for i in range(0, len(text), 4)]
+        if "tool" in reply:
+            name, args = reply["tool"]
+            function = {"name": name, "arguments": json.dumps(args)}
+            call = {"index": 0, "id": "call_0", "type": "function"}
+            deltas.append({"tool_calls": [{**call, "function": function}]})
+        chunks = [
+            {**base, "choices": [{"index": 0, "delta": d, "finish_reason": None}]}
+            for d in deltas
+        ]
+        chunks.append(
+            {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        )
+        data = "".join(f"data: {json.dumps(c)}\n\n" for c in chunks)
+        return httpx.Response(
+            200,
+            content=(data + "data: [DONE]\n\n").encode(),
+            headers={"content-type": "text/event-stream"},
+        )
+
+    return openai.AsyncOpenAI(
+        api_key="sk-test",
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+
+
+@pytest.mark.asyncio
+async def test_deltas_reach_the_root(monkeypatch: pytest.MonkeyPatch, tmp_path):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.chdir(tmp_path)
+    model = "openai:gpt-4o-mini"
+    worker = Agent(name="Worker", description="Works", model=model)
+    manager = Agent(
+        name="Manager", description="Manages", model=model, colleagues=[worker]
+    )
+    root = Agent(name="Root", description="Leads", model=model, colleagues=[manager])
+    job = {"agent": "Worker", "message": "Do it"}
+    agents_and_replies = [
+        (worker, [{"content": "The work is done."}]),
+        (manager, [{"tool": ("_communiate", job)}, {"content": "Worker did it."}]),
+        (root, [{"tool": ("_communiate", {**job, "agent": "Manager"})}, {}]),
+    ]
+    for agent, replies in agents_and_replies:
+        agent._Agent__backend.client = client(replies)  # type: ignore
+    deltas: dict[str, list[str]] = {}
+
+    def on_delta(e: CommunicationEvent):
+        assert e.delta is not None
+        deltas.setdefault(f"{e.parent.name}->{e.child.name}", []).append(e.delta)
+
+    others: list[CommunicationEvent] = []
+    root.on_commuication_delta(on_delta)
+    manager.on_commuication_delta(others.append)
+    async for _ in root.chat_completion([UserMessage("Go")], stream=True):
+        pass
+    # The root sees the deltas of its colleague's colleague
+    assert "".join(deltas["Manager->Worker"]) == "The work is done."
+    assert "".join(deltas["Root->Manager"]) == "Worker did it."
+    assert others == []
@@ -0,0 +1,96 @@
+from agentia.utils.deadline import (
+    Deadline,
+    DeadlineExceeded,
+    current_deadline,
+    with_deadline,
+)
+from agentia.llm import _DeadlineMessageStream
+from agentia.message import MessageStream, ReasoningMessageStream
+import asyncio
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_deadline_expires():
+    deadline = Deadline(0.1)
+    assert await deadline.run(asyncio.sleep(0, "done")) == "done"
+    with pytest.raises(DeadlineExceeded):
+        await deadline.run(asyncio.sleep(1))
+    assert deadline.expired
+    # Expired deadlines do not start new work
+    with pytest.raises(DeadlineExceeded):
+        await deadline.run(asyncio.sleep(0))
+
+
+@pytest.mark.asyncio
+async def test_deadline_cancel():
+    deadline = Deadline()
+    asyncio.get_running_loop().call_later(0.1, deadline.cancel)
+    with pytest.raises(DeadlineExceeded):
+        await deadline.run(asyncio.sleep(1))
+
+
+@pytest.mark.asyncio
+async def test_deadline_is_inherited():
+    deadline = Deadline(0.1)
+
+    async def tool():
+        assert current_deadline() is deadline
+        await with_deadline(asyncio.sleep(1))
+
+    with deadline.activate():
+        with pytest.raises(DeadlineExceeded):
+            await tool()
+    assert current_deadline() is None
+
+
+class SlowReasoning(ReasoningMessageStream):
+    async def __aiter__(self):
+        while True:
+            await asyncio.sleep(0.02)
+            yield "think "
+
+
+class SlowStream(MessageStream):
+    def __init__(self):
+        self.reasoning = SlowReasoning()
+        self.closed = False
+
+    async def __aiter__(self):
+        while True:
+            await asyncio.sleep(0.02)
+            yield "word "
+
+    async def aclose(self):
+        self.closed = True
+
+
+@pytest.mark.asyncio
+async def test_stream_deadline():
+    stream = SlowStream()
+    wrapped = _DeadlineMessageStream(stream, Deadline(0.1))
+    # The reasoning is interrupted as well
+    assert wrapped.reasoning is not None
+    reasoning = [d async for d in wrapped.reasoning]
+    assert len(reasoning) > 0
+    message = await wrapped.wait_for_completion()
+    assert wrapped.interrupted and stream.closed
+    assert message.content is None
+    assert message.reasoning == "".join(reasoning)
+
+
+@pytest.mark.asyncio
+async def test_stream_deadline_only_interrupts_reads():
+    deadline = Deadline()
+    wrapped = _DeadlineMessageStream(SlowStream(), deadline)
+    deltas = []
+    async for delta in wrapped:
+        deltas.append(delta)
+        if len(deltas) == 2:
+            # Work done by the consumer between chunks is not cancelled
+            asyncio.get_running_loop().call_soon(deadline.cancel)
+            await asyncio.sleep(0.05)
+    message = await wrapped.wait_for_completion()
+    assert wrapped.interrupted and message.content == "word word "
+    # The consumer task is not left cancelled
+    await asyncio.sleep(0)
@@ -0,0 +1,108 @@
+import asyncio
+import time
+
+import pytest
+
+from agentia import Agent
+from agentia.llm import hedged
+from agentia.llm.hedged import HedgedBackend, ProviderStats, get_provider_stats
+from agentia.llm.openai import ChatMessageStream
+from agentia.message import AssistantMessage, UserMessage
+
+
+def test_provider_stats():
+    stats = ProviderStats()
+    for latency in [1.0, 1.0, 1.0, 1.0, 5.0]:
+        stats.record(latency, alpha=0.5)
+    assert stats.latency == 3.0
+    assert stats.percentile(0.5) == 1.0
+    assert stats.percentile(0.9) == 5.0
+    stats.record(None, alpha=0.5)
+    assert stats.error_rate == 0.5
+    assert stats.latency == 3.0
+    # Cancelled requests never lower the estimate, and are not samples
+    stats.record_censored(1.0, alpha=0.5)
+    assert stats.latency == 3.0
+    stats.record_censored(5.0, alpha=0.5)
+    assert stats.latency == 4.0
+    assert len(stats.samples) == 5
+
+
+class FakeStream(ChatMessageStream):
+    def __init__(self, first_chunk_delay: float):
+        self.first_chunk_delay = first_chunk_delay
+        self.closed = False
+
+    async def wait_for_first_chunk(self):
+        await asyncio.sleep(self.first_chunk_delay)
+
+    async def aclose(self):
+        self.closed = True
+
+
+def hedged_backend(monkeypatch: pytest.MonkeyPatch, *responses) -> HedgedBackend:
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(hedged, "_STATS", {})
+    agent = Agent(model=[f"openai:model-{i}" for i in range(len(responses))])
+    backend = agent._Agent__backend  # type: ignore
+    assert isinstance(backend, HedgedBackend)
+    backend.hedge_delay = 0.05
+    for b, respond in zip(backend.backends, responses):
+        monkeypatch.setattr(b, "_chat_completion_request", respond)
+    return backend
+
+
+@pytest.mark.asyncio
+async def test_hedge_after_delay(monkeypatch: pytest.MonkeyPatch):
+    async def slow(messages, stream):
+        await asyncio.sleep(10)
+        return AssistantMessage(content="slow")
+
+    async def fast(messages, stream):
+        return AssistantMessage(content="fast")
+
+    backend = hedged_backend(monkeypatch, slow, fast)
+    start = time.monotonic()
+    result = await backend._chat_completion_request([UserMessage("hi")], stream=False)
+    assert isinstance(result, AssistantMessage) and result.content == "fast"
+    assert time.monotonic() - start < 1
+    # The slow provider was cancelled: its latency is censored, not a sample
+    stats = get_provider_stats(backend.backends[0])
+    assert stats.latency is not None and stats.latency >= 0.05
+    assert len(stats.samples) == 0
+    assert len(get_provider_stats(backend.backends[1]).samples) == 1
+
+
+@pytest.mark.asyncio
+async def test_failover(monkeypatch: pytest.MonkeyPatch):
+    async def failing(messages, stream):
+        raise RuntimeError("unavailable")
+
+    async def working(messages, stream):
+        return AssistantMessage(content="ok")
+
+    backend = hedged_backend(monkeypatch, failing, working)
+    result = await backend._chat_completion_request([UserMessage("hi")], stream=False)
+    assert isinstance(result, AssistantMessage) and result.content == "ok"
+    assert get_provider_stats(backend.backends[0]).error_rate > 0
+    assert get_provider_stats(backend.backends[1]).error_rate == 0
+    # The failing provider is ranked last
+    ranked = backend._HedgedBackend__rank()  # type: ignore
+    assert ranked[0] is backend.backends[1]
+
+
+@pytest.mark.asyncio
+async def test_loser_is_closed(monkeypatch: pytest.MonkeyPatch):
+    streams = [FakeStream(first_chunk_delay=10), FakeStream(first_chunk_delay=0)]
+
+    async def slow(messages, stream):
+        return streams[0]
+
+    async def fast(messages, stream):
+        return streams[1]
+
+    backend = hedged_backend(monkeypatch, slow, fast)
+    result = await backend._chat_completion_request([UserMessage("hi")], stream=True)
+    assert result is streams[1]
+    assert streams[0].closed
+    assert not streams[1].closed
@@ -0,0 +1,274 @@
+from agentia import AssistantMessage, Message, SystemMessage, ToolMessage, UserMessage
+from agentia import ToolCall
+from agentia.history import History
+from agentia.llm.compaction import SUMMARY_PREFIX, is_summary
+from agentia.blobs import BlobStore
+from agentia.message import ContentPartImage, ContentPartText, FunctionCall
+from agentia.offload import OFFLOADED_PREFIX, OffloadStore, ToolResultAging
+from agentia.session_store import JsonlSessionStore, SessionStore, SqliteSessionStore
+from pathlib import Path
+import base64
+import gc
+import pytest
+import tempfile
+
+
+def test_context_is_sent_last():
+    history = History(instructions="You are a helpful assistant.")
+    history.set_context("files", "FILES: a.txt")
+    history.add(UserMessage("Hello"))
+    messages = history.get_for_inference()
+    assert messages[0].content == "You are a helpful assistant."
+    assert isinstance(messages[-1], SystemMessage)
+    assert messages[-1].content == "FILES: a.txt"
+    history.set_context("files", None)
+    assert len(history.get_for_inference()) == 2
+
+
+def test_prefix_stability():
+    history = History(instructions="You are a helpful assistant.")
+    history.add(UserMessage("Hello"))
+    history.get_for_inference()
+    history.add(AssistantMessage("Hi! How can I help you today?"))
+    history.add(UserMessage("Tell me a joke"))
+    history.get_for_inference()
+    assert history.prefix_stability is not None
+    assert 0 < history.prefix_stability < 1
+
+
+def test_trim_whole_turns():
+    history = History(instructions=None, token_limit=200, trim_ratio=0.5)
+    for i in range(10):
+        history.add(UserMessage(f"Question {i} " + "word " * 10))
+        history.add(AssistantMessage(f"Answer {i} " + "word " * 10))
+    messages = history.get_for_inference()
+    assert isinstance(messages[0], UserMessage)
+    assert sum(history.count_tokens(m) for m in messages) <= 100
+    # The trimmed prefix stays stable until the limit is exceeded again
+    history.add(UserMessage("One more question"))
+    assert history.get_for_inference()[0] is messages[0]
+
+
+@pytest.mark.asyncio
+async def test_compaction():
+    spans: list[list[Message]] = []
+
+    async def summarize(messages: list[Message]):
+        spans.append(messages)
+        return SystemMessage(SUMMARY_PREFIX + "The user asked some questions.")
+
+    history = History(instructions="You are a helpful assistant.")
+    history.enable_compaction(summarize, threshold=100, keep_ratio=0.5)
+    for i in range(5):
+        history.add(UserMessage(f"Question {i} " + "word " * 10))
+        history.add(
+            AssistantMessage(
+                tool_calls=[
+                    ToolCall(
+                        id=f"call_{i}",
+                        function=FunctionCall(name="search", arguments={"q": i}),
+                        type="function",
+                    )
+                ]
+            )
+        )
+        history.add(ToolMessage("result " * 10, tool_call_id=f"call_{i}"))
+        history.add(AssistantMessage(f"Answer {i} " + "word " * 10))
+        await history.wait_for_compaction()
+    assert len(spans) > 0
+    # Only whole turns are summarized
+    assert all(isinstance(s[0], (UserMessage, SystemMessage)) for s in spans)
+    assert all(isinstance(s[-1], AssistantMessage) for s in spans)
+    messages = history.get_messages()
+    assert messages[0].content == "You are a helpful assistant."
+    assert is_summary(messages[1])
+    assert isinstance(messages[2], UserMessage)
+
+
+def test_tool_result_aging():
+    store = OffloadStore()
+    history = History(instructions=None)
+    history.enable_tool_result_aging(store, ToolResultAging(max_age=1, head_chars=10))
+    payload = "x" * 5000
+    for i in range(3):
+        history.add(UserMessage(f"Question {i}"))
+        history.add(ToolMessage(payload, tool_call_id=f"call_{i}"))
+    tool_messages = [m for m in history.get_messages() if isinstance(m, ToolMessage)]
+    # Tool results of the current and the previous turn are kept
+    assert [m.content == payload for m in tool_messages] == [False, True, True]
+    assert tool_messages[0].content.startswith(OFFLOADED_PREFIX)
+    assert tool_messages[0].tool_call_id == "call_0"
+    ref = tool_messages[0].content.split("ref=")[1].split(".")[0]
+    assert store.get(ref) == payload
+
+
+@pytest.mark.parametrize("backend", ["jsonl", "sqlite"])
+def test_session_store_resume(backend: str):
+    with tempfile.TemporaryDirectory() as dir:
+        if backend == "jsonl":
+            store: SessionStore = JsonlSessionStore(Path(dir), compact_ratio=1.5)
+        else:
+            store = SqliteSessionStore(Path(dir) / "sessions.db")
+        history = History(instructions="You are a helpful assistant.")
+        history.attach_store(store, "s1")
+        for i in range(20):
+            history.add(UserMessage(f"Question {i} " + "word " * 10))
+            history.add(AssistantMessage(f"Answer {i} " + "word " * 10))
+        history.reset()
+        for i in range(20):
+            history.add(UserMessage(f"Question {i} " + "word " * 10))
+            history.add(AssistantMessage(f"Answer {i} " + "word " * 10))
+        expected = history.get_raw_messages()
+        # Only the instructions and the recent turns are loaded on resume
+        resumed = History(instructions=None, token_limit=50)
+        resumed.attach_store(store, "s1")
+        messages = resumed.get_for_inference()
+        assert messages[0].content == "You are a helpful assistant."
+        assert isinstance(messages[1], UserMessage)
+        assert messages[-1].content == expected[-1]["content"]
+        assert len(messages) < len(expected)
+        resumed.add(UserMessage("One more question"))
+        assert resumed.get_raw_messages() == expected + [
+            UserMessage("One more question").to_json()
+        ]
+        # Reopen the store to replay the log from disk
+        if backend == "jsonl":
+            store = JsonlSessionStore(Path(dir))
+        else:
+            store = SqliteSessionStore(Path(dir) / "sessions.db")
+        assert len(store.read("s1")) == len(expected) + 1
+
+
+def test_jsonl_store_torn_line(tmp_path: Path):
+    store = JsonlSessionStore(tmp_path)
+    store.write("s1", 0, UserMessage("first").to_json())
+    store.write("s1", 1, AssistantMessage("second").to_json())
+    # The process crashed while appending a record
+    with open(tmp_path / "s1.jsonl", "ab") as f:
+        f.write(b'{"i": 2, "m": {"role": "us')
+    store = JsonlSessionStore(tmp_path)
+    assert store.length("s1") == 2
+    store.write("s1", 2, UserMessage("third").to_json())
+    store = JsonlSessionStore(tmp_path)
+    assert [m["content"] for m in store.read("s1")] == ["first", "second", "third"]
+
+
+def test_jsonl_store_rejects_unsafe_session_ids(tmp_path: Path):
+    store = JsonlSessionStore(tmp_path / "sessions")
+    for session in ["../../x", "/tmp/x", "a/b", "..", ".hidden", ""]:
+        with pytest.raises(ValueError):
+            store.write(session, 0, UserMessage("hi").to_json())
+        with pytest.raises(ValueError):
+            store.delete(session)
+    assert not (tmp_path / "x.jsonl").exists()
+    store.write("agent-2024-01-01-000000-abc_1.2", 0, UserMessage("hi").to_json())
+    assert store.length("agent-2024-01-01-000000-abc_1.2") == 1
+
+
+def test_blob_store_keeps_referenced_blobs(tmp_path: Path):
+    store = BlobStore(tmp_path / "blobs", max_bytes=3000)
+    history = History(instructions=None)
+    history.enable_blob_store(store)
+    data_url = "data:image/png;base64," + base64.b64encode(b"a" * 2000).decode()
+    history.add(UserMessage([ContentPartImage(data_url)]))
+    m = history.get_messages()[0]
+    assert isinstance(m, UserMessage) and not isinstance(m.content, str)
+    assert isinstance(m.content[0], ContentPartImage)
+    url = m.content[0].url
+    # Unreferenced blobs are evicted first
+    other = store.put(b"b" * 2000, "image/png")
+    store.put(b"c" * 2000, "image/png")
+    assert history.materialize_url(url) == data_url
+    assert store.materialize(other) is None
+    # Released once the history no longer references it
+    history.reset()
+    store.put(b"d" * 2000, "image/png")
+    assert history.materialize_url(url) is None
+
+
+def test_new_session_releases_blobs(tmp_path: Path):
+    store = BlobStore(tmp_path / "blobs", max_bytes=3000)
+    history = History(instructions=None)
+    history.enable_blob_store(store)
+    session = history.new_session()
+    data_url = "data:image/png;base64," + base64.b64encode(b"a" * 2000).decode()
+    session.add(UserMessage([ContentPartImage(data_url)]))
+    m = session.get_messages()[0]
+    assert isinstance(m, UserMessage) and not isinstance(m.content, str)
+    assert isinstance(m.content[0], ContentPartImage)
+    url = m.content[0].url
+    # Released once the session is dropped
+    del session, m
+    gc.collect()
+    store.put(b"b" * 2000, "image/png")
+    assert store.materialize(url) is None
+
+
+def test_blob_store():
+    store = BlobStore()
+    history = History(instructions=None)
+    history.enable_blob_store(store, drop_images_after=1)
+    data_url = "data:image/png;base64," + base64.b64encode(b"\x89PNG" * 1000).decode()
+    history.add(
+        UserMessage([ContentPartText("What is this?"), ContentPartImage(data_url)])
+    )
+    m = history.get_messages()[0]
+    assert isinstance(m, UserMessage) and not isinstance(m.content, str)
+    part = m.content[1]
+    assert isinstance(part, ContentPartImage) and part.url.startswith("blob:")
+    assert history.materialize_url(part.url) == data_url
+    history.add(AssistantMessage("A PNG image."))
+    history.add(UserMessage("Are you sure?"))
+    history.add(UserMessage("Really?"))
+    m = history.get_messages()[0]
+    assert isinstance(m, UserMessage) and not isinstance(m.content, str)
+    assert isinstance(m.content[1], ContentPartText)
+
+
+def test_new_session():
+    history = History(instructions="You are a helpful assistant.")
+    history.set_context("files", "FILES: a.txt")
+    history.add(UserMessage("Hello"))
+    session = history.new_session(token_limit=1000)
+    assert session.token_limit == 1000
+    assert [m.content for m in session.get_for_inference()] == [
+        "You are a helpful assistant.",
+        "FILES: a.txt",
+    ]
+    for i in range(5):
+        session.add(UserMessage(f"Job {i}"))
+        session.add(AssistantMessage(f"Done {i}"))
+    session.keep_last_turns(2)
+    assert [m.content for m in session.get_messages()] == [
+        "You are a helpful assistant.",
+        "Job 3",
+        "Done 3",
+        "Job 4",
+        "Done 4",
+    ]
+    # The original history is not affected
+    assert len(history.get_messages()) == 2
+
+
+@pytest.mark.asyncio
+async def test_offloaded_tool_results_survive_resume(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+):
+    from agentia import Agent
+
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.chdir(tmp_path)
+    store = JsonlSessionStore(tmp_path / "sessions")
+    with Agent(model="openai:gpt-4o-mini", tool_result_aging=True) as agent:
+        agent.attach_session_store(store, "s1")
+        offload: OffloadStore = agent._Agent__offload_store  # type: ignore
+        ref = offload.put("x" * 5000)
+    # The session folder of the first process is gone
+    agent = Agent(model="openai:gpt-4o-mini", tool_result_aging=True)
+    agent.attach_session_store(store, "s1")
+    result = await agent.tools.call_function_raw("_get_tool_result", {"ref": ref}, None)
+    assert result == "x" * 5000
+    agent.delete_session()
+    assert store.length("s1") == 0
+    result = await agent.tools.call_function_raw("_get_tool_result", {"ref": ref}, None)
+    assert "not found" in result["error"]
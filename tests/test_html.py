@@ -0,0 +1,71 @@
+import pytest
+
+from agentia.utils.html import _extract, extract_main_content
+
+PAGE = """
+<html>
+<head><title>The Title</title><script>track()</script><style>p {}</style></head>
+<body>
+<nav><a href="/">Home</a> | <a href="/about">About</a></nav>
+<div class="cookie-banner">We use cookies</div>
+<main>
+<article>
+<header><h1>Heading</h1></header>
+%s
+</article>
+<aside>Related posts</aside>
+</main>
+<footer>Copyright</footer>
+</body>
+</html>
+"""
+
+
+@pytest.mark.asyncio
+async def test_extract_main_content():
+    paragraphs = "".join(f"<p>Paragraph {i} of the article.</p>" for i in range(100))
+    result = await extract_main_content(PAGE % paragraphs, page_tokens=200)
+    assert result.title == "The Title"
+    assert len(result.pages) > 1
+    assert result.pages[0].startswith("# Heading")
+    text = "\n\n".join(result.pages)
+    assert "Paragraph 0 of" in text and "Paragraph 99 of" in text
+    for boilerplate in ["track", "Home", "cookies", "Related", "Copyright"]:
+        assert boilerplate not in text
+    # Plain text is only paginated
+    result = await extract_main_content("a\n\nb", is_html=False)
+    assert result.pages == ["a\n\nb"]
+
+
+def test_extract_keeps_wrappers_of_main_content():
+    html = """
+    <html><body>
+      <div class="site has-sidebar">
+        <nav>Home | About</nav>
+        <main><h1>Title</h1><p>The main content.</p></main>
+        <div class="sidebar">Popular posts</div>
+      </div>
+    </body></html>
+    """
+    content = _extract(html, page_tokens=1000)
+    assert "The main content." in content.pages[0]
+    assert "Popular posts" not in content.pages[0]
+    assert "Home | About" not in content.pages[0]
+
+
+def test_extract_aspnet_form():
+    html = """
+    <html><body>
+      <form id="aspnetForm" method="post" action="./page.aspx">
+        <input type="hidden" name="__VIEWSTATE" value="abc" />
+        <div class="menu">Home | Products</div>
+        <h1>Annual report</h1>
+        <p>Revenue grew by ten percent this year.</p>
+        <form class="search"><input name="q" /><button>Search</button></form>
+      </form>
+    </body></html>
+    """
+    content = _extract(html, page_tokens=1000)
+    assert "Revenue grew by ten percent this year." in content.pages[0]
+    assert "Home | Products" not in content.pages[0]
+    assert "Search" not in content.pages[0]
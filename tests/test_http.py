@@ -0,0 +1,99 @@
+from pathlib import Path
+import httpx
+import pytest
+
+from agentia.utils import http
+from agentia.utils.http import Fetcher
+
+
+@pytest.mark.asyncio
+async def test_fetcher_cache(monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+    requests: list[httpx.Request] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.url.path == "/fresh":
+            return httpx.Response(
+                200, text="fresh", headers={"cache-control": "max-age=60"}
+            )
+        if request.url.path == "/etag":
+            if request.headers.get("if-none-match") == '"v1"':
+                return httpx.Response(304, headers={"etag": '"v1"'})
+            return httpx.Response(
+                200, text="etag", headers={"etag": '"v1"', "cache-control": "no-cache"}
+            )
+        if request.url.path == "/large":
+            return httpx.Response(200, content=b"x" * 100)
+        return httpx.Response(
+            200, text="private", headers={"cache-control": "no-store"}
+        )
+
+    AsyncClient = httpx.AsyncClient
+    monkeypatch.setattr(
+        http.httpx,
+        "AsyncClient",
+        lambda **kwargs: AsyncClient(transport=httpx.MockTransport(handler), **kwargs),
+    )
+    fetcher = Fetcher(cache_path=tmp_path / "http.db", max_bytes=10)
+    # Fresh responses are served from the cache
+    assert (await fetcher.fetch("https://a.com/fresh")).text == "fresh"
+    res = await fetcher.fetch("https://a.com/fresh")
+    assert res.from_cache and res.text == "fresh" and len(requests) == 1
+    # Also across processes
+    other = Fetcher(cache_path=tmp_path / "http.db")
+    assert (await other.fetch("https://a.com/fresh")).from_cache
+    assert len(requests) == 1
+    # Stale responses are revalidated
+    assert (await fetcher.fetch("https://a.com/etag")).text == "etag"
+    res = await fetcher.fetch("https://a.com/etag")
+    assert res.from_cache and res.text == "etag" and len(requests) == 3
+    assert requests[-1].headers["if-none-match"] == '"v1"'
+    # `no-store` responses are not cached
+    await fetcher.fetch("https://a.com/private")
+    assert not (await fetcher.fetch("https://a.com/private")).from_cache
+    # Bodies are capped
+    res = await fetcher.fetch("https://a.com/large")
+    assert res.truncated and len(res.content) == 10
+    # Capping a cached response does not modify the cache
+    res = await fetcher.fetch("https://a.com/fresh", max_bytes=2)
+    assert res.truncated and res.text == "fr"
+    res = await fetcher.fetch("https://a.com/fresh")
+    assert not res.truncated and res.text == "fresh"
+
+
+@pytest.mark.asyncio
+async def test_fetcher_cache_vary_and_size(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+):
+    requests: list[httpx.Request] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        vary = "*" if request.url.path == "/any" else "user-agent"
+        headers = {"cache-control": "max-age=60", "vary": vary}
+        return httpx.Response(200, text=request.url.path, headers=headers)
+
+    AsyncClient = httpx.AsyncClient
+    monkeypatch.setattr(
+        http.httpx,
+        "AsyncClient",
+        lambda **kwargs: AsyncClient(transport=httpx.MockTransport(handler), **kwargs),
+    )
+    fetcher = Fetcher(cache_path=tmp_path / "http.db")
+    # `Vary: *` responses are not cached
+    await fetcher.fetch("https://a.com/any")
+    assert not (await fetcher.fetch("https://a.com/any")).from_cache
+    # Other variants are not served from the cache
+    await fetcher.fetch("https://a.com/ua")
+    assert (await fetcher.fetch("https://a.com/ua")).from_cache
+    monkeypatch.setattr(http, "USER_AGENT", "other")
+    other = Fetcher(cache_path=tmp_path / "http.db")
+    assert not (await other.fetch("https://a.com/ua")).from_cache
+    assert requests[-1].headers["user-agent"] == "other"
+    assert (await other.fetch("https://a.com/ua")).from_cache
+    # The memory tier is bounded by bytes
+    small = Fetcher(max_memory_cache_bytes=5)
+    await small.fetch("https://a.com/ab")
+    await small.fetch("https://a.com/cd")
+    assert (await small.fetch("https://a.com/cd")).from_cache
+    assert not (await small.fetch("https://a.com/ab")).from_cache
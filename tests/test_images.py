@@ -0,0 +1,40 @@
+import base64
+import io
+import pytest
+from agentia import UserMessage
+from agentia.message import ContentPartImage, ContentPartText
+from agentia.utils.images import ImageOptions, preprocess_message_images
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def data_url(width: int, height: int) -> str:
+    out = io.BytesIO()
+    Image.new("RGB", (width, height), color=(255, 0, 0)).save(out, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(out.getvalue()).decode()
+
+
+def decode(url: str):
+    return Image.open(io.BytesIO(base64.b64decode(url.split(",", 1)[1])))
+
+
+@pytest.mark.asyncio
+async def test_downscale():
+    m = UserMessage(
+        [ContentPartText("What is this?"), ContentPartImage(data_url(4000, 3000))]
+    )
+    m = await preprocess_message_images(m, ImageOptions())
+    assert not isinstance(m.content, str)
+    part = m.content[1]
+    assert isinstance(part, ContentPartImage)
+    assert part.url.startswith("data:image/webp;base64,")
+    assert decode(part.url).size == (1024, 768)
+
+
+@pytest.mark.asyncio
+async def test_small_images_are_kept():
+    url = data_url(64, 64)
+    m = await preprocess_message_images(UserMessage([ContentPartImage(url)]))
+    assert not isinstance(m.content, str)
+    part = m.content[0]
+    assert isinstance(part, ContentPartImage) and part.url == url
@@ -0,0 +1,26 @@
+from typing import Any
+
+from agentia.history import History
+from agentia.llm.routing import ModelRouter, RoutingOptions
+from agentia.message import AssistantMessage, ToolMessage, UserMessage
+
+
+def test_routing_rules():
+    fast: Any = None
+    router = ModelRouter(RoutingOptions(fast="openai:gpt-4o-mini"), fast)
+    history = History(instructions=None)
+    assert router.route(history, [UserMessage("Thanks!")]) == "fast"
+    assert router.route(history, [UserMessage("ok, thank you")]) == "fast"
+    assert router.route(history, [UserMessage("Thanks, now fix the bug")]) == "strong"
+    followup = [
+        UserMessage("What's the weather?"),
+        AssistantMessage(content=None),
+        ToolMessage(content="Sunny", tool_call_id="1"),
+    ]
+    assert router.route(history, followup) == "fast"
+    # Large requests always go to the strong tier
+    router.options.max_fast_tokens = 1
+    assert router.route(history, followup) == "strong"
+    # Custom rules come first
+    router.options.rule = lambda r: "fast" if r.tokens > 0 else None
+    assert router.route(history, followup) == "fast"
@@ -0,0 +1,59 @@
+from agentia.utils.singleflight import SingleFlight
+import asyncio
+import threading
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_are_coalesced():
+    group = SingleFlight()
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.1)
+        return calls
+
+    results = await asyncio.gather(*[group.do("key", work) for _ in range(5)])
+    assert results == [1] * 5
+    assert calls == 1
+    # Completed calls are not cached
+    assert await group.do("key", work) == 2
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_does_not_cancel_others():
+    group = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.1)
+        return "done"
+
+    first = asyncio.ensure_future(group.do("key", work))
+    second = asyncio.ensure_future(group.do("key", work))
+    await asyncio.sleep(0.01)
+    first.cancel()
+    assert await second == "done"
+
+
+def test_calls_are_not_shared_across_loops():
+    group = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    async def blocking():
+        started.set()
+        await asyncio.to_thread(release.wait)
+        return "first"
+
+    async def work():
+        return "second"
+
+    thread = threading.Thread(target=lambda: asyncio.run(group.do("key", blocking)))
+    thread.start()
+    started.wait()
+    # The call in flight on the other loop is not awaited from this one
+    assert asyncio.run(group.do("key", work)) == "second"
+    release.set()
+    thread.join()
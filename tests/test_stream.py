@@ -1,4 +1,5 @@
 from agentia import Agent, UserMessage, tool
+from agentia.message import coalesce_deltas
 from typing import Literal, Annotated
 import pytest
 import dotenv
@@ -40,3 +41,14 @@ async def test_function_call():
             all_assistant_content += content
         print(msg)
     assert "72" in all_assistant_content
+
+
+@pytest.mark.asyncio
+async def test_coalesce_deltas():
+    async def deltas():
+        for _ in range(100):
+            yield "ab"
+
+    batches = [b async for b in coalesce_deltas(deltas(), interval=60, max_chars=50)]
+    assert "".join(batches) == "ab" * 100
+    assert len(batches) == 4
@@ -0,0 +1,64 @@
+from agentia import Agent, tool
+from agentia.tools import CACHE_TAG
+from typing import Annotated
+import pytest
+import dotenv
+
+dotenv.load_dotenv()
+
+calls = 0
+
+
+@tool(cache=True)
+def square(x: Annotated[int, "The number to square"], offset: int = 0):
+    """Square a number"""
+    global calls
+    calls += 1
+    return x * x + offset
+
+
+@pytest.mark.asyncio
+async def test_tool_cache(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    agent = Agent(model="openai:gpt-4o-mini", tools=[square])
+    assert await agent.tools.call_function_raw("square", {"x": 3}, None) == 9
+    # Default arguments are normalized
+    assert (
+        await agent.tools.call_function_raw("square", {"x": 3, "offset": 0}, None) == 9
+    )
+    assert await agent.tools.call_function_raw("square", {"x": 4}, None) == 16
+    assert calls == 2
+    stats = agent.tools.get_cache_stats()["square"]
+    assert stats.hits == 1
+    assert stats.misses == 2
+
+
+@tool(cache=True, cache_on_disk=True)
+def lookup(key: str):
+    """Look up a value"""
+    global calls
+    calls += 1
+    if key == "set":
+        return {1, 2}
+    return key.upper()
+
+
+@pytest.mark.asyncio
+async def test_tool_disk_cache(monkeypatch: pytest.MonkeyPatch, tmp_path):
+    global calls
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.chdir(tmp_path)
+    calls = 0
+    agent = Agent(model="openai:gpt-4o-mini", id="cached", tools=[lookup])
+    assert await agent.tools.call_function_raw("lookup", {"key": "a"}, None) == "A"
+    # Results that are not JSON-serializable are only cached in memory
+    assert await agent.tools.call_function_raw("lookup", {"key": "set"}, None) == {
+        1,
+        2,
+    }
+    assert calls == 2
+    # Another process: the memory tier is empty, but the disk tier is shared
+    getattr(lookup, CACHE_TAG).memory.clear()
+    agent = Agent(model="openai:gpt-4o-mini", id="cached", tools=[lookup])
+    assert await agent.tools.call_function_raw("lookup", {"key": "a"}, None) == "A"
+    assert calls == 2
@@ -1,5 +1,5 @@
 from agentia import Agent, UserMessage, tool
-from typing import Literal, Annotated
+from typing import Any, Literal, Annotated
 import pytest
 import dotenv
 
@@ -33,3 +33,37 @@ async def test_function_call():
             all_assistant_content += msg.content or ""
         print(msg)
     assert "72" in all_assistant_content
+
+
+@tool
+def assign(jobs: Annotated[dict[str, str], "Jobs by worker name"]):
+    """Assign jobs to workers"""
+    return sorted(jobs)
+
+
+def test_mapping_parameter(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    agent = Agent(model="openai:gpt-4o-mini", tools=[assign])
+    schema: Any = agent.tools.to_json()[0]
+    assert schema["function"]["parameters"]["properties"]["jobs"] == {
+        "type": "object",
+        "additionalProperties": {"type": "string"},
+        "description": "Jobs by worker name",
+    }
+
+
+@tool
+def fetch_all(urls: Annotated[list[str], "The URLs to fetch"]):
+    """Fetch URLs"""
+    return urls
+
+
+def test_list_parameter(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    agent = Agent(model="openai:gpt-4o-mini", tools=[fetch_all])
+    schema: Any = agent.tools.to_json()[0]
+    assert schema["function"]["parameters"]["properties"]["urls"] == {
+        "type": "array",
+        "items": {"type": "string"},
+        "description": "The URLs to fetch",
+    }
@@ -0,0 +1,48 @@
+from agentia.utils import tracing
+import asyncio
+import json
+import tempfile
+from pathlib import Path
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_nested_spans_chrome_trace():
+    with tempfile.TemporaryDirectory() as dir:
+        path = Path(dir) / "trace.json"
+        tracing.enable(tracing.ChromeTraceExporter(path))
+        try:
+
+            async def child_steps():
+                for i in range(2):
+                    with tracing.start_span("step", index=i):
+                        await asyncio.sleep(0.01)
+                    yield i
+
+            with tracing.start_span("turn") as turn:
+                items = [i async for i in tracing.iterate_in_span(turn, child_steps())]
+                turn.event("done")
+            assert items == [0, 1]
+            assert [c.name for c in turn.children] == ["step", "step"]
+            # The array is left open, so that traces can be appended
+            events = json.loads(path.read_text() + "]")
+            assert [e["name"] for e in events] == ["turn", "done", "step", "step"]
+            with tracing.start_span("turn"):
+                pass
+            events = json.loads(path.read_text() + "]")
+            assert [e["name"] for e in events] == [
+                "turn",
+                "done",
+                "step",
+                "step",
+                "turn",
+            ]
+        finally:
+            tracing.disable()
+
+
+def test_disabled_tracing_is_noop():
+    assert not tracing.is_enabled()
+    with tracing.start_span("turn") as span:
+        assert not span.recording
+        assert tracing.current_span() is None
@@ -13,3 +13,14 @@ async def test_function_call():
     await utils.voice.tts("Hello World!", fp.name)
     text = await utils.voice.stt(fp.name)
     assert "world" in text.lower()
+
+
+@pytest.mark.asyncio
+async def test_split_sentences():
+    async def chunks():
+        for c in ["Hello", " there. This is", " a test! Ok. ", "The end"]:
+            yield c
+
+    sentences = [s async for s in utils.voice.split_sentences(chunks(), min_chars=10)]
+    # The first sentence is never merged, and the later short ones are
+    assert sentences == ["Hello there.", "This is a test!", "Ok. The end"]
@@ -0,0 +1,51 @@
+import asyncio
+from pathlib import Path
+from typing import Any
+import httpx
+import pytest
+
+from agentia import Agent
+from agentia.plugins.web import WebPlugin, _share_budget
+from agentia.utils import http
+
+
+def test_share_budget():
+    assert _share_budget({"a": 10, "b": 1000, "c": 1000}, 1000) == {
+        "a": 10,
+        "b": 495,
+        "c": 495,
+    }
+    assert _share_budget({"a": 10, "b": 20}, 1000) == {"a": 10, "b": 20}
+
+
+@pytest.mark.asyncio
+async def test_get_webpages(monkeypatch: pytest.MonkeyPatch, tmp_path: Path):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.chdir(tmp_path)
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/slow":
+            await asyncio.sleep(10)
+        if request.url.path == "/missing":
+            return httpx.Response(404)
+        paragraphs = "".join(f"<p>{request.url.path} {i}</p>" for i in range(500))
+        html = f"<title>{request.url.path}</title><main>{paragraphs}</main>"
+        return httpx.Response(200, html=html)
+
+    AsyncClient = httpx.AsyncClient
+    monkeypatch.setattr(
+        http.httpx,
+        "AsyncClient",
+        lambda **kwargs: AsyncClient(transport=httpx.MockTransport(handler), **kwargs),
+    )
+    plugin = WebPlugin(config={"batch_max_tokens": 1000, "batch_timeout": 1})
+    agent = Agent(model="openai:gpt-4o-mini", tools=[plugin])
+    await agent.init()
+    urls = [f"https://{host}.com/{path}" for host in "ab" for path in "xy"]
+    urls += ["https://a.com/missing", "https://a.com/slow"]
+    results: Any = await plugin.get_webpages(urls)
+    assert [r["url"] for r in results] == urls
+    for r in results[:4]:
+        assert r["truncated"] and 200 < len(r["content"]) < 1200
+    assert "HTTP 404" in results[4]["error"]
+    assert "Timed out" in results[5]["error"]